@@ -1,12 +1,32 @@
 import sqlite3
-from flask import Flask, render_template, request, redirect, url_for, jsonify, flash, session
+from flask import Flask, render_template, stream_template, make_response, request, redirect, url_for, jsonify, flash, session, g, has_app_context, has_request_context, send_file, stream_with_context
 import datetime
 import os
 import secrets
 from functools import wraps 
+from markupsafe import Markup
 from datetime import date, timedelta 
-import hashlib 
 import math 
+import re
+import json
+import base64
+import time
+import csv
+import io
+import threading
+from collections import OrderedDict
+import random
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor
+import hmac
+import hashlib
+import metrics
+from slow_queries import SlowQueryLog
+from shared_cache import SharedCache
+from jobs import JobRunner, JobError
+from backups import BackupManager
+from process_threads import ProcessThreads, start_daemon
+import reports
 
 app = Flask(__name__)
 @app.template_filter('dateformat')
@@ -23,7 +43,7 @@ def dateformat(value, format='%d/%m/%y'):
         return value
 # Secure configuration
 app.secret_key = os.environ.get('SECRET_KEY', secrets.token_hex(24))
-DB_NAME = "library.db"
+DB_NAME = os.environ.get('LIBRARY_DB', "library.db")
 
 # --- HELPER FUNCTION FOR TRUNCATION ---
 def truncate_text(text, max_length=35):
@@ -38,36 +58,372 @@ LIBRARIAN_PASSWORD = os.environ.get('LIBRARIAN_PASS', 'password')
 # --------------------------------------------------------
 
 # --- Hashing Utilities for Student Authentication ---
-def hash_password(password):
-    """Hashes a password using SHA-256."""
-    return hashlib.sha256(password.encode()).hexdigest()
-
-def check_password(hashed_password, provided_password):
-    """Checks a provided password against a hashed one."""
-    return hashed_password == hash_password(provided_password)
+# Salted scrypt hashes; legacy SHA-256 hashes are upgraded at next login.
+from passwords import hash_password, hash_passwords, check_password, password_needs_rehash
+
+# --- Pooled SQLite Connections ---
+# Connections are long-lived: the PRAGMAs below are applied once when a
+# connection is opened, and each connection keeps its own prepared-statement
+# cache. Inside a request, every `with get_connection()` block shares the
+# same connection, which goes back to the pool when the request ends.
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+STATEMENT_CACHE_SIZE = 256
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    f"PRAGMA synchronous = {os.environ.get('DB_SYNCHRONOUS', 'NORMAL')}",  # FULL pairs well with GROUP_COMMIT
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA cache_size = -16000",      # ~16 MB page cache per connection
+    "PRAGMA mmap_size = 268435456",    # 256 MB memory-mapped I/O
+    "PRAGMA temp_store = MEMORY",
+)
+
+class ConnectionPool:
+    """A thread-safe pool of configured SQLite connections, one pool per process."""
+    def __init__(self, db_name, size=POOL_SIZE):
+        self.db_name = db_name
+        self.size = size
+        self._lock = threading.Lock()
+        self._idle = []
+        self._pid = os.getpid()
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_name, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE, factory=metrics.TimedConnection)
+        conn.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            # Untimed, so a pool miss does not inflate the request's query count.
+            sqlite3.Connection.execute(conn, pragma)
+        attach_archive(conn)
+        return conn
+
+    def _check_fork(self):
+        # Connections must never cross a fork (e.g. gunicorn --preload);
+        # a worker simply forgets whatever it inherited from its parent.
+        if self._pid != os.getpid():
+            self._idle = []
+            self._pid = os.getpid()
+            self.hits = self.misses = self.discarded = 0
+
+    def acquire(self):
+        with self._lock:
+            self._check_fork()
+            if self._idle:
+                self.hits += 1
+                return self._idle.pop()
+            self.misses += 1
+        return self._connect()
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            self._check_fork()
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+            self.discarded += 1
+        conn.close()
+
+    def dispose(self):
+        """Closes every idle connection, e.g. before the server forks workers."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'pid': os.getpid(),
+                'size': self.size,
+                'idle': len(self._idle),
+                'hits': self.hits,
+                'misses': self.misses,
+                'discarded': self.discarded,
+                'hit_ratio': round(self.hits / total, 4) if total else 0.0,
+            }
+
+_pool = ConnectionPool(DB_NAME)
 
 # --- SQLite Context Manager for safe database connections ---
 class SQLiteContext:
-    """A context manager to handle SQLite connections and ensure commits/closes."""
-    def __init__(self, db_name):
-        self.db_name = db_name
+    """A context manager that borrows a pooled connection and commits on success.
+
+    Inside a request the connection is kept on `g` and reused by every block,
+    so only the outermost block commits (or rolls back on error).
+    """
+    def __init__(self, pool):
+        self.pool = pool
         self.conn = None
+        self.owned = False
 
     def __enter__(self):
-        self.conn = sqlite3.connect(self.db_name)
-        self.conn.row_factory = sqlite3.Row
-        self.conn.execute('PRAGMA foreign_keys = ON;')
+        if has_app_context():
+            if 'db_conn' not in g:
+                g.db_conn = self.pool.acquire()
+                g.db_depth = 0
+            g.db_depth += 1
+            self.conn = g.db_conn
+        else:
+            self.conn = self.pool.acquire()
+            self.owned = True
         return self.conn
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if exc_type is None and self.conn:
+        if not self.owned:
+            g.db_depth -= 1
+            if g.db_depth > 0:
+                return False
+        if exc_type is None:
             self.conn.commit()
-        if self.conn:
-            self.conn.close()
+        else:
+            self.conn.rollback()
+        if self.owned:
+            self.pool.release(self.conn)
         return False
 
 def get_connection():
-    return SQLiteContext(DB_NAME)
+    return SQLiteContext(_pool)
+
+@app.teardown_appcontext
+def release_connection(exc):
+    conn = g.pop('db_conn', None)
+    g.pop('db_depth', None)
+    if conn is not None:
+        _pool.release(conn)
+
+# --- Request Metrics ---
+# Every request records its route, status and latency, plus the number of
+# SQL statements it ran and where the SQLite time went, per normalized
+# statement. See metrics.py for how the workers' counters are combined.
+# Statements slower than SLOW_QUERY_MS also go to the slow-query log.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+# Plans are captured with the archive attached, as on the pool's connections
+# (attach_archive is defined further down).
+_slow_queries = SlowQueryLog(DB_NAME, prepare=lambda conn: attach_archive(conn))
+
+def observe_sql(sql, params, seconds):
+    """Charges a finished statement to the current request and the slow-query log."""
+    statement = metrics.normalize_sql(sql)
+    route = (request.endpoint or 'unmatched') if has_request_context() else '(background)'
+    if has_request_context() and 'metrics_started' in g:
+        stats = g.metrics_sql.setdefault(statement, [0, 0.0])
+        stats[0] += 1
+        stats[1] += seconds
+    else:
+        # Background threads, and streamed responses after their request was counted.
+        labels = {'route': route, 'statement': statement}
+        metrics.registry.inc('library_sql_statements_total', labels)
+        metrics.registry.inc('library_sql_statement_seconds_total', labels, seconds)
+    _slow_queries.record(sql, params, seconds, route)
+
+metrics.observer = observe_sql
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_started = time.perf_counter()
+    g.metrics_sql = {}
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return response
+    route = request.endpoint or 'unmatched'
+    registry = metrics.registry
+    registry.inc('library_http_requests_total',
+                 {'route': route, 'method': request.method, 'status': str(response.status_code)})
+    registry.observe('library_http_request_duration_seconds', {'route': route},
+                     time.perf_counter() - started, metrics.LATENCY_BUCKETS)
+    statements = g.pop('metrics_sql', {})
+    registry.observe('library_sql_queries_per_request', {'route': route},
+                     sum(count for count, _ in statements.values()), metrics.QUERY_COUNT_BUCKETS)
+    for statement, (count, seconds) in statements.items():
+        labels = {'route': route, 'statement': statement}
+        registry.inc('library_sql_statements_total', labels, count)
+        registry.inc('library_sql_statement_seconds_total', labels, seconds)
+    metrics.flush()
+    return response
+
+# --- Write Transactions ---
+# Circulation writes run under BEGIN IMMEDIATE so the write lock is taken
+# before anything is read: two workers can never both see a copy as
+# available. busy_timeout covers short waits; if the lock is still held
+# after that, BEGIN is retried with jittered backoff.
+WRITE_RETRIES = 5
+WRITE_RETRY_DELAY = 0.05  # seconds, doubled on each attempt
+
+class CirculationError(Exception):
+    """A rejected issue/return/extend or delete; the message is shown to the librarian."""
+
+def is_busy_error(exc):
+    message = str(exc).lower()
+    return isinstance(exc, sqlite3.OperationalError) and ('locked' in message or 'busy' in message)
+
+def begin_immediate(conn):
+    """Opens a write transaction, backing off while another writer holds the lock."""
+    for attempt in range(WRITE_RETRIES):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            return
+        except sqlite3.OperationalError as e:
+            if not is_busy_error(e) or attempt == WRITE_RETRIES - 1:
+                raise
+        time.sleep(random.uniform(0, WRITE_RETRY_DELAY * 2 ** attempt))
+
+def run_write(work, *args):
+    """Runs work(conn, *args) in an immediate transaction and returns its result.
+
+    Any exception rolls the transaction back. A nested call joins the
+    transaction that is already open instead of starting its own. With
+    group commit enabled the work is handed to the writer thread instead.
+    """
+    with get_connection() as conn:
+        if conn.in_transaction:
+            return work(conn, *args)
+        if _write_queue is not None:
+            return _write_queue.submit(work, *args)
+        begin_immediate(conn)
+        try:
+            result = work(conn, *args)
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+
+def write_statement(sql, params=()):
+    """Runs a single write statement through run_write(); returns its rowcount."""
+    return run_write(lambda conn: conn.execute(sql, params).rowcount)
+
+# --- Group Commit ---
+# Optional (GROUP_COMMIT=1). A single writer thread per process collects
+# write operations from request threads and commits them together: one
+# transaction and one fsync for up to GROUP_COMMIT_MAX_OPS operations, or
+# whatever arrived within GROUP_COMMIT_WINDOW_MS of the first one. Each
+# operation runs in its own savepoint, so a failing operation is rolled
+# back on its own and its caller gets the error; the others still commit.
+GROUP_COMMIT = os.environ.get('GROUP_COMMIT') == '1'
+GROUP_COMMIT_WINDOW_MS = float(os.environ.get('GROUP_COMMIT_WINDOW_MS', 5))
+GROUP_COMMIT_MAX_OPS = int(os.environ.get('GROUP_COMMIT_MAX_OPS', 64))
+
+class WriteQueue:
+    """A single-writer group-commit queue with its own pooled connection."""
+    def __init__(self, pool, window_ms=GROUP_COMMIT_WINDOW_MS, max_ops=GROUP_COMMIT_MAX_OPS):
+        self.pool = pool
+        self.window = window_ms / 1000
+        self.max_ops = max_ops
+        self._lock = threading.Lock()
+        self._writer = ProcessThreads(self._start_writer)
+        self._queue = None
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.batches = 0
+        self.ops = 0
+        self.failed_ops = 0
+        self.max_batch = 0
+        self.batch_sizes = {}
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.commit_total = 0.0
+
+    def _start_writer(self):
+        self._queue = queue.Queue()
+        with self._lock:
+            self._reset_stats()
+        start_daemon(self._run, 'write-queue')
+
+    def submit(self, work, *args):
+        """Queues work(conn, *args) and blocks until its group has committed."""
+        self._writer.ensure()
+        future = Future()
+        self._queue.put((work, args, future, time.perf_counter()))
+        return future.result()
+
+    def _collect(self):
+        items = [self._queue.get()]
+        deadline = time.perf_counter() + self.window
+        while len(items) < self.max_ops:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        conn = self.pool.acquire()
+        while True:
+            self._commit_group(conn, self._collect())
+
+    def _commit_group(self, conn, items):
+        started = time.perf_counter()
+        outcomes = []
+        try:
+            begin_immediate(conn)
+            for work, args, future, queued_at in items:
+                conn.execute("SAVEPOINT queued_write")
+                try:
+                    outcomes.append((future, work(conn, *args), None))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO queued_write")
+                    outcomes.append((future, None, e))
+                conn.execute("RELEASE queued_write")
+            conn.commit()
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            outcomes = [(future, None, e) for _, _, future, _ in items]
+        finished = time.perf_counter()
+
+        with self._lock:
+            size = len(items)
+            bucket = str(1 << (size - 1).bit_length())  # 1, 2, 4, 8, ...
+            self.batches += 1
+            self.ops += size
+            self.failed_ops += sum(1 for _, _, error in outcomes if error is not None)
+            self.max_batch = max(self.max_batch, size)
+            self.batch_sizes[bucket] = self.batch_sizes.get(bucket, 0) + 1
+            for _, _, _, queued_at in items:
+                self.wait_total += started - queued_at
+                self.wait_max = max(self.wait_max, started - queued_at)
+            self.commit_total += finished - started
+
+        # Callers only hear back once their group is durable (or has failed).
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': True,
+                'pid': os.getpid(),
+                'window_ms': self.window * 1000,
+                'max_ops': self.max_ops,
+                'pending': self._queue.qsize() if self._writer.running else 0,
+                'batches': self.batches,
+                'ops': self.ops,
+                'failed_ops': self.failed_ops,
+                'avg_batch': round(self.ops / self.batches, 2) if self.batches else 0.0,
+                'max_batch': self.max_batch,
+                'batch_sizes': self.batch_sizes,
+                'avg_queue_ms': round(self.wait_total * 1000 / self.ops, 3) if self.ops else 0.0,
+                'max_queue_ms': round(self.wait_max * 1000, 3),
+                'avg_commit_ms': round(self.commit_total * 1000 / self.batches, 3) if self.batches else 0.0,
+            }
+
+_write_queue = WriteQueue(_pool) if GROUP_COMMIT else None
 
 def init_db():
     with get_connection() as conn:
@@ -116,18 +472,803 @@ def init_db():
             )
         """)
 
+        # Denormalized borrow counters for the leaderboards and charts
+        added_books = add_column_if_missing(cursor, "books", "borrow_count", "INTEGER NOT NULL DEFAULT 0")
+        added_students = add_column_if_missing(cursor, "students", "borrow_count", "INTEGER NOT NULL DEFAULT 0")
+        create_borrow_count_triggers(cursor)
+        if added_books or added_students:
+            rebuild_borrow_counts(cursor)
+
+        # Shared counters: the pending-approval badge and per-table data versions
+        cursor.execute("""CREATE TABLE IF NOT EXISTS library_stats (
+                            key TEXT PRIMARY KEY,
+                            value INTEGER NOT NULL
+                        )""")
+        create_pending_count_triggers(cursor)
+        cursor.execute("""INSERT OR REPLACE INTO library_stats (key, value)
+                          SELECT 'pending_count', COUNT(id) FROM students_auth WHERE is_approved = 0""")
+        create_data_version_triggers(cursor)
+
+        # Full-text index over the book catalog (external content on books)
+        fts_exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='books_fts'").fetchone()
+        create_books_fts(cursor)
+        if not fts_exists:
+            rebuild_books_fts(cursor)
+
+        apply_index_set(cursor)
+
+# --- Versioned Index Set ---
+# Each entry is (version, CREATE INDEX statement). The applied version is
+# stored in PRAGMA user_version, so a database only runs the entries newer
+# than it has seen. Append new indexes with the next version number; run
+# check_query_plans.py to confirm the queries actually use them.
+SCHEMA_INDEXES = (
+    # v1: keyset pagination on (name, id) and the borrow-count leaderboards
+    (1, "CREATE INDEX IF NOT EXISTS idx_books_name_id ON books(name, id)"),
+    (1, "CREATE INDEX IF NOT EXISTS idx_students_name_id ON students(name, id)"),
+    (1, "CREATE INDEX IF NOT EXISTS idx_books_borrow_count ON books(borrow_count)"),
+    (1, "CREATE INDEX IF NOT EXISTS idx_students_borrow_count ON students(borrow_count)"),
+    # v2: active loans (return_date IS NULL) and per-student / per-book history
+    (2, "CREATE INDEX IF NOT EXISTS idx_transactions_active_due ON transactions(due_date) WHERE return_date IS NULL"),
+    (2, "CREATE INDEX IF NOT EXISTS idx_transactions_active_book ON transactions(book_id, student_id) WHERE return_date IS NULL"),
+    (2, "CREATE INDEX IF NOT EXISTS idx_transactions_student_return ON transactions(student_id, return_date)"),
+    (2, "CREATE INDEX IF NOT EXISTS idx_transactions_book_return ON transactions(book_id, return_date)"),
+    (2, "CREATE INDEX IF NOT EXISTS idx_students_auth_approved ON students_auth(is_approved, admission_no)"),
+    (2, "CREATE INDEX IF NOT EXISTS idx_students_batch ON students(batch)"),
+    (2, "CREATE INDEX IF NOT EXISTS idx_books_available ON books(available)"),
+    # v3: returned loans by age, for archive_transactions()
+    (3, "CREATE INDEX IF NOT EXISTS idx_transactions_returned ON transactions(return_date) WHERE return_date IS NOT NULL"),
+)
+INDEX_SET_VERSION = max(version for version, _ in SCHEMA_INDEXES)
+
+def apply_index_set(cursor):
+    """Creates any indexes newer than the database's recorded index-set version."""
+    current = cursor.execute("PRAGMA user_version").fetchone()[0]
+    if current >= INDEX_SET_VERSION:
+        return
+    for version, ddl in SCHEMA_INDEXES:
+        if version > current:
+            cursor.execute(ddl)
+    cursor.execute(f"PRAGMA user_version = {INDEX_SET_VERSION}")
+
+def add_column_if_missing(cursor, table, column, definition):
+    """Adds a column to an existing table; returns True if it was added."""
+    columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+    if column in columns:
+        return False
+    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return True
+
+# --- Pending Approval Counter ---
+def create_pending_count_triggers(cursor):
+    """Keeps library_stats.pending_count in step with students_auth."""
+    cursor.execute("""CREATE TRIGGER IF NOT EXISTS students_auth_pending_ai AFTER INSERT ON students_auth
+                      WHEN new.is_approved = 0 BEGIN
+                        UPDATE library_stats SET value = value + 1 WHERE key = 'pending_count';
+                    END""")
+    cursor.execute("""CREATE TRIGGER IF NOT EXISTS students_auth_pending_ad AFTER DELETE ON students_auth
+                      WHEN old.is_approved = 0 BEGIN
+                        UPDATE library_stats SET value = value - 1 WHERE key = 'pending_count';
+                    END""")
+    cursor.execute("""CREATE TRIGGER IF NOT EXISTS students_auth_pending_au AFTER UPDATE OF is_approved ON students_auth
+                      WHEN old.is_approved != new.is_approved BEGIN
+                        UPDATE library_stats SET value = value + (new.is_approved = 0) - (old.is_approved = 0)
+                        WHERE key = 'pending_count';
+                    END""")
+
+# --- Borrow Counters ---
+def create_borrow_count_triggers(cursor):
+    """Keeps books.borrow_count and students.borrow_count exact as loans change."""
+    cursor.execute("""CREATE TRIGGER IF NOT EXISTS transactions_count_ai AFTER INSERT ON transactions BEGIN
+                        UPDATE books SET borrow_count = borrow_count + 1 WHERE id = new.book_id;
+                        UPDATE students SET borrow_count = borrow_count + 1 WHERE id = new.student_id;
+                    END""")
+    cursor.execute("""CREATE TRIGGER IF NOT EXISTS transactions_count_ad AFTER DELETE ON transactions BEGIN
+                        UPDATE books SET borrow_count = borrow_count - 1 WHERE id = old.book_id;
+                        UPDATE students SET borrow_count = borrow_count - 1 WHERE id = old.student_id;
+                    END""")
+    cursor.execute("""CREATE TRIGGER IF NOT EXISTS transactions_count_au AFTER UPDATE OF book_id, student_id ON transactions BEGIN
+                        UPDATE books SET borrow_count = borrow_count - 1 WHERE id = old.book_id;
+                        UPDATE books SET borrow_count = borrow_count + 1 WHERE id = new.book_id;
+                        UPDATE students SET borrow_count = borrow_count - 1 WHERE id = old.student_id;
+                        UPDATE students SET borrow_count = borrow_count + 1 WHERE id = new.student_id;
+                    END""")
+
+# Archived loans still count, so both sides of all_transactions are counted.
+BORROW_COUNT_DRIFT_SQL = {
+    'books': """SELECT * FROM (
+                    SELECT b.id, b.name, b.borrow_count AS stored,
+                           (SELECT COUNT(*) FROM main.transactions t WHERE t.book_id = b.id)
+                           + (SELECT COUNT(*) FROM archive.transactions_archive a WHERE a.book_id = b.id) AS actual
+                    FROM books b)
+                WHERE stored != actual""",
+    'students': """SELECT * FROM (
+                       SELECT s.id, s.name, s.borrow_count AS stored,
+                              (SELECT COUNT(*) FROM main.transactions t WHERE t.student_id = s.id)
+                              + (SELECT COUNT(*) FROM archive.transactions_archive a WHERE a.student_id = s.id) AS actual
+                       FROM students s)
+                   WHERE stored != actual""",
+}
+
+def verify_borrow_counts(cursor):
+    """Returns {'books': [...], 'students': [...]} rows whose stored counter has drifted."""
+    return {table: cursor.execute(sql).fetchall() for table, sql in BORROW_COUNT_DRIFT_SQL.items()}
+
+def rebuild_borrow_counts(cursor):
+    """Recomputes every borrow counter from the live and archived transactions."""
+    cursor.execute("""UPDATE books SET borrow_count = (SELECT COUNT(*) FROM main.transactions t WHERE t.book_id = books.id)
+                      + (SELECT COUNT(*) FROM archive.transactions_archive a WHERE a.book_id = books.id)""")
+    cursor.execute("""UPDATE students SET borrow_count = (SELECT COUNT(*) FROM main.transactions t WHERE t.student_id = students.id)
+                      + (SELECT COUNT(*) FROM archive.transactions_archive a WHERE a.student_id = students.id)""")
+
+# --- Transaction Archive ---
+# Returned loans older than ARCHIVE_AFTER_DAYS are moved out of
+# transactions into transactions_archive, in a side database ATTACHed to
+# every connection as `archive`. The live table then holds little more
+# than the active loans, which is all the circulation desk, the dashboards
+# and the overdue checks read. History pages read the all_transactions
+# view, a UNION ALL of both tables; SQLite pushes their filters, joins and
+# ORDER BY id into each side, so it pages as cheaply as one table would.
+ARCHIVE_DB = os.environ.get('ARCHIVE_DB') or os.path.splitext(DB_NAME)[0] + '_archive.db'
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 365))
+ARCHIVE_BATCH_SIZE = 2000
+TRANSACTION_COLUMNS = "id, book_id, student_id, issue_date, due_date, return_date"
+
+def attach_archive(conn):
+    """Attaches the archive database and creates the all_transactions view on this connection."""
+    execute = sqlite3.Connection.execute  # untimed, like the connection PRAGMAs
+    execute(conn, "ATTACH DATABASE ? AS archive", (ARCHIVE_DB,))
+    execute(conn, "PRAGMA archive.journal_mode = WAL")
+    execute(conn, """CREATE TABLE IF NOT EXISTS archive.transactions_archive (
+                        id INTEGER PRIMARY KEY,
+                        book_id INTEGER,
+                        student_id INTEGER,
+                        issue_date TEXT NOT NULL,
+                        due_date TEXT NOT NULL,
+                        return_date TEXT NOT NULL,
+                        archived_at TEXT NOT NULL
+                    )""")
+    execute(conn, "CREATE INDEX IF NOT EXISTS archive.idx_archive_student_return ON transactions_archive(student_id, return_date)")
+    execute(conn, "CREATE INDEX IF NOT EXISTS archive.idx_archive_book_return ON transactions_archive(book_id, return_date)")
+    execute(conn, f"""CREATE TEMP VIEW IF NOT EXISTS all_transactions AS
+                       SELECT {TRANSACTION_COLUMNS} FROM main.transactions
+                       UNION ALL
+                       SELECT {TRANSACTION_COLUMNS} FROM archive.transactions_archive""")
+
+def archive_batch(conn, ids):
+    """Deletes archived loans from the live table without changing any borrow count."""
+    # Only rows whose copy is safely in the archive.
+    rows = conn.execute("""SELECT t.id, t.book_id, t.student_id FROM main.transactions t
+                           JOIN archive.transactions_archive a ON a.id = t.id
+                           WHERE t.id IN (SELECT value FROM json_each(?))""", (json.dumps(ids),)).fetchall()
+    conn.execute("DELETE FROM main.transactions WHERE id IN (SELECT value FROM json_each(?))",
+                 (json.dumps([row['id'] for row in rows]),))
+    # The delete trigger took one off each counter; an archived loan still counts.
+    for table, column in (('books', 'book_id'), ('students', 'student_id')):
+        counts = {}
+        for row in rows:
+            if row[column] is not None:
+                counts[row[column]] = counts.get(row[column], 0) + 1
+        conn.executemany(f"UPDATE {table} SET borrow_count = borrow_count + ? WHERE id = ?",
+                         [(count, key) for key, count in counts.items()])
+    return len(rows)
+
+def archive_transactions(older_than_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE, progress=None):
+    """Moves returned loans older than the cutoff into the archive; returns how many moved.
+
+    Works in batches, each copied in one transaction and removed from the
+    live table in the next, so the live table is only locked briefly and a
+    run that is stopped can simply be started again. Each batch is copied
+    before it is deleted (SQLite does not commit two WAL databases
+    atomically); a batch interrupted in between is finished by the next run.
+    progress(moved, total) is called after every batch.
+    """
+    cutoff = (date.today() - timedelta(days=older_than_days)).isoformat()
+    candidates = "FROM main.transactions WHERE return_date IS NOT NULL AND return_date < ?"
+    with get_connection() as conn:
+        total = conn.execute(f"SELECT COUNT(*) {candidates}", (cutoff,)).fetchone()[0]
+    moved = 0
+    if progress:
+        progress(moved, total)
+    while True:
+        with get_connection() as conn:
+            ids = [row[0] for row in conn.execute(f"SELECT id {candidates} ORDER BY return_date, id LIMIT ?", (cutoff, batch_size))]
+        if not ids:
+            return moved
+        run_write(lambda conn: conn.execute(f"""INSERT OR REPLACE INTO archive.transactions_archive ({TRANSACTION_COLUMNS}, archived_at)
+                                                SELECT {TRANSACTION_COLUMNS}, datetime('now') FROM main.transactions
+                                                WHERE id IN (SELECT value FROM json_each(?))""", (json.dumps(ids),)))
+        moved += run_write(archive_batch, ids)
+        if progress:
+            progress(moved, total)
+
+# --- Data Versions ---
+# Every insert, update or delete on these tables bumps 'version:<table>' and
+# stamps 'modified:<table>' (unix time) in library_stats, whoever does the
+# write: routes, import scripts or the sqlite3 shell. Conditional GETs
+# compare them instead of re-running their queries.
+VERSIONED_TABLES = ('books', 'students', 'students_auth', 'transactions')
+
+def create_data_version_triggers(cursor):
+    """Creates the change-counter rows and triggers for VERSIONED_TABLES."""
+    for table in VERSIONED_TABLES:
+        cursor.execute("INSERT OR IGNORE INTO library_stats (key, value) VALUES (?, 0), (?, CAST(strftime('%s', 'now') AS INTEGER))",
+                       (f'version:{table}', f'modified:{table}'))
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()} AFTER {event} ON {table} BEGIN
+                                UPDATE library_stats
+                                SET value = CASE key WHEN 'version:{table}' THEN value + 1
+                                                     ELSE CAST(strftime('%s', 'now') AS INTEGER) END
+                                WHERE key IN ('version:{table}', 'modified:{table}');
+                            END""")
+
+def data_versions(conn, tables=VERSIONED_TABLES):
+    """Returns ({table: version}, last modified unix time) for the given tables."""
+    keys = [f'{kind}:{table}' for table in tables for kind in ('version', 'modified')]
+    rows = dict(conn.execute(f"SELECT key, value FROM library_stats WHERE key IN ({', '.join('?' * len(keys))})",
+                             keys).fetchall())
+    versions = {table: rows.get(f'version:{table}', 0) for table in tables}
+    return versions, max((rows.get(f'modified:{table}', 0) for table in tables), default=0)
+
+# --- Circulation Rollups ---
+# The reports page reads daily and monthly rollups kept in a side database
+# (reports.py). Triggers log the id of every loan issued, returned or
+# extended to transaction_changes, and each refresh folds the loans logged
+# since its watermark into the rollups. The log and its triggers are
+# created by the first build, so a library that never opens the reports
+# does not keep one. Once built, a background thread in each worker folds
+# the log in and trims it, so no request waits on the refresh.
+REPORTS_DB = os.environ.get('REPORTS_DB') or os.path.splitext(DB_NAME)[0] + '_reports.db'
+ROLLUP_REFRESH_SECONDS = float(os.environ.get('ROLLUP_REFRESH_SECONDS', 30))
+
+def create_rollup_change_log(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS transaction_changes (
+                        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                        loan_id INTEGER NOT NULL
+                    )""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS transactions_rollup_insert AFTER INSERT ON transactions BEGIN
+                        INSERT INTO transaction_changes (loan_id) VALUES (new.id);
+                    END""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS transactions_rollup_update
+                    AFTER UPDATE OF issue_date, due_date, return_date ON transactions BEGIN
+                        INSERT INTO transaction_changes (loan_id) VALUES (new.id);
+                    END""")
+
+def refresh_rollups(rebuild=False, progress=None, timeout=5):
+    """Folds recent loans into the rollups, building them first if needed.
+
+    Returns the number of loans folded in, or None after a full build.
+    """
+    rebuild = rebuild or not reports.status(REPORTS_DB)['built']
+    if rebuild:
+        run_write(create_rollup_change_log)
+    # A connection of its own: the refresh reads in one transaction of its own.
+    conn = _pool.acquire()
+    try:
+        if rebuild:
+            changed, watermark = None, reports.rebuild(conn, REPORTS_DB, progress)
+        else:
+            changed, watermark = reports.apply_changes(conn, REPORTS_DB, timeout)
+        consumed = conn.execute("SELECT 1 FROM transaction_changes WHERE seq <= ? LIMIT 1", (watermark,)).fetchone()
+    finally:
+        _pool.release(conn)
+    # Everything up to the watermark is in the rollups now; a trim missed
+    # last time (a busy database) is caught up here too.
+    if consumed:
+        run_write(lambda conn: conn.execute("DELETE FROM transaction_changes WHERE seq <= ?", (watermark,)))
+    return changed
+
+_rollup_refresh = {'at': 0.0, 'built': False, 'lock': threading.Lock()}
+
+def fresh_rollups():
+    """Refreshes the rollups at most every ROLLUP_REFRESH_SECONDS; False if never built.
+
+    Never raises: a failed refresh is logged and the rollups are served as
+    they are, so nothing that calls this depends on the reports working.
+    """
+    state = _rollup_refresh
+    if state['built'] and time.monotonic() - state['at'] < ROLLUP_REFRESH_SECONDS:
+        return True
+    if not state['lock'].acquire(blocking=False):
+        return state['built']
+    try:
+        state['at'] = time.monotonic()
+        status = reports.status(REPORTS_DB)
+        state['built'] = status['built']
+        # Any worker's refresh counts, so the workers do not take turns redoing it.
+        if state['built'] and time.time() - (status['refreshed_at'] or 0) >= ROLLUP_REFRESH_SECONDS:
+            refresh_rollups(timeout=0.5)
+    except sqlite3.OperationalError:
+        pass  # another worker holds the rollups
+    except Exception:
+        app.logger.exception("Refreshing the report rollups failed; serving them as they are.")
+    finally:
+        state['lock'].release()
+    return state['built']
+
+def refresh_rollups_forever():
+    while True:
+        time.sleep(ROLLUP_REFRESH_SECONDS)
+        fresh_rollups()
+
+_rollup_refresher = ProcessThreads(lambda: start_daemon(refresh_rollups_forever, 'rollup-refresh'))
+
+@app.before_request
+def start_rollup_refresher():
+    if ROLLUP_REFRESH_SECONDS > 0 and not _rollup_refresher.running:
+        _rollup_refresher.ensure()
+
+# --- Full-Text Search for Books ---
+def create_books_fts(cursor):
+    """Creates the FTS5 index on books and the triggers that keep it in sync."""
+    cursor.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+                        name, author, custom_id,
+                        content='books', content_rowid='id',
+                        tokenize='unicode61 remove_diacritics 2'
+                    )""")
+    cursor.execute("""CREATE TRIGGER IF NOT EXISTS books_fts_ai AFTER INSERT ON books BEGIN
+                        INSERT INTO books_fts(rowid, name, author, custom_id)
+                        VALUES (new.id, new.name, new.author, new.custom_id);
+                    END""")
+    cursor.execute("""CREATE TRIGGER IF NOT EXISTS books_fts_ad AFTER DELETE ON books BEGIN
+                        INSERT INTO books_fts(books_fts, rowid, name, author, custom_id)
+                        VALUES ('delete', old.id, old.name, old.author, old.custom_id);
+                    END""")
+    # Only re-index when a searchable column changes, not on every available flip.
+    cursor.execute("""CREATE TRIGGER IF NOT EXISTS books_fts_au AFTER UPDATE OF name, author, custom_id ON books BEGIN
+                        INSERT INTO books_fts(books_fts, rowid, name, author, custom_id)
+                        VALUES ('delete', old.id, old.name, old.author, old.custom_id);
+                        INSERT INTO books_fts(rowid, name, author, custom_id)
+                        VALUES (new.id, new.name, new.author, new.custom_id);
+                    END""")
+
+def rebuild_books_fts(cursor):
+    """Re-indexes the whole catalog from the books table."""
+    cursor.execute("INSERT INTO books_fts(books_fts) VALUES ('rebuild')")
+
+def build_fts_query(text):
+    """Turns free text into an FTS5 MATCH expression of prefix terms.
+
+    Each word becomes a quoted prefix term, so "harry pot" matches
+    "Harry Potter". Returns None if the text has no searchable words.
+    """
+    terms = re.findall(r'\w+', text or '')
+    if not terms:
+        return None
+    return " ".join(f'"{term}"*' for term in terms)
+
 # Initialize the database structures
 init_db()
+# Don't let forked gunicorn workers inherit the connection used above.
+_pool.dispose()
+
+# --- Pending Approval Count ---
+# The count lives in library_stats, kept exact by triggers on students_auth,
+# so every worker reads the same value. Each worker also remembers it for a
+# few seconds; routes that change approvals drop that local copy at once.
+PENDING_COUNT_TTL = 5  # seconds
+_pending_count_memo = {'value': None, 'at': 0.0}
+
+def get_pending_count():
+    memo = _pending_count_memo
+    now = time.monotonic()
+    if memo['value'] is not None and now - memo['at'] < PENDING_COUNT_TTL:
+        return memo['value']
+    with get_connection() as conn:
+        row = conn.execute("SELECT value FROM library_stats WHERE key = 'pending_count'").fetchone()
+    memo['value'], memo['at'] = (row[0] if row else 0), now
+    return memo['value']
+
+def invalidate_pending_count():
+    _pending_count_memo['value'] = None
 
-# --- Context Processor for Pending Count ---
 @app.context_processor
 def inject_pending_count():
-    with get_connection() as conn:
-        try:
-            count = conn.execute("SELECT COUNT(id) FROM students_auth WHERE is_approved = 0").fetchone()[0]
-            return dict(pending_count=count)
-        except:
-            return dict(pending_count=0)
+    """Injects the count of pending student approvals into librarian templates."""
+    if not session.get('logged_in'):
+        return dict(pending_count=0)
+    try:
+        return dict(pending_count=get_pending_count())
+    except sqlite3.Error:
+        return dict(pending_count=0)
+
+# --- Lookup Caches ---
+# The issue/return forms look up books and students on every keystroke.
+# Each worker keeps a small LRU of recent answers (misses included), which
+# the routes that change books or students invalidate explicitly. Other
+# workers are not told, so entries also expire after LOOKUP_CACHE_TTL;
+# the issue/return transactions themselves always re-read the database.
+LOOKUP_CACHE_SIZE = 2048
+LOOKUP_CACHE_TTL = 30  # seconds
+
+class LRUCache:
+    """A thread-safe LRU mapping whose entries also expire after a TTL."""
+    def __init__(self, maxsize=LOOKUP_CACHE_SIZE, ttl=LOOKUP_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now - entry[1] >= self.ttl:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def discard(self, keys=(), where=None):
+        """Drops the given keys, plus every entry whose value matches where(value)."""
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+            if where is not None:
+                for key in [k for k, (value, _) in self._entries.items() if where(value)]:
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+_book_lookups = LRUCache()
+_student_lookups = LRUCache()
+_NOT_CACHED = object()
+
+def book_lookup_key(book_input):
+    return str(book_input).strip().upper()
+
+def is_book_id(value):
+    """True for a plain database id; str.isdigit() alone also accepts digits like '²' that int() rejects."""
+    return value.isascii() and value.isdigit()
+
+def resolve_books(conn, book_inputs):
+    """Maps each scanned book id (custom id or database id) to its books row, or None."""
+    rows = conn.execute("""SELECT id, custom_id, name, available FROM books
+                           WHERE custom_id IN (SELECT upper(value) FROM json_each(?))
+                              OR id IN (SELECT value FROM json_each(?))""",
+                        (json.dumps(book_inputs), json.dumps([int(v) for v in book_inputs if is_book_id(v)]))).fetchall()
+    by_custom_id = {row['custom_id']: row for row in rows if row['custom_id']}
+    by_id = {row['id']: row for row in rows}
+    # Keyed by number, so '01' finds book 1 as the plain id = ? lookup did.
+    return {value: by_custom_id.get(value.upper()) or (by_id.get(int(value)) if is_book_id(value) else None)
+            for value in book_inputs}
+
+def lookup_books(book_inputs):
+    """Maps each book id (custom id or database id) to a summary dict, or None if unknown."""
+    found, missing = {}, []
+    for value in book_inputs:
+        cached = _book_lookups.get(book_lookup_key(value), _NOT_CACHED)
+        if cached is _NOT_CACHED:
+            missing.append(value)
+        else:
+            found[value] = cached
+    if missing:
+        with get_connection() as conn:
+            rows = resolve_books(conn, [book_lookup_key(value) for value in missing])
+        for value in missing:
+            row = rows[book_lookup_key(value)]
+            summary = {'id': row['id'], 'custom_id': row['custom_id'], 'name': row['name'],
+                       'available': bool(row['available'])} if row else None
+            _book_lookups.put(book_lookup_key(value), summary)
+            found[value] = summary
+    return found
+
+def lookup_students(admission_nos):
+    """Maps each admission number to a summary dict, or None if unknown."""
+    found, missing = {}, []
+    for value in admission_nos:
+        cached = _student_lookups.get(value.strip().upper(), _NOT_CACHED)
+        if cached is _NOT_CACHED:
+            missing.append(value.strip().upper())
+        else:
+            found[value] = cached
+    if missing:
+        with get_connection() as conn:
+            rows = {row['admission_no']: row for row in conn.execute(
+                "SELECT admission_no, name FROM students WHERE admission_no IN (SELECT value FROM json_each(?))",
+                (json.dumps(missing),))}
+        for value in admission_nos:
+            key = value.strip().upper()
+            if key in missing:
+                summary = {'admission_no': key, 'name': rows[key]['name']} if key in rows else None
+                _student_lookups.put(key, summary)
+                found[value] = summary
+    return found
+
+def forget_books(*book_ids, keys=(), misses=False):
+    """Invalidates cached lookups for books given by database id or lookup key.
+
+    misses=True also drops cached "not found" answers, e.g. after adding a book.
+    """
+    ids = set(book_ids)
+    keys = {book_lookup_key(key) for key in keys if key}
+
+    def stale(summary):
+        if summary is None:
+            return misses
+        return summary['id'] in ids or str(summary['id']) in keys or (summary['custom_id'] or '') in keys
+    _book_lookups.discard(keys=keys, where=stale)
+    _shared_cache.invalidate('books')
+
+def forget_students(*admission_nos):
+    _student_lookups.discard(keys=[value.strip().upper() for value in admission_nos if value])
+    _shared_cache.invalidate('students')
+
+# --- Shared Result Cache ---
+# Catalog-wide results (leaderboards, availability, dashboard totals) are
+# the same for every visitor, so they are cached once for all workers in a
+# side SQLite file (see shared_cache.py). Entries are tagged with the tables
+# they read: forget_books()/forget_students() drop them as soon as a route
+# changes those tables, and each entry is also stamped with the tables'
+# data versions, so writes from scripts or other tools are never served
+# stale either.
+SHARED_CACHE_TTL = 60  # seconds
+_shared_cache = SharedCache(DB_NAME)
+
+def shared_result(conn, name, tables, compute, ttl=SHARED_CACHE_TTL, key=''):
+    """Returns compute() from the shared cache, recomputing it when the tables change.
+
+    The value must be JSON-serializable; sqlite3.Row results become dicts.
+    """
+    versions, modified = data_versions(conn, tables)
+    stamp = json.dumps([versions, modified], sort_keys=True)
+    cache_key = f"{name}:{key}"
+    value = _shared_cache.get(cache_key, stamp, name=name)
+    if value is None:
+        value = compute()
+        _shared_cache.set(cache_key, value, ttl, tags=tables, stamp=stamp)
+    return value
+
+def rows_to_dicts(rows):
+    return [dict(row) for row in rows]
+
+def leaderboards(conn):
+    """Top five students and books by loans, shared by both dashboards."""
+    def compute():
+        students = conn.execute("SELECT name, borrow_count AS book_count FROM students WHERE borrow_count > 0 ORDER BY borrow_count DESC LIMIT 5").fetchall()
+        books = conn.execute("SELECT name, borrow_count FROM books WHERE borrow_count > 0 ORDER BY borrow_count DESC LIMIT 5").fetchall()
+        return {'students': rows_to_dicts(students),
+                'chart_labels': [truncate_text(row['name']) for row in books],
+                'chart_data': [row['borrow_count'] for row in books]}
+    return shared_result(conn, 'leaderboards', ('books', 'students'), compute)
+
+# --- Keyset (Cursor) Pagination Helpers ---
+# Paginated APIs seek on (name, id) instead of using OFFSET, so every page
+# costs the same no matter how deep it is. Cursors are opaque tokens that
+# encode the direction and the (name, id) of the row to seek from.
+COUNT_CACHE_TTL = 15  # seconds
+_count_cache = {}
+_count_cache_lock = threading.Lock()
+
+def encode_cursor(direction, name, row_id):
+    raw = json.dumps([direction, name, row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(token):
+    """Returns (direction, sort value, id) or raises ValueError for a bad token."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        direction, name, row_id = json.loads(base64.urlsafe_b64decode(padded))
+    except Exception:
+        raise ValueError("Invalid pagination cursor.")
+    if (direction not in ('next', 'prev') or not isinstance(row_id, int)
+            or isinstance(name, bool) or not isinstance(name, (str, int, float))):
+        raise ValueError("Invalid pagination cursor.")
+    return direction, name, row_id
+
+def cached_count(conn, count_sql, params):
+    """Runs a COUNT query, reusing the result for COUNT_CACHE_TTL seconds or until the data changes."""
+    # Keyed on the data versions too, so a count is never older than the rows
+    # served next to it (and an ETag built from the versions stays honest).
+    key = (count_sql, tuple(params), tuple(data_versions(conn)[0].values()))
+    now = time.monotonic()
+    with _count_cache_lock:
+        hit = _count_cache.get(key)
+        if hit and now - hit[1] < COUNT_CACHE_TTL:
+            return hit[0]
+    total = conn.execute(count_sql, tuple(params)).fetchone()[0]
+    with _count_cache_lock:
+        if len(_count_cache) > 1024:
+            _count_cache.clear()
+        _count_cache[key] = (total, now)
+    return total
+
+def keyset_page(conn, select_sql, base_sql, conditions, params, name_col, id_col, per_page, cursor):
+    """Fetches one page ordered by (name, id) starting from a cursor token.
+
+    name_col may be any column the rows carry, such as a search rank.
+    Returns (rows, next_cursor, prev_cursor); a cursor is None when there is
+    no page in that direction.
+    """
+    conditions = list(conditions)
+    params = list(params)
+    direction = 'next'
+    if cursor:
+        direction, seek_name, seek_id = decode_cursor(cursor)
+        op = '>' if direction == 'next' else '<'
+        conditions.append(f"({name_col}, {id_col}) {op} (?, ?)")
+        params.extend([seek_name, seek_id])
+
+    sql = select_sql + base_sql
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    order = "ASC" if direction == 'next' else "DESC"
+    sql += f" ORDER BY {name_col} {order}, {id_col} {order} LIMIT ?"
+    rows = conn.execute(sql, tuple(params + [per_page + 1])).fetchall()
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if direction == 'prev':
+        rows.reverse()
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, bool(cursor)
+
+    name_key, id_key = name_col.rsplit('.', 1)[-1], id_col.rsplit('.', 1)[-1]
+    next_cursor = prev_cursor = None
+    if rows and has_next:
+        next_cursor = encode_cursor('next', rows[-1][name_key], rows[-1][id_key])
+    if rows and has_prev:
+        prev_cursor = encode_cursor('prev', rows[0][name_key], rows[0][id_key])
+    return rows, next_cursor, prev_cursor
+
+# --- Conditional GET ---
+# Read-heavy views are tagged with the data versions of the tables they
+# read. A client that already has the current version gets a 304 before
+# any of the view's queries run. The versions are read before the view's
+# own queries, so a write in between only makes the tag older than the
+# body, which costs one extra full response, never a stale one.
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+# Changes whenever the code or templates are deployed, so old tags die with them.
+CODE_VERSION = int(max(os.path.getmtime(path) for path in
+                       [os.path.abspath(__file__)] + [os.path.join(TEMPLATE_DIR, name) for name in os.listdir(TEMPLATE_DIR)]))
+
+def conditional_get(*tables, daily=False):
+    """Answers If-None-Match / If-Modified-Since with 304 while `tables` are unchanged.
+
+    Goes below the login decorator. Use daily=True for views whose output
+    also depends on today's date (e.g. overdue flags).
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if session.get('_flashes'):
+                return f(*args, **kwargs)  # a pending flash message has to be rendered
+            with get_connection() as conn:
+                versions, modified = data_versions(conn, tables)
+            identity = [session.get('logged_in'), session.get('student_adm_no')]
+            state = [CODE_VERSION, request.full_path, identity, sorted(versions.items())]
+            modified = max(modified, CODE_VERSION)
+            if daily:
+                today = date.today()
+                state.append(today.isoformat())
+                modified = max(modified, int(time.mktime(today.timetuple())))
+            etag = hashlib.sha1(json.dumps(state).encode()).hexdigest()
+            last_modified = datetime.datetime.fromtimestamp(modified, datetime.timezone.utc)
+
+            if request.if_none_match:
+                not_modified = etag in request.if_none_match
+            else:
+                not_modified = request.if_modified_since is not None and last_modified <= request.if_modified_since
+            if not_modified:
+                response = app.response_class(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            if modified < int(time.time()):
+                # Last-Modified has one-second resolution: skip it while this second can still change.
+                response.last_modified = last_modified
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return decorated_function
+    return decorator
+
+# --- Static Assets and Service Worker ---
+# build_assets.py compiles Tailwind and vendors the CSS/JS libraries and
+# fonts into static/dist/ under content-hashed names, listed in its
+# manifest. asset_tag() emits those, or the CDN originals until the bundle
+# has been built. asset_url() adds a content hash to other static files.
+# Either way a changed file gets a new URL, so static responses can be
+# cached for a year. BUILD_VERSION hashes every template and static file;
+# a deploy that changes any of them installs a new service worker, which
+# drops the previous caches.
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+ASSET_MANIFEST_PATH = os.path.join(STATIC_DIR, 'dist', 'manifest.json')
+STATIC_MAX_AGE = 365 * 24 * 3600
+CDN_FALLBACKS = {
+    'app.css': 'https://cdn.tailwindcss.com',  # the in-browser compiler is a script
+    'inter.css': 'https://fonts.googleapis.com/css2?family=Inter:wght@100..900&display=swap',
+    'poppins.css': 'https://fonts.googleapis.com/css2?family=Poppins:wght@400;600&display=swap',
+    'bootstrap.css': 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/css/bootstrap.min.css',
+    'bootstrap-icons.css': 'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.10.5/font/bootstrap-icons.css',
+    'bootstrap.js': 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/js/bootstrap.bundle.min.js',
+    'chart.js': 'https://cdn.jsdelivr.net/npm/chart.js@4.4.1/dist/chart.umd.js',
+}
+SW_PRECACHE_ASSETS = ('app.css', 'inter.css', 'register_sw.js', 'manifest.json', 'icon-192x192.png', 'icon-512x512.png')
+SW_PRECACHE_PAGES = ('select_portal', 'student_login', 'student_register', 'offline_page')
+
+def file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
+
+def load_asset_manifest():
+    if not os.path.exists(ASSET_MANIFEST_PATH):
+        return {}
+    with open(ASSET_MANIFEST_PATH) as f:
+        return json.load(f)
+
+ASSET_MANIFEST = load_asset_manifest()
+STATIC_VERSIONS = {name: file_digest(os.path.join(STATIC_DIR, name))
+                   for name in os.listdir(STATIC_DIR) if os.path.isfile(os.path.join(STATIC_DIR, name))}
+BUILD_VERSION = hashlib.sha256("".join(
+    file_digest(os.path.join(folder, name))
+    for top in (TEMPLATE_DIR, STATIC_DIR) for folder, _, names in sorted(os.walk(top))
+    for name in sorted(names)).encode()).hexdigest()[:12]
+
+@app.template_global()
+def asset_url(filename):
+    """url_for('static', ...) for a bundled or content-hashed file, for long-lived caching."""
+    if filename in ASSET_MANIFEST:
+        return url_for('static', filename='dist/' + ASSET_MANIFEST[filename])
+    return url_for('static', filename=filename, v=STATIC_VERSIONS.get(filename))
+
+@app.template_global()
+def asset_tag(name):
+    """A <link> or <script> tag for a bundled asset, e.g. {{ asset_tag('app.css') }}."""
+    if name in ASSET_MANIFEST:
+        url, is_script = asset_url(name), name.endswith('.js')
+    else:
+        url = CDN_FALLBACKS[name]
+        is_script = name.endswith('.js') or name == 'app.css'
+    if is_script:
+        return Markup('<script src="%s"></script>') % url
+    return Markup('<link rel="stylesheet" href="%s">') % url
+
+def is_precachable(name):
+    return name in ASSET_MANIFEST or name in STATIC_VERSIONS
+
+@app.after_request
+def cache_static_assets(response):
+    """Hashed static URLs never change content, so browsers may keep them for a year."""
+    filename = (request.view_args or {}).get('filename', '') if request.endpoint == 'static' else ''
+    hashed = filename.startswith('dist/') or (filename in STATIC_VERSIONS and request.args.get('v') == STATIC_VERSIONS[filename])
+    if hashed and response.status_code in (200, 304):
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    return response
+
+@app.route("/sw.js")
+def service_worker():
+    """The service worker, served from the root so it controls every page."""
+    body = render_template("sw.js", version=BUILD_VERSION,
+                           precache=[asset_url(name) for name in SW_PRECACHE_ASSETS if is_precachable(name)] +
+                                    [url_for(endpoint) for endpoint in SW_PRECACHE_PAGES],
+                           offline_url=url_for('offline_page'), loans_url=url_for('api_student_loans'))
+    response = make_response(body)
+    response.headers['Content-Type'] = 'application/javascript; charset=utf-8'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route("/offline")
+def offline_page():
+    """Shown by the service worker when a page cannot be loaded offline."""
+    return render_template("offline.html")
 
 # ----------------- MAIN PORTAL SELECTION ROUTE -----------------
 
@@ -179,32 +1320,20 @@ def logout():
 @login_required 
 def index():
     with get_connection() as conn:
-        stats = conn.execute("SELECT (SELECT COUNT(id) FROM books) AS total_books, (SELECT COUNT(id) FROM students) AS total_students, (SELECT COUNT(id) FROM transactions WHERE return_date IS NULL) AS active_loans").fetchone()
-        overdue_loans = conn.execute("SELECT b.name AS book_name, s.name AS student_name, s.admission_no, t.due_date FROM transactions t JOIN books b ON t.book_id = b.id JOIN students s ON t.student_id = s.id WHERE t.return_date IS NULL AND t.due_date < date('now') ORDER BY t.due_date ASC").fetchall()
-        leaderboard_students = conn.execute("SELECT s.name, COUNT(t.id) as book_count FROM transactions t JOIN students s ON t.student_id = s.id GROUP BY t.student_id ORDER BY book_count DESC LIMIT 5").fetchall()
-        chart_data_query = conn.execute("SELECT b.name, COUNT(t.id) as borrow_count FROM transactions t JOIN books b ON t.book_id = b.id GROUP BY t.book_id ORDER BY borrow_count DESC LIMIT 5").fetchall()
-
-    # --- UPDATED: Process data for Chart.js with truncation ---
-    chart_labels = [truncate_text(row['name']) for row in chart_data_query]
-    chart_data = [row['borrow_count'] for row in chart_data_query]
-
+        def compute():
+            stats = conn.execute("SELECT (SELECT COUNT(id) FROM books) AS total_books, (SELECT COUNT(id) FROM students) AS total_students, (SELECT COUNT(id) FROM transactions WHERE return_date IS NULL) AS active_loans").fetchone()
+            overdue_loans = conn.execute("SELECT b.name AS book_name, s.name AS student_name, s.admission_no, t.due_date FROM transactions t JOIN books b ON t.book_id = b.id JOIN students s ON t.student_id = s.id WHERE t.return_date IS NULL AND t.due_date < date('now') ORDER BY t.due_date ASC").fetchall()
+            return {'stats': dict(stats), 'overdue_loans': rows_to_dicts(overdue_loans)}
+        # Overdue depends on today's date as well as the tables.
+        dashboard = shared_result(conn, 'index', ('books', 'students', 'transactions'), compute,
+                                  key=date.today().isoformat())
+        boards = leaderboards(conn)
+
+    stats = dashboard['stats']
     return render_template("index.html", 
                            total_books=stats['total_books'], total_students=stats['total_students'], active_loans=stats['active_loans'],
-                           overdue_loans=overdue_loans, leaderboard_students=leaderboard_students,
-                           chart_labels=chart_labels, chart_data=chart_data)
-
-    # Process data for Chart.js
-    chart_labels = [row['name'] for row in chart_data_query]
-    chart_data = [row['borrow_count'] for row in chart_data_query]
-
-    return render_template("index.html", 
-                           total_books=stats['total_books'],
-                           total_students=stats['total_students'],
-                           active_loans=stats['active_loans'],
-                           overdue_loans=overdue_loans,
-                           leaderboard_students=leaderboard_students,
-                           chart_labels=chart_labels,
-                           chart_data=chart_data)
+                           overdue_loans=dashboard['overdue_loans'], leaderboard_students=boards['students'],
+                           chart_labels=boards['chart_labels'], chart_data=boards['chart_data'])
 
 # ----------------- STUDENT AUTH DECORATOR AND ROUTES -----------------
 
@@ -247,15 +1376,10 @@ def student_register():
                 return redirect(url_for('student_register'))
             
             try:
-                # 2. CREATE the student record (profile) first
-                conn.execute("INSERT INTO students (admission_no, name, batch) VALUES (?, ?, ?)",
-                             (admission_no, name, batch))
-                                 
-                # 3. CREATE the authentication record
-                hashed_pass = hash_password(password)
-                conn.execute("INSERT INTO students_auth (admission_no, password_hash, is_approved) VALUES (?, ?, 0)",
-                             (admission_no, hashed_pass))
-                                 
+                # 2. CREATE the student record (profile) and its pending authentication record
+                run_write(create_student_account, admission_no, name, batch, hash_password(password), 0)
+                forget_students(admission_no)
+                invalidate_pending_count()
                 flash('Registration successful! Please wait for the librarian to approve your account before logging in.', 'success')
                 return redirect(url_for('student_login'))
             except sqlite3.IntegrityError:
@@ -292,6 +1416,9 @@ def student_login():
             elif not auth_record['is_approved']:
                 flash('Your account is awaiting approval by the librarian.', 'warning')
             elif check_password(auth_record['password_hash'], password):
+                if password_needs_rehash(auth_record['password_hash']):
+                    write_statement("UPDATE students_auth SET password_hash = ? WHERE admission_no = ?",
+                                    (hash_password(password), auth_record['admission_no']))
                 session['student_logged_in'] = True
                 session['student_adm_no'] = auth_record['admission_no']
                 flash('Login successful!', 'success')
@@ -320,19 +1447,28 @@ def student_dashboard():
             return redirect(url_for('student_logout'))
         student_id = student_record['id']
         active_loans = conn.execute("SELECT t.due_date < date('now') AS is_overdue, t.issue_date, t.due_date, COALESCE(b.name, '[DELETED BOOK]') AS book_name FROM transactions t LEFT JOIN books b ON t.book_id = b.id WHERE t.student_id = ? AND t.return_date IS NULL ORDER BY t.due_date ASC", (student_id,)).fetchall()
-        loan_history = conn.execute("SELECT t.issue_date, t.return_date, COALESCE(b.name, '[DELETED BOOK]') AS book_name FROM transactions t LEFT JOIN books b ON t.book_id = b.id WHERE t.student_id = ? AND t.return_date IS NOT NULL ORDER BY t.return_date DESC", (student_id,)).fetchall()
-        leaderboard_students = conn.execute("SELECT s.name, COUNT(t.id) as book_count FROM transactions t JOIN students s ON t.student_id = s.id GROUP BY t.student_id ORDER BY book_count DESC LIMIT 5").fetchall()
-        chart_data_query = conn.execute("SELECT b.name, COUNT(t.id) as borrow_count FROM transactions t JOIN books b ON t.book_id = b.id GROUP BY t.book_id ORDER BY borrow_count DESC LIMIT 5").fetchall()
-    
-    # --- UPDATED: Process data for Chart.js with truncation ---
-    chart_labels = [truncate_text(row['name']) for row in chart_data_query]
-    chart_data = [row['borrow_count'] for row in chart_data_query]
+        loan_history = conn.execute("SELECT t.issue_date, t.return_date, COALESCE(b.name, '[DELETED BOOK]') AS book_name FROM all_transactions t LEFT JOIN books b ON t.book_id = b.id WHERE t.student_id = ? AND t.return_date IS NOT NULL ORDER BY t.return_date DESC", (student_id,)).fetchall()
+        boards = leaderboards(conn)
 
     return render_template('student_dashboard.html', 
                            active_loans=active_loans, loan_history=loan_history, student_info=student_record,
-                           leaderboard_students=leaderboard_students, chart_labels=chart_labels, chart_data=chart_data)
+                           leaderboard_students=boards['students'], chart_labels=boards['chart_labels'], chart_data=boards['chart_data'])
+
 
 
+@app.route('/api/student_loans')
+@student_login_required
+@conditional_get('transactions', 'books', daily=True)
+def api_student_loans():
+    """The logged-in student's active loans; the service worker keeps a copy for offline use."""
+    with get_connection() as conn:
+        student = conn.execute("SELECT id, name, admission_no FROM students WHERE admission_no=?",
+                               (session.get('student_adm_no'),)).fetchone()
+        if not student:
+            return jsonify({'error': "Student not found."}), 404
+        loans = conn.execute("SELECT t.due_date < date('now') AS is_overdue, t.issue_date, t.due_date, COALESCE(b.name, '[DELETED BOOK]') AS book_name FROM transactions t LEFT JOIN books b ON t.book_id = b.id WHERE t.student_id = ? AND t.return_date IS NULL ORDER BY t.due_date ASC", (student['id'],)).fetchall()
+    return jsonify({'student': {'name': student['name'], 'admission_no': student['admission_no']},
+                    'loans': [dict(row) for row in loans]})
 
 # ----------------- STUDENT BOOK SEARCH ROUTE (FIXED) -----------------
 
@@ -344,7 +1480,8 @@ def student_search_books():
     with get_connection() as conn:
         student_info = conn.execute("SELECT id, name, batch FROM students WHERE admission_no=?", (student_adm_no,)).fetchone()
         
-        availability = conn.execute("SELECT SUM(CASE WHEN available = 1 THEN 1 ELSE 0 END) AS available_count, COUNT(id) AS total_count FROM books").fetchone()
+        availability = shared_result(conn, 'availability', ('books',), lambda: dict(conn.execute(
+            "SELECT (SELECT COUNT(id) FROM books WHERE available = 1) AS available_count, (SELECT COUNT(id) FROM books) AS total_count").fetchone()))
 
         active_loans = conn.execute("""
             SELECT b.name AS book_name, t.issue_date, t.due_date, t.due_date < date('now') AS is_overdue
@@ -380,9 +1517,9 @@ def approve_students():
 @login_required
 def approve_student_action(admission_no):
     try:
-        with get_connection() as conn:
-            # Only update the approval status, as the student record is already created.
-            conn.execute("UPDATE students_auth SET is_approved = 1 WHERE admission_no = ?", (admission_no,))
+        # Only update the approval status, as the student record is already created.
+        write_statement("UPDATE students_auth SET is_approved = 1 WHERE admission_no = ?", (admission_no,))
+        invalidate_pending_count()
         flash(f"Student {admission_no} approved successfully! They can now log in.", 'success')
     except Exception as e:
         flash(f"Error approving student: {str(e)}", 'danger')
@@ -390,6 +1527,18 @@ def approve_student_action(admission_no):
     return redirect(url_for('approve_students'))
 
 
+def reject_registration(conn, admission_no):
+    """Deletes a student and their portal registration inside a write transaction; returns the deleted row."""
+    # 1. Get the student's ID for deletion, needed to ensure the flash message is accurate.
+    student = conn.execute("SELECT name, id FROM students WHERE admission_no = ?", (admission_no,)).fetchone()
+    if not student:
+        raise CirculationError(f"Error: Student with admission number {admission_no} not found or already deleted.")
+
+    # 2. Deleting from 'students' cascades the deletion to 'students_auth' 
+    # (and 'transactions', though no active transactions should exist for a pending user).
+    conn.execute("DELETE FROM students WHERE id=?", (student['id'],))
+    return student
+
 @app.route("/reject_student/<admission_no>")
 @login_required
 def reject_student_action(admission_no):
@@ -398,19 +1547,13 @@ def reject_student_action(admission_no):
     This action ensures that the student must re-register if they wish to try again.
     """
     try:
-        with get_connection() as conn:
-            # 1. Get the student's ID for deletion, needed to ensure the flash message is accurate.
-            student = conn.execute("SELECT name, id FROM students WHERE admission_no = ?", (admission_no,)).fetchone()
-            
-            if not student:
-                flash(f"Error: Student with admission number {admission_no} not found or already deleted.", 'danger')
-                return redirect(url_for('approve_students'))
-                
-            # 2. Deleting from 'students' cascades the deletion to 'students_auth' 
-            # (and 'transactions', though no active transactions should exist for a pending user).
-            conn.execute("DELETE FROM students WHERE id=?", (student['id'],))
+        student = run_write(reject_registration, admission_no)
+        forget_students(admission_no)
+        invalidate_pending_count()
             
         flash(f"Student account for {admission_no} ({student['name']}) rejected and deleted successfully.", 'success')
+    except CirculationError as e:
+        flash(str(e), 'danger')
     except Exception as e:
         flash(f"Error rejecting student: {str(e)}", 'danger')
         
@@ -433,9 +1576,9 @@ def add_book():
         author = request.form["author"].strip()
         
         try:
-            with get_connection() as conn:
-                conn.execute("INSERT INTO books (custom_id, name, author, available) VALUES (?, ?, ?, 1)",
-                             (custom_id, name, author))
+            write_statement("INSERT INTO books (custom_id, name, author, available) VALUES (?, ?, ?, 1)",
+                            (custom_id, name, author))
+            forget_books(misses=True)
             flash("Book added successfully!", "success")
         except sqlite3.IntegrityError:
             flash("Book with this Custom ID already exists!", "danger")
@@ -452,22 +1595,24 @@ def view_books():
     return render_template("view_books.html")
 
 
+def remove_book(conn, book_id):
+    """Deletes a book that is on the shelf inside a write transaction."""
+    book = conn.execute("SELECT available, name FROM books WHERE id=?", (book_id,)).fetchone()
+    if not book:
+        raise CirculationError("Book not found.")
+    if not book['available']:
+        raise CirculationError(f"Cannot delete '{book['name']}'. It is currently issued out!")
+    conn.execute("DELETE FROM books WHERE id=?", (book_id,))
+
 @app.route("/delete_book/<int:id>", methods=["POST"])
 @login_required 
 def delete_book(id):
     try:
-        with get_connection() as conn:
-            book = conn.execute("SELECT available, name FROM books WHERE id=?", (id,)).fetchone()
-            if not book:
-                  flash("Book not found.", "danger")
-                  return redirect(url_for("view_books"))
-
-            if not book['available']:
-                flash(f"Cannot delete '{book['name']}'. It is currently issued out!", "danger")
-                return redirect(url_for("view_books"))
-                
-            conn.execute("DELETE FROM books WHERE id=?", (id,))
+        run_write(remove_book, id)
+        forget_books(id)
         flash("Book deleted successfully!", "success")
+    except CirculationError as e:
+        flash(str(e), "danger")
     except Exception as e:
         flash(f"Error deleting book: {str(e)}", "danger")
     return redirect(url_for("view_books"))
@@ -493,11 +1638,9 @@ def edit_book(id):
         author = request.form["author"].strip()
 
         try:
-            with get_connection() as conn:
-                conn.execute(
-                    "UPDATE books SET custom_id=?, name=?, author=? WHERE id=?",
-                    (custom_id, name, author, id)
-                )
+            write_statement("UPDATE books SET custom_id=?, name=?, author=? WHERE id=?",
+                            (custom_id, name, author, id))
+            forget_books(id, keys=[custom_id])
             flash(f"Book '{name}' updated successfully!", "success")
             return redirect(url_for("view_books"))
         except sqlite3.IntegrityError:
@@ -513,6 +1656,13 @@ def edit_book(id):
 
 # ----------------- STUDENTS -----------------
 
+def create_student_account(conn, admission_no, name, batch, password_hash, is_approved):
+    """Creates a student profile together with its portal authentication record."""
+    conn.execute("INSERT INTO students (admission_no, name, batch) VALUES (?, ?, ?)",
+                 (admission_no, name, batch))
+    conn.execute("INSERT INTO students_auth (admission_no, password_hash, is_approved) VALUES (?, ?, ?)",
+                 (admission_no, password_hash, is_approved))
+
 @app.route("/add_student", methods=["GET", "POST"])
 @login_required 
 def add_student():
@@ -523,16 +1673,12 @@ def add_student():
         password = request.form["password"] # New field
         
         try:
-            with get_connection() as conn:
-                # 1. Create the student profile
-                conn.execute("INSERT INTO students (admission_no, name, batch) VALUES (?, ?, ?)",
-                             (admission_no, name, batch))
-                
-                # 2. Hash the password and create the approved authentication record
-                hashed_pass = hash_password(password)
-                conn.execute("INSERT INTO students_auth (admission_no, password_hash, is_approved) VALUES (?, ?, 1)",
-                             (admission_no, hashed_pass))
+            # Hash first so the slow part never runs inside the write transaction,
+            # then create the student profile and its approved authentication record.
+            run_write(create_student_account, admission_no, name, batch, hash_password(password), 1)
+            forget_students(admission_no)
                              
+            invalidate_pending_count()
             flash("Student profile and portal account created successfully! They can now log in.", "success")
             return redirect(url_for('add_student'))
             
@@ -551,23 +1697,13 @@ def add_student():
 def view_students():
     # This route now just renders the page shell and fetches batches for the filter.
     with get_connection() as conn:
-        batches = conn.execute("SELECT DISTINCT batch FROM students ORDER BY batch ASC").fetchall()
+        batches = shared_result(conn, 'batches', ('students',), lambda: rows_to_dicts(
+            conn.execute("SELECT DISTINCT batch FROM students ORDER BY batch ASC").fetchall()))
         
     return render_template("view_students.html", batches=batches)
 
-@app.route("/api/view_students")
-@login_required
-def api_view_students():
-    STUDENTS_PER_PAGE = 15
-    page = request.args.get('page', 1, type=int)
-    query = request.args.get('query', '')
-    batch_filter = request.args.get('batch', 'all')
-    status_filter = request.args.get('status', 'all')
-
-    base_sql = "FROM students s LEFT JOIN students_auth sa ON s.admission_no = sa.admission_no"
-    count_sql = "SELECT COUNT(s.id) "
-    select_sql = "SELECT s.id, s.admission_no, s.name, s.batch, sa.is_approved "
-    
+def student_filters(query, batch_filter, status_filter):
+    """WHERE conditions and params for the student list (aliases s / sa)."""
     params = []
     conditions = []
 
@@ -585,13 +1721,49 @@ def api_view_students():
     elif status_filter == 'pending':
         conditions.append("(sa.is_approved = 0 OR sa.is_approved IS NULL)")
 
+    return conditions, params
+
+@app.route("/api/view_students")
+@login_required
+@conditional_get('students', 'students_auth')
+def api_view_students():
+    STUDENTS_PER_PAGE = 15
+    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
+    query = request.args.get('query', '')
+    batch_filter = request.args.get('batch', 'all')
+    status_filter = request.args.get('status', 'all')
+
+    base_sql = "FROM students s LEFT JOIN students_auth sa ON s.admission_no = sa.admission_no"
+    count_sql = "SELECT COUNT(s.id) "
+    select_sql = "SELECT s.id, s.admission_no, s.name, s.batch, sa.is_approved "
+    
+    conditions, params = student_filters(query, batch_filter, status_filter)
+
+    where_clause = ""
     if conditions:
         where_clause = " WHERE " + " AND ".join(conditions)
-        base_sql += where_clause
     
     with get_connection() as conn:
-        full_count_sql = count_sql + base_sql
-        total_students = conn.execute(full_count_sql, tuple(params)).fetchone()[0]
+        if cursor is not None:
+            # Cursor mode: seek on (name, id); the total is opt-in and cached.
+            try:
+                students_data, next_cursor, prev_cursor = keyset_page(
+                    conn, select_sql, base_sql, conditions, params,
+                    "s.name", "s.id", STUDENTS_PER_PAGE, cursor)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            pagination = {
+                'per_page': STUDENTS_PER_PAGE,
+                'next_cursor': next_cursor,
+                'prev_cursor': prev_cursor
+            }
+            if request.args.get('count') == '1':
+                pagination['total_students'] = cached_count(conn, count_sql + base_sql + where_clause, params)
+            return jsonify({'students': [dict(row) for row in students_data], 'pagination': pagination})
+
+        # Page-number mode (kept for compatibility)
+        total_students = cached_count(conn, count_sql + base_sql + where_clause, params)
         
         total_pages = 1
         if total_students > 0:
@@ -602,7 +1774,7 @@ def api_view_students():
 
         offset = (page - 1) * STUDENTS_PER_PAGE
         
-        paginated_sql = select_sql + base_sql + " ORDER BY s.name ASC LIMIT ? OFFSET ?"
+        paginated_sql = select_sql + base_sql + where_clause + " ORDER BY s.name ASC, s.id ASC LIMIT ? OFFSET ?"
         final_params = params + [STUDENTS_PER_PAGE, offset]
         
         students_data = conn.execute(paginated_sql, tuple(final_params)).fetchall()
@@ -618,25 +1790,29 @@ def api_view_students():
         }
     })
 
+def remove_student(conn, student_id):
+    """Deletes a student with no books out inside a write transaction; returns the deleted row."""
+    student = conn.execute("SELECT name, admission_no FROM students WHERE id=?", (student_id,)).fetchone()
+    if not student:
+        raise CirculationError("Student not found.")
+    active_issues = conn.execute("SELECT COUNT(id) FROM transactions WHERE student_id=? AND return_date IS NULL", (student_id,)).fetchone()[0]
+    if active_issues > 0:
+        raise CirculationError(f"Cannot delete student '{student['name']}'. They currently have {active_issues} book(s) issued!")
+
+    # Deleting the student record will cascade and remove the auth record and transactions.
+    conn.execute("DELETE FROM students WHERE id=?", (student_id,))
+    return student
+
 @app.route("/delete_student/<int:id>", methods=["POST"])
 @login_required 
 def delete_student(id):
     try:
-        with get_connection() as conn:
-            active_issues = conn.execute("SELECT COUNT(id) FROM transactions WHERE student_id=? AND return_date IS NULL", (id,)).fetchone()[0]
-            student = conn.execute("SELECT name, admission_no FROM students WHERE id=?", (id,)).fetchone()
-            
-            if not student:
-                  flash("Student not found.", "danger")
-                  return redirect(url_for("view_students"))
-
-            if active_issues > 0:
-                flash(f"Cannot delete student '{student['name']}'. They currently have {active_issues} book(s) issued!", "danger")
-                return redirect(url_for("view_students"))
-            
-            # Deleting the student record will cascade and remove the auth record and transactions.
-            conn.execute("DELETE FROM students WHERE id=?", (id,))
+        student = run_write(remove_student, id)
+        forget_students(student['admission_no'])
+        invalidate_pending_count()
         flash("Student and their associated portal account deleted successfully!", "success")
+    except CirculationError as e:
+        flash(str(e), "danger")
     except Exception as e:
         flash(f"Error deleting student: {str(e)}", "danger")
     return redirect(url_for("view_students"))
@@ -658,12 +1834,10 @@ def edit_student(id):
         batch = request.form["batch"]
 
         try:
-            with get_connection() as conn:
-                # Update main student record. CASCADE handles the auth table update.
-                conn.execute(
-                    "UPDATE students SET admission_no=?, name=?, batch=? WHERE id=?",
-                    (new_admission_no, name, batch, id)
-                )
+            # Update main student record. CASCADE handles the auth table update.
+            write_statement("UPDATE students SET admission_no=?, name=?, batch=? WHERE id=?",
+                            (new_admission_no, name, batch, id))
+            forget_students(student['admission_no'], new_admission_no)
 
             flash(f"Student '{name}' updated successfully!", "success")
             return redirect(url_for("view_students"))
@@ -680,6 +1854,61 @@ def edit_student(id):
 
 # ----------------- TRANSACTIONS -----------------
 
+def loan_due_date(loan_period, custom_due_date, issue_date):
+    """Returns the due date string for a loan, raising ValueError with a user-facing message."""
+    if loan_period == "custom" and custom_due_date:
+        try:
+            due_date = datetime.datetime.strptime(custom_due_date, '%Y-%m-%d').date()
+        except ValueError:
+            raise ValueError("Invalid Custom Due Date format.")
+        if due_date <= issue_date:
+            raise ValueError("Custom Due Date must be after the Issue Date.")
+        return due_date.strftime('%Y-%m-%d')
+    if loan_period and loan_period != "custom":
+        try:
+            days = int(loan_period)
+        except ValueError:
+            raise ValueError("Invalid Loan Period selected.")
+        return (issue_date + timedelta(days=days)).strftime('%Y-%m-%d')
+    raise ValueError("Please select a valid loan period or custom due date.")
+
+def find_book(conn, book_id_input):
+    # Matches the uppercased custom_id OR the numeric id.
+    return conn.execute("SELECT id, name FROM books WHERE custom_id=? OR id=?",
+                        (book_id_input.upper(), book_id_input)).fetchone()
+
+def issue_copy(conn, book_id_input, student_adm, issue_date, due_date):
+    """Issues one book inside a write transaction; returns (book, student)."""
+    book = find_book(conn, book_id_input)
+    student = conn.execute("SELECT id, name FROM students WHERE admission_no=?", (student_adm,)).fetchone()
+    if not book:
+        raise CirculationError("Book not found! (Check ID or Custom ID)")
+    if not student:
+        raise CirculationError("Student not found! (Check Admission No)")
+
+    # Claiming the copy and checking it was still available is one statement.
+    claimed = conn.execute("UPDATE books SET available=0 WHERE id=? AND available=1", (book["id"],)).rowcount
+    if claimed != 1:
+        raise CirculationError(f"Book '{book['name']}' is currently not available!")
+    conn.execute("INSERT INTO transactions (book_id, student_id, issue_date, due_date) VALUES (?, ?, ?, ?)",
+                 (book["id"], student["id"], issue_date, due_date))
+    return book, student
+
+def return_copy(conn, book_id_input, student_adm, return_date):
+    """Returns one book inside a write transaction; returns (book, student)."""
+    book = find_book(conn, book_id_input)
+    student = conn.execute("SELECT id, name FROM students WHERE admission_no=?", (student_adm,)).fetchone()
+    if not book or not student:
+        raise CirculationError("Book or student not found!")
+
+    closed = conn.execute("""UPDATE transactions SET return_date=?
+                             WHERE book_id=? AND student_id=? AND return_date IS NULL""",
+                          (return_date, book["id"], student["id"])).rowcount
+    if closed == 0:
+        raise CirculationError("No active issue found for this book and student!")
+    conn.execute("UPDATE books SET available=1 WHERE id=?", (book["id"],))
+    return book, student
+
 @app.route("/issue", methods=["GET", "POST"])
 @login_required 
 def issue_book():
@@ -690,53 +1919,21 @@ def issue_book():
         custom_due_date_str = request.form.get("custom_due_date")
         
         issue_date_obj = date.today()
-        calculated_due_date = ""
-
-        if loan_period_days == "custom" and custom_due_date_str:
-            try:
-                calculated_due_date = datetime.datetime.strptime(custom_due_date_str, '%Y-%m-%d').strftime('%Y-%m-%d')
-                if datetime.datetime.strptime(calculated_due_date, '%Y-%m-%d').date() <= issue_date_obj:
-                    flash("Custom Due Date must be after the Issue Date.", "danger")
-                    return redirect(url_for("issue_book"))
-            except ValueError:
-                flash("Invalid Custom Due Date format.", "danger")
-                return redirect(url_for("issue_book"))
-        elif loan_period_days and loan_period_days != "custom":
-            try:
-                days = int(loan_period_days)
-                calculated_due_date = (issue_date_obj + timedelta(days=days)).strftime('%Y-%m-%d')
-            except ValueError:
-                flash("Invalid Loan Period selected.", "danger")
-                return redirect(url_for("issue_book"))
-        else:
-            flash("Please select a valid loan period or custom due date.", "danger")
+        try:
+            calculated_due_date = loan_due_date(loan_period_days, custom_due_date_str, issue_date_obj)
+        except ValueError as e:
+            flash(str(e), "danger")
             return redirect(url_for("issue_book"))
         
-        with get_connection() as conn:
-            # --- THIS IS THE CORRECTED LINE ---
-            # It now checks for the uppercased custom_id OR the numeric id.
-            book = conn.execute("SELECT * FROM books WHERE custom_id=? OR id=?", 
-                                (book_id_input.upper(), book_id_input)).fetchone()
-            
-            student = conn.execute("SELECT * FROM students WHERE admission_no=?", (student_adm,)).fetchone()
-            
-            if not book:
-                flash("Book not found! (Check ID or Custom ID)", "danger")
-                return redirect(url_for("issue_book"))
-            if not student:
-                flash("Student not found! (Check Admission No)", "danger")
-                return redirect(url_for("issue_book"))
-            if not book["available"]:
-                flash(f"Book '{book['name']}' is currently not available!", "danger")
-                return redirect(url_for("issue_book"))
-            
-            try:
-                conn.execute("INSERT INTO transactions (book_id, student_id, issue_date, due_date) VALUES (?, ?, ?, ?)",
-                             (book["id"], student["id"], issue_date_obj.strftime('%Y-%m-%d'), calculated_due_date))
-                conn.execute("UPDATE books SET available=0 WHERE id=?", (book["id"],))
-                flash(f"Book '{book['name']}' issued to {student['name']}! Due Date: {calculated_due_date}", "success")
-            except Exception as e:
-                flash(f"Error issuing book: {str(e)}", "danger")
+        try:
+            book, student = run_write(issue_copy, book_id_input, student_adm,
+                                      issue_date_obj.strftime('%Y-%m-%d'), calculated_due_date)
+            forget_books(book['id'])
+            flash(f"Book '{book['name']}' issued to {student['name']}! Due Date: {calculated_due_date}", "success")
+        except CirculationError as e:
+            flash(str(e), "danger")
+        except Exception as e:
+            flash(f"Error issuing book: {str(e)}", "danger")
                 
         return redirect(url_for("issue_book"))
     return render_template("issue.html")
@@ -748,91 +1945,181 @@ def return_book():
         book_id_input = request.form["book_id"].strip()
         student_adm = request.form["admission_no"].strip().upper()
         
-        with get_connection() as conn:
-            # --- THIS IS THE CORRECTED LINE ---
-            # It now checks for the uppercased custom_id OR the numeric id.
-            book = conn.execute("SELECT * FROM books WHERE custom_id=? OR id=?", 
-                                (book_id_input.upper(), book_id_input)).fetchone()
-            
-            student = conn.execute("SELECT * FROM students WHERE admission_no=?", (student_adm,)).fetchone()
-            
-            if not book or not student:
-                flash("Book or student not found!", "danger")
-                return redirect(url_for("return_book"))
-            
-            transaction = conn.execute(
-                "SELECT id, book_id FROM transactions WHERE book_id=? AND student_id=? AND return_date IS NULL",
-                (book["id"], student["id"])
-            ).fetchone()
-            
-            if not transaction:
-                flash("No active issue found for this book and student!", "danger")
-                return redirect(url_for("return_book"))
-            
-            try:
-                conn.execute("UPDATE transactions SET return_date=? WHERE id=?",
-                             (datetime.datetime.now().strftime('%Y-%m-%d'), transaction["id"]))
-                conn.execute("UPDATE books SET available=1 WHERE id=?", (book["id"],))
-                flash(f"Book '{book['name']}' returned by {student['name']}!", "success")
-            except Exception as e:
-                flash(f"Error returning book: {str(e)}", "danger")
+        try:
+            book, student = run_write(return_copy, book_id_input, student_adm,
+                                      datetime.datetime.now().strftime('%Y-%m-%d'))
+            forget_books(book['id'])
+            flash(f"Book '{book['name']}' returned by {student['name']}!", "success")
+        except CirculationError as e:
+            flash(str(e), "danger")
+        except Exception as e:
+            flash(f"Error returning book: {str(e)}", "danger")
                 
         return redirect(url_for("return_book"))
     return render_template("return.html")
 
-@app.route("/extend/<int:transaction_id>", methods=["POST"])
+# --- Batch circulation (barcode scanner desk) ---
+# One student is scanned, then any number of books. The whole batch is
+# validated with a handful of set-based queries and applied in a single
+# write transaction, with a result reported for every scanned item.
+
+CIRCULATION_BATCH_LIMIT = 200
+
+def circulation_batch(conn, action, student, book_inputs, due_date=None):
+    """Validates and applies a batch of issues or returns for one student.
+
+    Returns one result dict per scanned book, in scan order. Items that fail
+    validation are reported and skipped; the rest are written together.
+    """
+    books = resolve_books(conn, book_inputs)
+    book_ids = [book['id'] for book in books.values() if book]
+    active = {}
+    if action == "return" and book_ids:
+        active = {row['book_id']: row['id'] for row in conn.execute(
+            """SELECT id, book_id FROM transactions
+               WHERE student_id = ? AND return_date IS NULL
+                 AND book_id IN (SELECT value FROM json_each(?))""",
+            (student['id'], json.dumps(book_ids)))}
+
+    results, accepted, seen = [], [], set()
+    for value in book_inputs:
+        book = books[value]
+        result = {'book_id': value, 'book_name': book['name'] if book else None, 'status': 'error'}
+        if not book:
+            result['message'] = "Book not found"
+        elif book['id'] in seen:
+            result['message'] = "Scanned more than once in this batch"
+        elif action == "issue" and not book['available']:
+            result['message'] = "Book is not available"
+        elif action == "return" and book['id'] not in active:
+            result['message'] = "No active issue for this student"
+        else:
+            result['status'] = 'issued' if action == "issue" else 'returned'
+            if due_date:
+                result['due_date'] = due_date
+            accepted.append(book['id'])
+        if book:
+            seen.add(book['id'])
+        results.append(result)
+
+    # The updates stay conditional; under run_write() nothing can change
+    # between the checks above and here, so a short count means a bug.
+    today = date.today().strftime('%Y-%m-%d')
+    if action == "issue":
+        changed = conn.executemany("UPDATE books SET available=0 WHERE id=? AND available=1",
+                                   [(book_id,) for book_id in accepted]).rowcount
+        conn.executemany("INSERT INTO transactions (book_id, student_id, issue_date, due_date) VALUES (?, ?, ?, ?)",
+                         [(book_id, student['id'], today, due_date) for book_id in accepted])
+    else:
+        changed = conn.executemany("UPDATE transactions SET return_date=? WHERE id=? AND return_date IS NULL",
+                                   [(today, active[book_id]) for book_id in accepted]).rowcount
+        conn.executemany("UPDATE books SET available=1 WHERE id=?", [(book_id,) for book_id in accepted])
+    if accepted and changed != len(accepted):
+        raise CirculationError("Some books changed while the batch was being processed. Please resubmit.")
+    return results
+
+@app.route("/circulation")
 @login_required
-def extend_loan(transaction_id):
-    # Fetch the transaction to ensure it exists and to get the current due date
+def circulation():
+    return render_template("circulation.html", batch_limit=CIRCULATION_BATCH_LIMIT)
+
+@app.route("/api/circulation", methods=["POST"])
+@login_required
+def api_circulation():
+    data = request.get_json(silent=True) or {}
+    action = data.get('action')
+    admission_no = str(data.get('admission_no') or '').strip().upper()
+    book_inputs = [str(value).strip() for value in data.get('book_ids') or [] if str(value).strip()]
+
+    if action not in ("issue", "return"):
+        return jsonify({'error': "Action must be 'issue' or 'return'."}), 400
+    if not admission_no or not book_inputs:
+        return jsonify({'error': "An admission number and at least one book are required."}), 400
+    if len(book_inputs) > CIRCULATION_BATCH_LIMIT:
+        return jsonify({'error': f"A batch can hold at most {CIRCULATION_BATCH_LIMIT} books."}), 400
+
+    due_date = None
+    if action == "issue":
+        try:
+            due_date = loan_due_date(str(data.get('loan_period') or ''), data.get('custom_due_date'), date.today())
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
     with get_connection() as conn:
-        transaction = conn.execute(
-            "SELECT due_date FROM transactions WHERE id = ? AND return_date IS NULL",
-            (transaction_id,)
-        ).fetchone()
+        student = conn.execute("SELECT id, name FROM students WHERE admission_no=?", (admission_no,)).fetchone()
+    if not student:
+        return jsonify({'error': "Student not found! (Check Admission No)"}), 404
+    try:
+        results = run_write(circulation_batch, action, student, book_inputs, due_date)
+    except CirculationError as e:
+        return jsonify({'error': str(e)}), 409
+    forget_books(keys=book_inputs)
 
+    succeeded = sum(1 for result in results if result['status'] != 'error')
+    return jsonify({
+        'action': action,
+        'student': {'admission_no': admission_no, 'name': student['name']},
+        'results': results,
+        'succeeded': succeeded,
+        'failed': len(results) - succeeded,
+    })
+
+def extend_due_date(conn, transaction_id, new_due_date_str):
+    """Moves an active loan's due date later inside a write transaction."""
+    transaction = conn.execute(
+        "SELECT due_date FROM transactions WHERE id = ? AND return_date IS NULL",
+        (transaction_id,)
+    ).fetchone()
     if not transaction:
-        flash("Active transaction not found or already returned.", "danger")
-        return redirect(url_for("active_issues"))
+        raise CirculationError("Active transaction not found or already returned.")
 
-    new_due_date_str = request.form.get("new_due_date")
-    
     try:
-        new_due_date_obj = datetime.datetime.strptime(new_due_date_str, '%Y-%m-%d').date()
+        new_due_date_obj = datetime.datetime.strptime(new_due_date_str or '', '%Y-%m-%d').date()
         current_due_date_obj = datetime.datetime.strptime(transaction['due_date'], '%Y-%m-%d').date()
-        
-        # Validation checks
-        if new_due_date_obj <= current_due_date_obj:
-            flash("New due date must be *after* the current due date.", "danger")
-        elif new_due_date_obj <= date.today():
-             flash("New due date must be in the future.", "danger")
-        else:
-            # Update the database if validation passes
-            with get_connection() as conn_update:
-                conn_update.execute("UPDATE transactions SET due_date=? WHERE id=?", 
-                                     (new_due_date_str, transaction_id))
-            flash(f"Loan for transaction #{transaction_id} extended successfully! New Due Date: {new_due_date_str}", "success")
-            
     except ValueError:
-        flash("Invalid date format provided.", "danger")
+        raise CirculationError("Invalid date format provided.")
+    if new_due_date_obj <= current_due_date_obj:
+        raise CirculationError("New due date must be *after* the current due date.")
+    if new_due_date_obj <= date.today():
+        raise CirculationError("New due date must be in the future.")
+
+    # Only applies if the loan is still open with the due date checked above.
+    updated = conn.execute("UPDATE transactions SET due_date=? WHERE id=? AND return_date IS NULL AND due_date=?",
+                           (new_due_date_obj.strftime('%Y-%m-%d'), transaction_id, transaction['due_date'])).rowcount
+    if updated != 1:
+        raise CirculationError("The loan changed while it was being extended. Please try again.")
+    return new_due_date_obj.strftime('%Y-%m-%d')
+
+@app.route("/extend/<int:transaction_id>", methods=["POST"])
+@login_required
+def extend_loan(transaction_id):
+    try:
+        new_due_date = run_write(extend_due_date, transaction_id, request.form.get("new_due_date"))
+        flash(f"Loan for transaction #{transaction_id} extended successfully! New Due Date: {new_due_date}", "success")
+    except CirculationError as e:
+        flash(str(e), "danger")
     except Exception as e:
         flash(f"Error extending loan: {str(e)}", "danger")
 
     return redirect(url_for("active_issues"))
 
+ACTIVE_ISSUES_SQL = """SELECT t.id, t.student_id, t.issue_date, t.due_date, 
+                              COALESCE(b.name, '[DELETED BOOK]') AS book_name, 
+                              COALESCE(s.name, '[DELETED STUDENT]') AS student_name, 
+                              COALESCE(s.admission_no, 'N/A') AS admission_no,
+                              COALESCE(s.batch, '-') AS batch
+                              FROM transactions t
+                              LEFT JOIN books b ON t.book_id = b.id
+                              LEFT JOIN students s ON t.student_id = s.id
+                              WHERE t.return_date IS NULL
+                              ORDER BY t.due_date ASC"""
+
 @app.route("/active_issues")
 @login_required 
+@conditional_get('transactions', 'books', 'students', 'students_auth', daily=True)
 def active_issues():
     with get_connection() as conn:
-        transactions = conn.execute("""SELECT t.id, t.student_id, t.issue_date, t.due_date, 
-                                           COALESCE(b.name, '[DELETED BOOK]') AS book_name, 
-                                           COALESCE(s.name, '[DELETED STUDENT]') AS student_name, 
-                                           COALESCE(s.admission_no, 'N/A') AS admission_no,
-                                           COALESCE(s.batch, '-') AS batch
-                                           FROM transactions t
-                                           LEFT JOIN books b ON t.book_id = b.id
-                                           LEFT JOIN students s ON t.student_id = s.id
-                                           WHERE t.return_date IS NULL
-                                           ORDER BY t.due_date ASC""").fetchall() 
+        transactions = conn.execute(ACTIVE_ISSUES_SQL).fetchall() 
     
     today_str = date.today().strftime('%Y-%m-%d')
     transactions_list = []
@@ -844,13 +2131,13 @@ def active_issues():
         
     return render_template("active_issues.html", transactions=transactions_list)
 
-@app.route("/transaction_history")
-@login_required 
-def transaction_history():
-    query = request.args.get('query', '')
-    status_filter = request.args.get('status', 'all')
-    
-    sql = """
+HISTORY_PER_PAGE = 50
+
+def transaction_history_sql(query, status_filter):
+    """Builds the filtered history query (without ORDER BY) and its params."""
+    # Active loans are never archived, so they skip the archive side entirely.
+    source = 'transactions' if status_filter == 'active' else 'all_transactions'
+    sql = f"""
         SELECT t.id, 
                COALESCE(b.name, '[DELETED BOOK]') AS book_name, 
                COALESCE(s.name, '[DELETED STUDENT]') AS student_name, 
@@ -858,7 +2145,7 @@ def transaction_history():
                COALESCE(s.batch, '-') AS batch,
                t.issue_date, 
                t.return_date
-        FROM transactions t
+        FROM {source} t
         LEFT JOIN books b ON t.book_id = b.id
         LEFT JOIN students s ON t.student_id = s.id
     """
@@ -875,51 +2162,474 @@ def transaction_history():
     elif status_filter == 'returned':
         conditions.append("t.return_date IS NOT NULL")
 
+    return sql, conditions, params
+
+def transaction_history_page(conn, query, status_filter, cursor=None, per_page=HISTORY_PER_PAGE):
+    """Returns one page of history, newest first, and the cursor for the next page.
+
+    The cursor is the id of the last row shown; the next page seeks past it
+    with t.id < cursor, so deep pages cost the same as the first.
+    """
+    sql, conditions, params = transaction_history_sql(query, status_filter)
+    if cursor:
+        conditions.append("t.id < ?")
+        params.append(int(cursor))
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY t.id DESC LIMIT ?"
+
+    rows = conn.execute(sql, tuple(params + [per_page + 1])).fetchall()
+    next_cursor = str(rows[per_page - 1]['id']) if len(rows) > per_page else None
+    return rows[:per_page], next_cursor
+
+def iter_transaction_history(query, status_filter, batch_size=500):
+    """Yields every matching history row, fetching from the cursor in batches."""
+    sql, conditions, params = transaction_history_sql(query, status_filter)
     if conditions:
         sql += " WHERE " + " AND ".join(conditions)
-        
     sql += " ORDER BY t.id DESC"
+    with get_connection() as conn:
+        rows = conn.execute(sql, tuple(params))
+        while True:
+            batch = rows.fetchmany(batch_size)
+            if not batch:
+                break
+            yield from batch
+
+@app.route("/transaction_history")
+@login_required 
+def transaction_history():
+    query = request.args.get('query', '')
+    status_filter = request.args.get('status', 'all')
+
+    if request.args.get('all') == '1':
+        # Streamed mode: render every row without holding them all in memory.
+        return stream_template("transaction_history.html",
+                               transactions=iter_transaction_history(query, status_filter),
+                               next_cursor=None,
+                               streaming=True,
+                               search_query=query,
+                               current_status=status_filter)
 
     with get_connection() as conn:
-        transactions = conn.execute(sql, tuple(params)).fetchall()
+        transactions, next_cursor = transaction_history_page(conn, query, status_filter)
         
     return render_template("transaction_history.html", 
                            transactions=transactions,
+                           next_cursor=next_cursor,
+                           streaming=False,
                            search_query=query,
                            current_status=status_filter)
 
+@app.route("/api/transaction_history")
+@login_required
+@conditional_get('transactions', 'books', 'students')
+def api_transaction_history():
+    query = request.args.get('query', '')
+    status_filter = request.args.get('status', 'all')
+    cursor = request.args.get('cursor', '')
+    if cursor and not (cursor.isascii() and cursor.isdigit()):
+        return jsonify({'error': "Invalid pagination cursor."}), 400
+
+    with get_connection() as conn:
+        transactions, next_cursor = transaction_history_page(conn, query, status_filter, cursor)
+
+    return jsonify({
+        'transactions': [dict(row) for row in transactions],
+        'pagination': {
+            'per_page': HISTORY_PER_PAGE,
+            'next_cursor': next_cursor
+        }
+    })
+
+# ----------------- EXPORTS -----------------
+# Exports stream straight from a database cursor, so memory stays flat no
+# matter how many rows there are. Readers never block writers in WAL mode.
+EXPORT_BATCH_SIZE = 1000
+
+def export_books_query(args):
+    conditions, params = book_filters(args.get('query', ''), args.get('filter', 'all'))
+    sql = "SELECT id, custom_id, name, author, available, borrow_count FROM books"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    return sql + " ORDER BY name ASC, id ASC", params
+
+def export_students_query(args):
+    conditions, params = student_filters(args.get('query', ''), args.get('batch', 'all'), args.get('status', 'all'))
+    sql = """SELECT s.id, s.admission_no, s.name, s.batch, sa.is_approved, s.borrow_count
+             FROM students s LEFT JOIN students_auth sa ON s.admission_no = sa.admission_no"""
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    return sql + " ORDER BY s.name ASC, s.id ASC", params
+
+def export_active_issues_query(args):
+    return ACTIVE_ISSUES_SQL, []
+
+def export_transactions_query(args):
+    sql, conditions, params = transaction_history_sql(args.get('query', ''), args.get('status', 'all'))
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    return sql + " ORDER BY t.id DESC", params
+
+EXPORTS = {
+    'books': export_books_query,
+    'students': export_students_query,
+    'active_issues': export_active_issues_query,
+    'transactions': export_transactions_query,
+}
+
+def iter_export_rows(sql, params):
+    """Yields the header row, then every data row, fetching in batches."""
+    with get_connection() as conn:
+        rows = conn.execute(sql, tuple(params))
+        yield [column[0] for column in rows.description]
+        while True:
+            batch = rows.fetchmany(EXPORT_BATCH_SIZE)
+            if not batch:
+                break
+            for row in batch:
+                yield tuple(row)
+
+def iter_csv(rows):
+    """Encodes rows as CSV text, one chunk per EXPORT_BATCH_SIZE rows."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+@app.route("/export/<dataset>.<fmt>")
+@login_required
+def export_data(dataset, fmt):
+    if dataset not in EXPORTS or fmt not in ('csv', 'xlsx'):
+        flash("Unknown export.", "danger")
+        return redirect(url_for('index'))
+
+    sql, params = EXPORTS[dataset](request.args)
+    filename = f"{dataset}_{date.today().strftime('%Y-%m-%d')}.{fmt}"
+
+    if fmt == 'csv':
+        return app.response_class(stream_with_context(iter_csv(iter_export_rows(sql, params))),
+                                  mimetype='text/csv',
+                                  headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+    try:
+        import openpyxl  # noqa: F401
+    except ImportError:
+        flash("Excel export needs the 'openpyxl' package. Download CSV instead.", "danger")
+        return redirect(request.referrer or url_for('index'))
+
+    # Building a workbook is CPU-bound, so it runs as a background job.
+    job_id = _jobs.submit('export', {'dataset': dataset, 'args': request.args.to_dict(), 'filename': filename},
+                          created_by=session.get('username'))
+    flash(f"Preparing {filename} as job #{job_id}. It will be ready to download here.", "success")
+    return redirect(url_for('jobs_page', job=job_id))
+
+# ----------------- BACKGROUND JOBS -----------------
+# Spreadsheet imports and Excel exports run on the job runner (jobs.py)
+# instead of inside the request, so a large file never ties up a worker
+# or hits the gunicorn timeout. The librarian gets a job page that polls
+# its progress and links the finished file.
+IMPORT_EXTENSIONS = ('.xlsx', '.csv')
+_jobs = JobRunner(DB_NAME)
+
+def job_import_books(job):
+    from bulk_import import BOOK_COLUMNS, count_rows, import_books, missing_columns, read_chunks
+    path = job.params['path']
+    missing = missing_columns(path, BOOK_COLUMNS)
+    if missing:
+        raise JobError(f"The file has no {', '.join(missing)} column.")
+    job.progress(0, count_rows(path), "Importing books...", force=True)
+    with get_connection() as conn:
+        report = import_books(conn, read_chunks(path, BOOK_COLUMNS), progress=job.progress)
+    forget_books(misses=True)
+    return import_summary(report)
+
+def job_import_students(job):
+    from bulk_import import STUDENT_COLUMNS, count_rows, import_students, missing_columns, read_chunks
+    path = job.params['path']
+    missing = missing_columns(path, STUDENT_COLUMNS)
+    if missing:
+        raise JobError(f"The file has no {', '.join(missing)} column.")
+    job.progress(0, count_rows(path), "Importing students...", force=True)
+    # Threads rather than processes: forking a web worker is unsafe, and
+    # hashlib.scrypt releases the GIL, so the hashes still use every core.
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor, get_connection() as conn:
+        report = import_students(conn, read_chunks(path, STUDENT_COLUMNS),
+                                 lambda passwords: hash_passwords(passwords, executor), progress=job.progress)
+    forget_students(*report['added_keys'])
+    invalidate_pending_count()
+    return import_summary(report)
+
+def import_summary(report):
+    """The import report without the full list of added keys, which can be huge."""
+    return {'added': report['added'], 'skipped': report['skipped'],
+            'skipped_rows': report['skipped_rows'][:200]}
+
+def job_export(job):
+    """Writes an Excel export to the job's folder."""
+    dataset = job.params['dataset']
+    sql, params = EXPORTS[dataset](job.params['args'])
+    with get_connection() as conn:
+        total = conn.execute(f"SELECT COUNT(*) FROM ({sql})", tuple(params)).fetchone()[0]
+    job.progress(0, total, "Exporting...", force=True)
+    filename = job.params['filename']
+    path = job.output_path(filename)
+    from openpyxl import Workbook
+    # Write-only workbooks stream rows to disk instead of keeping them in memory.
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(dataset)
+    for count, row in enumerate(iter_export_rows(sql, params)):
+        sheet.append(row)
+        job.progress(count, total)
+    job.progress(total, total, "Saving workbook...", force=True)
+    workbook.save(path)
+    return {'file': filename, 'rows': total}
+
+def job_archive_transactions(job):
+    moved = archive_transactions(job.params['older_than_days'],
+                                 progress=lambda done, total: job.progress(done, total, "Archiving returned loans...", force=True))
+    return {'moved': moved}
+
+_jobs.register('import_books', job_import_books)
+_jobs.register('import_students', job_import_students)
+_jobs.register('export', job_export)
+_jobs.register('archive_transactions', job_archive_transactions)
+
+@app.route("/jobs")
+@login_required
+def jobs_page():
+    return render_template('jobs.html', jobs=_jobs.recent(), highlight=request.args.get('job', type=int),
+                           archive_after_days=ARCHIVE_AFTER_DAYS, backups=_backups.list()[:5])
+
+@app.route("/api/jobs")
+@login_required
+def api_jobs():
+    return jsonify({'jobs': _jobs.recent()})
+
+@app.route("/api/jobs/<int:job_id>")
+@login_required
+def api_job(job_id):
+    job = _jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': "Job not found."}), 404
+    return jsonify(job)
+
+@app.route("/jobs/import/<kind>", methods=['POST'])
+@login_required
+def submit_import_job(kind):
+    if kind not in ('books', 'students'):
+        flash("Unknown import.", "danger")
+        return redirect(url_for('jobs_page'))
+    upload = request.files.get('file')
+    extension = os.path.splitext(upload.filename)[1].lower() if upload and upload.filename else ''
+    if extension not in IMPORT_EXTENSIONS:
+        flash("Choose an .xlsx or .csv file to import.", "danger")
+        return redirect(url_for('jobs_page'))
+    folder = os.path.join(_jobs.file_dir, 'uploads')
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"{kind}_{secrets.token_hex(8)}{extension}")
+    upload.save(path)
+    job_id = _jobs.submit(f'import_{kind}', {'path': path, 'filename': upload.filename}, created_by=session.get('username'))
+    flash(f"Import of '{upload.filename}' queued as job #{job_id}.", "success")
+    return redirect(url_for('jobs_page', job=job_id))
+
+@app.route("/jobs/archive", methods=['POST'])
+@login_required
+def submit_archive_job():
+    days = request.form.get('older_than_days', ARCHIVE_AFTER_DAYS, type=int)
+    if days is None or days < 0:
+        flash("Enter the age in days of the returned loans to archive.", "danger")
+        return redirect(url_for('jobs_page'))
+    job_id = _jobs.submit('archive_transactions', {'older_than_days': days}, created_by=session.get('username'))
+    flash(f"Archiving loans returned more than {days} days ago as job #{job_id}.", "success")
+    return redirect(url_for('jobs_page', job=job_id))
+
+@app.route("/jobs/<int:job_id>/cancel", methods=['POST'])
+@login_required
+def cancel_job(job_id):
+    if _jobs.cancel(job_id):
+        flash(f"Job #{job_id} is being cancelled.", "success")
+    else:
+        flash(f"Job #{job_id} has already finished.", "danger")
+    return redirect(url_for('jobs_page'))
+
+@app.route("/jobs/<int:job_id>/retry", methods=['POST'])
+@login_required
+def retry_job(job_id):
+    if _jobs.retry(job_id):
+        flash(f"Job #{job_id} queued again.", "success")
+    else:
+        flash("Only failed or cancelled jobs can be retried.", "danger")
+    return redirect(url_for('jobs_page', job=job_id))
+
+@app.route("/jobs/<int:job_id>/download")
+@login_required
+def download_job_file(job_id):
+    job = _jobs.get(job_id)
+    if job is None or job['status'] != 'succeeded' or not (job['result'] or {}).get('file'):
+        flash("That file is not available.", "danger")
+        return redirect(url_for('jobs_page'))
+    return send_file(os.path.join(_jobs.file_dir, str(job_id), job['result']['file']), as_attachment=True)
+
+# ----------------- BACKUPS -----------------
+# Online snapshots of library.db and the loan archive (backups.py). They
+# run as a background job from the jobs page, or from cron or a sidecar
+# through manage_backups.py.
+_backups = BackupManager(DB_NAME, ARCHIVE_DB)
+
+def job_backup(job):
+    manifest = _backups.snapshot(progress=lambda done, total: job.progress(done, total, "Copying pages..."))
+    return {'snapshot': manifest['name'], 'bytes': sum(entry['bytes'] for entry in manifest['files'].values())}
+
+_jobs.register('backup', job_backup)
+
+def restore_backup(name, progress=None):
+    """Restores a snapshot over the live databases and settles what depends on them."""
+    with get_connection() as conn:
+        before, _ = data_versions(conn)
+    manifest = _backups.restore(name, progress)
+    _pool.dispose()
+
+    def settle(conn):
+        # Keep the change counters moving forward, so no ETag or cache
+        # stamp from before the restore can match the restored data.
+        restored, _ = data_versions(conn)
+        now = int(time.time())
+        for table in VERSIONED_TABLES:
+            conn.execute("UPDATE library_stats SET value = ? WHERE key = ?",
+                         (max(before[table], restored[table]) + 1, f'version:{table}'))
+            conn.execute("UPDATE library_stats SET value = ? WHERE key = ?", (now, f'modified:{table}'))
+        # A loan archived while the snapshot was taken can be in both copies.
+        ids = [row[0] for row in conn.execute("""SELECT t.id FROM main.transactions t
+                                                 JOIN archive.transactions_archive a ON a.id = t.id""")]
+        return archive_batch(conn, ids) if ids else 0
+    run_write(settle)
+    _shared_cache.clear()
+    if reports.status(REPORTS_DB)['built']:
+        refresh_rollups(rebuild=True)  # their watermark refers to the change log before the restore
+    return manifest
+
+@app.route("/jobs/backup", methods=['POST'])
+@login_required
+def submit_backup_job():
+    job_id = _jobs.submit('backup', {}, created_by=session.get('username'))
+    flash(f"Backup queued as job #{job_id}.", "success")
+    return redirect(url_for('jobs_page', job=job_id))
+
+# ----------------- REPORTS -----------------
+# Circulation reports and charts, read only from the rollups.
+def report_range():
+    """(start, end) ISO dates from the query string; the last 90 days by default."""
+    end = request.args.get('end') or date.today().isoformat()
+    start = request.args.get('start') or (date.fromisoformat(end) - timedelta(days=89)).isoformat()
+    if date.fromisoformat(start) > date.fromisoformat(end):
+        raise ValueError("The start date is after the end date.")
+    return start, end
+
+def report_api(build):
+    """Wraps a report in the JSON envelope shared by the report endpoints."""
+    @wraps(build)
+    def decorated_function():
+        if not fresh_rollups():
+            return jsonify({'built': False, 'rows': []})
+        try:
+            start, end = report_range()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'built': True, 'start': start, 'end': end, 'rows': build(reports, start, end),
+                        'refreshed_at': reports.status(REPORTS_DB)['refreshed_at']})
+    return decorated_function
+
+def job_build_rollups(job):
+    refresh_rollups(rebuild=True, progress=lambda done, total: job.progress(done, total, "Reading loans..."))
+    return {'rollups': 'built', 'watermark': reports.status(REPORTS_DB)['watermark']}
+
+_jobs.register('build_rollups', job_build_rollups)
+
+@app.route("/reports")
+@login_required
+def reports_page():
+    try:
+        start, end = report_range()
+    except ValueError:
+        flash("Enter a valid date range.", "danger")
+        start, end = (date.today() - timedelta(days=89)).isoformat(), date.today().isoformat()
+    return render_template('reports.html', status=reports.status(REPORTS_DB), start=start, end=end)
+
+@app.route("/api/reports/circulation")
+@login_required
+@report_api
+def api_report_circulation(reports, start, end):
+    grain = 'month' if request.args.get('grain') == 'month' else 'day'
+    return reports.circulation(REPORTS_DB, grain, start, end, batch=request.args.get('batch'))
+
+@app.route("/api/reports/batches")
+@login_required
+@report_api
+def api_report_batches(reports, start, end):
+    return reports.batch_summary(REPORTS_DB, start, end)
+
+@app.route("/api/reports/books")
+@login_required
+@report_api
+def api_report_books(reports, start, end):
+    rows = reports.top_books(REPORTS_DB, start, end, limit=min(request.args.get('limit', 20, type=int), 100))
+    with get_connection() as conn:
+        books = {row['id']: row for row in conn.execute(
+            "SELECT id, custom_id, name, author FROM books WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps([row['book_id'] for row in rows]),))}
+    for row in rows:
+        book = books.get(row['book_id'])
+        row.update(custom_id=book['custom_id'] if book else None, name=book['name'] if book else "(deleted book)",
+                   author=book['author'] if book else '')
+    return rows
+
+@app.route("/jobs/rollups", methods=['POST'])
+@login_required
+def submit_rollup_job():
+    job_id = _jobs.submit('build_rollups', {}, created_by=session.get('username'))
+    flash(f"Building the report rollups as job #{job_id}.", "success")
+    return redirect(url_for('jobs_page', job=job_id))
+
 @app.route("/search_books", methods=["GET", "POST"])
 @login_required 
 def search_books():
     results = []
     if request.method == "POST":
         query = request.form["query"].strip()
+        fts_query = build_fts_query(query)
         with get_connection() as conn:
-            search_term = f"%{query}%"
-            results = conn.execute("""SELECT * FROM books 
-                                           WHERE name LIKE ? 
-                                           OR author LIKE ?
-                                           OR custom_id LIKE ?
-                                           OR id LIKE ?
-                                           ORDER BY name ASC""",
-                                           (search_term, search_term, search_term, search_term)).fetchall()
+            if not query:
+                results = conn.execute("SELECT * FROM books ORDER BY name ASC").fetchall()
+            elif not fts_query:
+                results = []  # only punctuation: nothing to match
+            else:
+                # Best matches first, ranked by bm25 across name, author and custom_id.
+                results = conn.execute("""SELECT b.* FROM books_fts
+                                               JOIN books b ON b.id = books_fts.rowid
+                                               WHERE books_fts MATCH ?
+                                               ORDER BY bm25(books_fts), b.name ASC""",
+                                               (fts_query,)).fetchall()
+                # A numeric query may also be a book's primary key.
+                if is_book_id(query) and all(row['id'] != int(query) for row in results):
+                    by_id = conn.execute("SELECT * FROM books WHERE id = ?", (int(query),)).fetchone()
+                    if by_id:
+                        results.insert(0, by_id)
     return render_template("search_books.html", results=results)
 
 # ----------------- AJAX ENDPOINTS (Unchanged) -----------------
 
 @app.route("/lookup_book/<book_id>")
 def lookup_book(book_id):
-    if not book_id:
-        return jsonify({"name": "Book not found", "available": False}), 404
-        
-    with get_connection() as conn:
-        # Query by either the primary key (id) or the custom_id
-        book = conn.execute("SELECT name, available FROM books WHERE id = ? OR custom_id = ?", 
-                            (book_id, book_id.upper())).fetchone()
-    
+    book = lookup_books([book_id]).get(book_id) if book_id.strip() else None
     if book:
         # The column names are 'name' and 'available'
-        return jsonify({"name": book["name"], "available": bool(book["available"])})
+        return jsonify({"name": book["name"], "available": book["available"]})
     else:
         return jsonify({"name": "Book not found", "available": False}), 404
 
@@ -930,14 +2640,25 @@ def lookup_student(admission_no):
     if not admission_no:
            return jsonify({'name': ''}), 404
            
-    with get_connection() as conn:
-        student = conn.execute("SELECT name FROM students WHERE admission_no=?", (admission_no,)).fetchone()
-    
+    student = lookup_students([admission_no]).get(admission_no)
     if student:
         return jsonify({'name': student["name"]}), 200
     
     return jsonify({'name': 'Student not found.'}), 404
 
+LOOKUP_BATCH_LIMIT = 500
+
+@app.route("/api/lookup", methods=["POST"])
+@login_required
+def api_lookup():
+    """Resolves many book ids and admission numbers in one call."""
+    data = request.get_json(silent=True) or {}
+    book_inputs = [str(value) for value in data.get('book_ids') or [] if str(value).strip()]
+    admission_nos = [str(value) for value in data.get('admission_nos') or [] if str(value).strip()]
+    if len(book_inputs) + len(admission_nos) > LOOKUP_BATCH_LIMIT:
+        return jsonify({'error': f"At most {LOOKUP_BATCH_LIMIT} ids can be looked up at once."}), 400
+    return jsonify({'books': lookup_books(book_inputs), 'students': lookup_students(admission_nos)})
+
 @app.route("/reset_student_password/<int:id>", methods=["POST"])
 @login_required
 def reset_student_password(id):
@@ -955,56 +2676,134 @@ def reset_student_password(id):
 
     try:
         hashed_pass = hash_password(new_password)
-        with get_connection() as conn_update:
-            conn_update.execute("UPDATE students_auth SET password_hash = ? WHERE admission_no = ?", 
-                                (hashed_pass, student['admission_no']))
+        write_statement("UPDATE students_auth SET password_hash = ? WHERE admission_no = ?",
+                        (hashed_pass, student['admission_no']))
         flash(f"Password for {student['name']} has been updated successfully.", "success")
     except Exception as e:
         flash(f"An error occurred while resetting the password: {str(e)}", "danger")
 
     return redirect(url_for('view_students'))
 
-@app.context_processor
-def inject_pending_count():
-    """Injects the count of pending student approvals into all templates."""
-    with get_connection() as conn:
-        try:
-            count = conn.execute("SELECT COUNT(id) FROM students_auth WHERE is_approved = 0").fetchone()[0]
-            return dict(pending_count=count)
-        except:
-            return dict(pending_count=0)
+@app.route("/api/pool_stats")
+@login_required
+def api_pool_stats():
+    """Connection pool hit/miss counters for this worker process."""
+    return jsonify(_pool.stats())
+
+@app.route("/api/shared_cache_stats")
+@login_required
+def api_shared_cache_stats():
+    """Size of the shared result cache; hit ratios are on /metrics."""
+    return jsonify(_shared_cache.stats())
+
+@app.route("/metrics")
+def prometheus_metrics():
+    """Request and SQL metrics for all workers, for Prometheus to scrape.
+
+    Scrapers send `Authorization: Bearer $METRICS_TOKEN`; a logged-in
+    librarian can also open it in the browser.
+    """
+    supplied = request.headers.get('Authorization', '')
+    token_ok = bool(METRICS_TOKEN) and hmac.compare_digest(supplied, f"Bearer {METRICS_TOKEN}")
+    if not token_ok and not session.get('logged_in'):
+        if METRICS_TOKEN or supplied:
+            return "Unauthorized\n", 401, {'Content-Type': 'text/plain'}
+        flash('Please log in to access this page.', 'danger')
+        return redirect(url_for('login'))
+    return metrics.render(metrics.collect()), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.route("/slow_queries")
+@login_required
+def slow_queries_report():
+    """Slowest statements by total time, from every worker's slow-query log."""
+    return render_template('slow_queries.html', offenders=_slow_queries.report(),
+                           threshold_ms=_slow_queries.threshold * 1000, dropped=_slow_queries.dropped)
+
+@app.route("/slow_queries/clear", methods=['POST'])
+@login_required
+def clear_slow_queries():
+    _slow_queries.clear()
+    flash("Slow-query log cleared.", "success")
+    return redirect(url_for('slow_queries_report'))
+
+@app.route("/api/write_queue_stats")
+@login_required
+def api_write_queue_stats():
+    """Group-commit batch sizes and queue latency for this worker process."""
+    return jsonify(_write_queue.stats() if _write_queue is not None else {'enabled': False})
+
+def book_filters(query, availability_filter):
+    """WHERE conditions and params for the book list: full-text match plus availability."""
+    params = []
+    conditions = []
+
+    fts_query = build_fts_query(query)
+    if fts_query:
+        conditions.append("id IN (SELECT rowid FROM books_fts WHERE books_fts MATCH ?)")
+        params.append(fts_query)
+    elif query and query.strip():
+        conditions.append("0")  # only punctuation: nothing to match, as with the old LIKE search
+        
+    if availability_filter == 'available':
+        conditions.append("available = 1")
+    elif availability_filter == 'issued':
+        conditions.append("available = 0")
+
+    return conditions, params
+
+def book_listing(query, availability_filter):
+    """SELECT, FROM, conditions, params and (sort, id) columns for a page of books.
+
+    With search words the books come best match first, by the bm25 rank of
+    the full-text index, as on the search page; otherwise they go by name.
+    """
+    fts_query = build_fts_query(query)
+    if not fts_query:
+        conditions, params = book_filters(query, availability_filter)
+        return "SELECT * ", "FROM books", conditions, params, "name", "id"
+    conditions, params = book_filters('', availability_filter)
+    return ("SELECT books.*, books_fts.rank ", "FROM books JOIN books_fts ON books_fts.rowid = books.id",
+            ["books_fts MATCH ?"] + conditions, [fts_query] + params, "books_fts.rank", "books.id")
 
 @app.route("/api/view_books")
 @login_required
+@conditional_get('books')
 def api_view_books():
     BOOKS_PER_PAGE = 15
     page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     query = request.args.get('query', '')
     availability_filter = request.args.get('filter', 'all')
     
     base_sql = "FROM books"
     count_sql = "SELECT COUNT(id) "
-    select_sql = "SELECT * "
-    params = []
-    
-    conditions = []
-    if query:
-        search_term = f"%{query}%"
-        conditions.append("(name LIKE ? OR author LIKE ? OR custom_id LIKE ?)")
-        params.extend([search_term, search_term, search_term])
-        
-    if availability_filter == 'available':
-        conditions.append("available = 1")
-    elif availability_filter == 'issued':
-        conditions.append("available = 0")
+    conditions, params = book_filters(query, availability_filter)
+    select_sql, page_sql, page_conditions, page_params, sort_col, id_col = book_listing(query, availability_filter)
         
+    where_clause = ""
     if conditions:
         where_clause = " WHERE " + " AND ".join(conditions)
-        base_sql += where_clause
     
     with get_connection() as conn:
-        full_count_sql = count_sql + base_sql
-        total_books = conn.execute(full_count_sql, tuple(params)).fetchone()[0]
+        if cursor is not None:
+            # Cursor mode: seek on (name or rank, id); the total is opt-in and cached.
+            try:
+                books_data, next_cursor, prev_cursor = keyset_page(
+                    conn, select_sql, page_sql, page_conditions, page_params,
+                    sort_col, id_col, BOOKS_PER_PAGE, cursor)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            pagination = {
+                'per_page': BOOKS_PER_PAGE,
+                'next_cursor': next_cursor,
+                'prev_cursor': prev_cursor
+            }
+            if request.args.get('count') == '1':
+                pagination['total_books'] = cached_count(conn, count_sql + base_sql + where_clause, params)
+            return jsonify({'books': [dict(row) for row in books_data], 'pagination': pagination})
+
+        # Page-number mode (kept for compatibility)
+        total_books = cached_count(conn, count_sql + base_sql + where_clause, params)
         
         total_pages = 1
         if total_books > 0:
@@ -1017,8 +2816,10 @@ def api_view_books():
 
         offset = (page - 1) * BOOKS_PER_PAGE
         
-        paginated_sql = select_sql + base_sql + " ORDER BY name ASC LIMIT ? OFFSET ?"
-        final_params = params + [BOOKS_PER_PAGE, offset]
+        if page_conditions:
+            page_sql += " WHERE " + " AND ".join(page_conditions)
+        paginated_sql = select_sql + page_sql + f" ORDER BY {sort_col} ASC, {id_col} ASC LIMIT ? OFFSET ?"
+        final_params = page_params + [BOOKS_PER_PAGE, offset]
         
         books_data = conn.execute(paginated_sql, tuple(final_params)).fetchall()
         books = [dict(row) for row in books_data]
@@ -1056,8 +2857,8 @@ def student_change_password():
             if user and check_password(user['password_hash'], current_password):
                 try:
                     new_hashed_password = hash_password(new_password)
-                    conn.execute("UPDATE students_auth SET password_hash = ? WHERE admission_no = ?", 
-                                 (new_hashed_password, student_adm_no))
+                    write_statement("UPDATE students_auth SET password_hash = ? WHERE admission_no = ?",
+                                    (new_hashed_password, student_adm_no))
                     flash("Your password has been updated successfully!", 'success')
                     return redirect(url_for('student_dashboard'))
                 except Exception as e:
@@ -1098,7 +2899,7 @@ def student_details(id):
         # 3. Get Student's loan history (returned books)
         loan_history = conn.execute("""
             SELECT b.name as book_name, t.issue_date, t.return_date
-            FROM transactions t
+            FROM all_transactions t
             JOIN books b ON t.book_id = b.id
             WHERE t.student_id = ? AND t.return_date IS NOT NULL
             ORDER BY t.return_date DESC
@@ -1111,33 +2912,43 @@ def student_details(id):
 
 @app.route("/api/student_search")
 @student_login_required
+@conditional_get('books')
 def api_student_search():
     BOOKS_PER_PAGE = 15
     page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     query = request.args.get('query', '')
     status_filter = request.args.get('status', 'all')
 
-    params = []
-    conditions = []
-    
-    if query:
-        search_term = f"%{query}%"
-        conditions.append("(name LIKE ? OR author LIKE ? OR custom_id LIKE ?)")
-        params.extend([search_term, search_term, search_term])
-        
-    if status_filter == 'available':
-        conditions.append("available = 1")
-    elif status_filter == 'issued':
-        conditions.append("available = 0")
+    conditions, params = book_filters(query, status_filter)
+    select_sql, page_sql, page_conditions, page_params, sort_col, id_col = book_listing(query, status_filter)
 
     where_clause = ""
     if conditions:
         where_clause = " WHERE " + " AND ".join(conditions)
     
     with get_connection() as conn:
-        # First, get the total count of books MATCHING THE FILTERS
         count_sql = "SELECT COUNT(id) FROM books" + where_clause
-        total_books = conn.execute(count_sql, tuple(params)).fetchone()[0]
+
+        if cursor is not None:
+            # Cursor mode: seek on (name or rank, id); the total is opt-in and cached.
+            try:
+                books_data, next_cursor, prev_cursor = keyset_page(
+                    conn, select_sql, page_sql, page_conditions, page_params,
+                    sort_col, id_col, BOOKS_PER_PAGE, cursor)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            pagination = {
+                'per_page': BOOKS_PER_PAGE,
+                'next_cursor': next_cursor,
+                'prev_cursor': prev_cursor
+            }
+            if request.args.get('count') == '1':
+                pagination['total_books'] = cached_count(conn, count_sql, params)
+            return jsonify({'books': [dict(row) for row in books_data], 'pagination': pagination})
+
+        # Page-number mode (kept for compatibility)
+        total_books = cached_count(conn, count_sql, params)
         
         # Calculate total pages
         total_pages = 1
@@ -1150,8 +2961,10 @@ def api_student_search():
         offset = (page - 1) * BOOKS_PER_PAGE
         
         # Prepare the final query to get just one page of books
-        select_sql = "SELECT * FROM books" + where_clause + " ORDER BY name ASC LIMIT ? OFFSET ?"
-        final_params = params + [BOOKS_PER_PAGE, offset]
+        if page_conditions:
+            page_sql += " WHERE " + " AND ".join(page_conditions)
+        select_sql += page_sql + f" ORDER BY {sort_col} ASC, {id_col} ASC LIMIT ? OFFSET ?"
+        final_params = page_params + [BOOKS_PER_PAGE, offset]
         
         books_data = conn.execute(select_sql, tuple(final_params)).fetchall()
         books = [dict(row) for row in books_data]
@@ -0,0 +1,30 @@
+"""Moves returned loans older than a cutoff into the archive database.
+
+    python archive_transactions.py                 # loans returned over ARCHIVE_AFTER_DAYS (365) days ago
+    python archive_transactions.py --days 180 --batch-size 5000
+
+Safe to run while the app is serving requests, and to stop and start
+again: loans move in small batches. Archived loans stay in the
+transaction history and the borrow counts. The same job can be started
+from the Background Jobs page.
+"""
+import argparse
+import sys
+
+from app import ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE, ARCHIVE_DB, archive_transactions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS, help="archive loans returned more than this many days ago")
+    parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE, help="loans moved per transaction")
+    args = parser.parse_args()
+
+    def report(moved, total):
+        print(f"\rMoved {moved} of {total} loans...", end='', flush=True)
+
+    moved = archive_transactions(args.days, args.batch_size, progress=report)
+    print(f"\nArchived {moved} loans into {ARCHIVE_DB}.")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
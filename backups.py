@@ -0,0 +1,259 @@
+"""Online backups of the library database with the SQLite backup API.
+
+A snapshot copies the library database, and the loan archive attached to
+it, while the app keeps serving requests:
+
+- The copy is made with sqlite3's backup API, BACKUP_PAGES pages per step
+  with a BACKUP_SLEEP pause between steps, so it never holds the disk for
+  long. In WAL mode a reader does not block writers, so circulation goes on.
+- A read transaction is held on the source for the whole copy. Without it,
+  every write from another connection makes the backup start over; with it,
+  each database is copied as of one moment. The main database is pinned
+  before the archive, so a loan being archived meanwhile may show up in
+  both copies but never in neither.
+- Each copy passes PRAGMA quick_check, is gzipped if BACKUP_COMPRESS is on,
+  and has its SHA-256 recorded in the snapshot's manifest.json. Snapshots are
+  written to a .partial folder and renamed once complete.
+- Only the newest BACKUP_KEEP snapshots are kept.
+
+restore() checks a snapshot's checksums and integrity, then copies it back
+over the live files, again with the backup API, so connections that are
+still open see the restored data on their next transaction.
+
+Pages copied, bytes written, run outcomes and durations go to the metrics
+registry.
+"""
+import datetime
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import sqlite3
+import time
+
+import metrics
+
+BACKUP_DIR = os.environ.get('BACKUP_DIR')
+BACKUP_KEEP = int(os.environ.get('BACKUP_KEEP', 14))
+BACKUP_PAGES = int(os.environ.get('BACKUP_PAGES', 256))  # pages copied per step
+BACKUP_SLEEP = float(os.environ.get('BACKUP_SLEEP', 0.01))  # seconds between steps
+BACKUP_COMPRESS = os.environ.get('BACKUP_COMPRESS', '1') == '1'
+DURATION_BUCKETS = (1, 5, 15, 60, 300, 900, 3600)
+STALE_PARTIAL = 86400  # seconds before an abandoned .partial folder is removed
+
+class BackupError(Exception):
+    """A snapshot is missing, incomplete or fails verification."""
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def quick_check(path):
+    conn = sqlite3.connect(path)
+    try:
+        result = conn.execute("PRAGMA quick_check").fetchone()[0]
+    finally:
+        conn.close()
+    if result != 'ok':
+        raise BackupError(f"{os.path.basename(path)} failed its integrity check: {result}")
+
+class BackupManager:
+    """Takes, lists, verifies, prunes and restores snapshots in one folder."""
+    def __init__(self, db_name, archive_path=None, path=BACKUP_DIR, keep=BACKUP_KEEP,
+                 pages=BACKUP_PAGES, sleep=BACKUP_SLEEP, compress=BACKUP_COMPRESS):
+        self.db_name = db_name
+        self.archive_path = archive_path
+        self.path = path or os.path.splitext(db_name)[0] + '_backups'
+        self.keep = keep
+        self.pages = pages
+        self.sleep = sleep
+        self.compress = compress
+
+    def databases(self):
+        """{schema name: live file} for the databases a snapshot covers."""
+        databases = {'main': self.db_name}
+        if self.archive_path:
+            databases['archive'] = self.archive_path
+        return databases
+
+    # --- Snapshots ---
+    def snapshot(self, progress=None):
+        """Takes a snapshot and prunes old ones; returns its manifest.
+
+        progress, if given, is called as progress(pages done, pages total).
+        """
+        started = time.perf_counter()
+        name, folder, partial = self._claim(datetime.datetime.now().strftime('%Y%m%d-%H%M%S'))
+        try:
+            files = self._copy(partial, progress)
+            manifest = {'name': name, 'created_at': time.time(), 'compressed': self.compress,
+                        'duration': round(time.perf_counter() - started, 3), 'files': files}
+            with open(os.path.join(partial, 'manifest.json'), 'w') as f:
+                json.dump(manifest, f, indent=2)
+            os.rename(partial, folder)
+        except BaseException:
+            shutil.rmtree(partial, ignore_errors=True)
+            metrics.registry.inc('library_backup_runs_total', {'result': 'failed'})
+            raise
+        metrics.registry.inc('library_backup_runs_total', {'result': 'succeeded'})
+        metrics.registry.observe('library_backup_duration_seconds', {}, manifest['duration'], DURATION_BUCKETS)
+        self.prune()
+        return manifest
+
+    def _claim(self, stamp):
+        """Creates the .partial folder of a new snapshot; returns (name, folder, partial).
+
+        Names have one-second resolution, so a second snapshot in the same
+        second (two queued jobs, a double click) becomes stamp-1, stamp-2, ...
+        """
+        os.makedirs(self.path, exist_ok=True)
+        for attempt in itertools.count():
+            name = f"{stamp}-{attempt}" if attempt else stamp
+            folder = os.path.join(self.path, name)
+            if os.path.exists(folder):
+                continue
+            try:
+                os.mkdir(folder + '.partial')
+            except FileExistsError:
+                continue  # another snapshot is being written under this name
+            if os.path.exists(folder):  # finished and renamed in between
+                os.rmdir(folder + '.partial')
+                continue
+            return name, folder, folder + '.partial'
+
+    def _copy(self, folder, progress):
+        databases = self.databases()
+        source = sqlite3.connect(self.db_name, timeout=30, isolation_level=None)
+        try:
+            if 'archive' in databases:
+                source.execute("ATTACH DATABASE ? AS archive", (databases['archive'],))
+            # Pin one read snapshot per database for the whole copy; main first.
+            source.execute("BEGIN")
+            sizes = {schema: source.execute(f"PRAGMA {schema}.page_count").fetchone()[0] for schema in databases}
+            total, done = sum(sizes.values()), 0
+            files = {}
+            for schema, live_path in databases.items():
+                copy_path = os.path.join(folder, os.path.basename(live_path))
+                copied = self._backup(source, schema, copy_path, lambda pages: progress and progress(done + pages, total))
+                done += sizes[schema]
+                quick_check(copy_path)
+                if self.compress:
+                    copy_path = self._gzip(copy_path)
+                size = os.path.getsize(copy_path)
+                metrics.registry.inc('library_backup_bytes_total', {'database': schema}, size)
+                files[schema] = {'file': os.path.basename(copy_path), 'sha256': file_sha256(copy_path),
+                                 'bytes': size, 'pages': copied}
+            source.execute("COMMIT")
+        finally:
+            source.close()
+        return files
+
+    def _backup(self, source, schema, copy_path, progress):
+        """Copies one schema of source into a new file, a step at a time; returns the page count."""
+        target = sqlite3.connect(copy_path)
+        state = {'copied': 0}
+        def step(status, remaining, total):
+            metrics.registry.inc('library_backup_pages_total', {'database': schema}, total - remaining - state['copied'])
+            state['copied'] = total - remaining
+            progress(state['copied'])
+            if remaining:
+                time.sleep(self.sleep)  # let the desk's writes through between steps
+        try:
+            source.backup(target, pages=self.pages, progress=step, name=schema)
+        finally:
+            target.close()
+        return state['copied']
+
+    def _gzip(self, path):
+        with open(path, 'rb') as raw, gzip.open(path + '.gz', 'wb', compresslevel=6) as packed:
+            shutil.copyfileobj(raw, packed, 1024 * 1024)
+        os.remove(path)
+        return path + '.gz'
+
+    def list(self):
+        """Manifests of the complete snapshots, newest first."""
+        if not os.path.isdir(self.path):
+            return []
+        manifests = []
+        for name in sorted(os.listdir(self.path), reverse=True):
+            try:
+                manifests.append(self.manifest(name))
+            except BackupError:
+                continue  # still being written, or not a snapshot
+        return manifests
+
+    def manifest(self, name):
+        try:
+            with open(os.path.join(self.path, name, 'manifest.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            raise BackupError(f"No complete snapshot named {name!r} in {self.path}.")
+
+    def prune(self):
+        """Removes all but the newest `keep` snapshots, and abandoned partial ones."""
+        for manifest in self.list()[self.keep:]:
+            shutil.rmtree(os.path.join(self.path, manifest['name']), ignore_errors=True)
+        for name in os.listdir(self.path):
+            folder = os.path.join(self.path, name)
+            if name.endswith('.partial') and time.time() - os.path.getmtime(folder) > STALE_PARTIAL:
+                shutil.rmtree(folder, ignore_errors=True)
+
+    # --- Verify and restore ---
+    def verify(self, name, unpack_dir=None):
+        """Checks every file of a snapshot against its checksum and runs PRAGMA quick_check.
+
+        Returns the manifest. With unpack_dir, the checked database files are
+        left there, decompressed, as {schema: path} under manifest['unpacked'].
+        """
+        manifest = self.manifest(name)
+        folder = os.path.join(self.path, name)
+        unpacked = {}
+        for schema, entry in manifest['files'].items():
+            path = os.path.join(folder, entry['file'])
+            if not os.path.exists(path):
+                raise BackupError(f"{entry['file']} is missing from snapshot {name}.")
+            if file_sha256(path) != entry['sha256']:
+                raise BackupError(f"{entry['file']} in snapshot {name} does not match its checksum.")
+            target = os.path.join(unpack_dir or folder, os.path.basename(path).removesuffix('.gz') + '.check')
+            if path.endswith('.gz'):
+                with gzip.open(path, 'rb') as packed, open(target, 'wb') as raw:
+                    shutil.copyfileobj(packed, raw, 1024 * 1024)
+            else:
+                shutil.copyfile(path, target)
+            try:
+                quick_check(target)
+            except BackupError:
+                os.remove(target)
+                raise
+            if unpack_dir:
+                unpacked[schema] = target
+            else:
+                os.remove(target)
+        return dict(manifest, unpacked=unpacked)
+
+    def restore(self, name, progress=None):
+        """Verifies a snapshot, then copies it over the live databases; returns the manifest."""
+        databases = self.databases()
+        unpack_dir = os.path.join(self.path, name + '.restore')
+        os.makedirs(unpack_dir, exist_ok=True)
+        try:
+            manifest = self.verify(name, unpack_dir)
+            for schema, copy_path in manifest['unpacked'].items():
+                if schema not in databases:
+                    continue
+                source = sqlite3.connect(copy_path)
+                target = sqlite3.connect(databases[schema], timeout=30)
+                try:
+                    # One step: writers wait for the restore instead of seeing half of it.
+                    source.backup(target, progress=progress and (lambda status, remaining, total: progress(total - remaining, total)))
+                finally:
+                    source.close()
+                    target.close()
+        finally:
+            shutil.rmtree(unpack_dir, ignore_errors=True)
+        return manifest
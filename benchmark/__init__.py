@@ -0,0 +1,9 @@
+"""Performance benchmarks for the library app.
+
+    python -m benchmark.generate --scale full        # build benchmark/bench.db
+    python -m benchmark.run                          # time every route, write JSON
+    python -m benchmark.compare before.json after.json
+
+The generator is deterministic for a given seed and end date, so two runs
+against databases built with the same arguments can be compared directly.
+"""
@@ -0,0 +1,59 @@
+"""Compares two benchmark result files route by route.
+
+    python -m benchmark.compare before.json after.json
+    python -m benchmark.compare before.json after.json --threshold 10
+
+Prints the change in p50/p95/p99 latency and throughput for each route.
+Exits 1 if any route's p95 got worse by more than --threshold percent.
+"""
+import argparse
+import json
+import sys
+
+METRICS = ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps')
+
+def change(before, after):
+    """Percentage change from before to after (None if before is zero)."""
+    return (after - before) / before * 100 if before else None
+
+def compare(before, after, threshold):
+    """Prints a comparison table; returns the routes whose p95 regressed past threshold."""
+    for label, run in (('before', before), ('after', after)):
+        meta = run['meta']
+        print(f"{label}: {meta['started_at']} commit {meta.get('git_commit') or '?'}, "
+              f"{meta['mode']}, {meta['clients']} clients, {meta['db_counts']}")
+    print(f"{'route':<26}" + "".join(f"{metric:>18}" for metric in METRICS))
+
+    regressions = []
+    for name in before['routes']:
+        if name not in after['routes']:
+            continue
+        old, new = before['routes'][name], after['routes'][name]
+        cells = []
+        for metric in METRICS:
+            delta = change(old[metric], new[metric])
+            cells.append(f"{new[metric]:>9.2f} ({'   n/a' if delta is None else f'{delta:+5.0f}%'})")
+        print(f"{name:<26}" + "".join(f"{cell:>18}" for cell in cells))
+        delta = change(old['p95_ms'], new['p95_ms'])
+        if delta is not None and delta > threshold:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=20.0, help="allowed p95 slowdown in percent")
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    regressions = compare(before, after, args.threshold)
+    if regressions:
+        print(f"p95 regressed by more than {args.threshold:.0f}%: {', '.join(regressions)}")
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
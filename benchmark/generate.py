@@ -0,0 +1,207 @@
+"""Deterministic synthetic library for benchmarks.
+
+Builds a database with the app's own schema, triggers and indexes, filled
+with a realistic-looking library:
+
+- Book popularity and reader activity are Zipf-like, so a few titles and
+  students account for most loans.
+- Loans are spread evenly over the three years before the end date. Ids
+  follow issue order, as they do in production.
+- Most loans come back before they are due, some come back late, and a
+  few are still out and overdue.
+- Every book has at most one active loan, and books.available matches.
+
+Every student's portal password is "password". The triggers and secondary
+indexes are dropped while loading and rebuilt at the end, which is much
+faster than maintaining them row by row.
+
+    python -m benchmark.generate                          # small scale
+    python -m benchmark.generate --scale full             # 200k books, 50k students, 3M loans
+    python -m benchmark.generate --books 5000 --seed 7 --output /tmp/lib.db
+"""
+import argparse
+import datetime
+import itertools
+import os
+import random
+import re
+import sqlite3
+import sys
+import time
+
+DEFAULT_DB = os.path.join(os.path.dirname(__file__), 'bench.db')
+
+# (books, students, transactions)
+SCALES = {
+    'small': (2_000, 500, 30_000),
+    'medium': (20_000, 5_000, 300_000),
+    'full': (200_000, 50_000, 3_000_000),
+}
+
+HISTORY_DAYS = 3 * 365
+LOAN_PERIODS = (7, 14, 14, 14, 30)
+CHUNK = 50_000
+
+TITLE_WORDS = """
+    ancient silent river garden shadow kingdom light winter summer secret
+    lost hidden city ocean mountain forest storm fire glass iron golden
+    broken last first night morning history science theory practice guide
+    introduction principles modern classic elements world life death love
+    war peace journey return empire machine code number island voice memory
+    dream stone star sky earth water wind bridge road house window door
+""".split()
+FIRST_NAMES = """
+    Aarav Aditi Amir Ana Arjun Ben Chen Clara David Diya Elena Emma Farah
+    Felix Grace Hana Hugo Ines Isaac Ishaan Jamal Julia Kabir Kavya Leo
+    Lina Lucas Maya Meera Mohan Nadia Noah Omar Priya Rahul Rosa Sara
+    Sofia Tara Tomas Uma Vikram Wei Yara Yusuf Zara
+""".split()
+LAST_NAMES = """
+    Ahmed Banerjee Chen Costa Das Fischer Garcia Gupta Haddad Iyer Jensen
+    Joshi Kapoor Khan Kim Kumar Lee Lopez Mehta Menon Mueller Nair Novak
+    Okafor Patel Pereira Rao Reddy Rossi Sato Sharma Silva Singh Smith
+    Tanaka Thomas Varma Wang Weber Yadav
+""".split()
+
+def zipf_weights(n, s=1.1):
+    """Cumulative Zipf weights for n items, for random.choices(cum_weights=...)."""
+    return list(itertools.accumulate(1 / (rank ** s) for rank in range(1, n + 1)))
+
+def person_name(rng):
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+def book_rows(rng, count):
+    authors = [person_name(rng) for _ in range(max(1, count // 8))]
+    author_weights = zipf_weights(len(authors), 0.8)
+    for i in range(count):
+        words = rng.sample(TITLE_WORDS, rng.randint(2, 4))
+        title = " ".join(word.capitalize() for word in words)
+        if rng.random() < 0.1:
+            title += f", Volume {rng.randint(2, 6)}"
+        custom_id = f"BK{i + 1:06d}" if rng.random() < 0.9 else None
+        author = rng.choices(authors, cum_weights=author_weights)[0]
+        yield custom_id, title, author
+
+def student_rows(rng, count, end_year):
+    for i in range(count):
+        batch = str(end_year - rng.randint(0, 6))
+        yield f"ADM{i + 1:06d}", person_name(rng), batch
+
+def transaction_rows(rng, books, students, count, end):
+    """Yields (book_id, student_id, issue_date, due_date, return_date) in issue order."""
+    start = end - datetime.timedelta(days=HISTORY_DAYS)
+    day = [(start + datetime.timedelta(days=offset)).isoformat() for offset in range(HISTORY_DAYS + 400)]
+    # Popular books and keen readers are spread over the id range, not clustered at the start.
+    book_order = list(range(1, books + 1))
+    student_order = list(range(1, students + 1))
+    rng.shuffle(book_order)
+    rng.shuffle(student_order)
+    book_weights = zipf_weights(books)
+    student_weights = zipf_weights(students, 0.7)
+
+    for offset in range(0, count, CHUNK):
+        size = min(CHUNK, count - offset)
+        picked_books = rng.choices(book_order, cum_weights=book_weights, k=size)
+        picked_students = rng.choices(student_order, cum_weights=student_weights, k=size)
+        for i in range(size):
+            issued = (offset + i) * HISTORY_DAYS // count
+            loan = rng.choice(LOAN_PERIODS)
+            roll = rng.random()
+            if roll < 0.80:
+                kept = rng.randint(1, loan)                      # on time
+            elif roll < 0.97:
+                kept = loan + 1 + int(rng.expovariate(1 / 10))   # a little late
+            else:
+                kept = loan + rng.randint(30, 300)               # very late or lost
+            returned = day[issued + kept] if issued + kept <= HISTORY_DAYS else None
+            yield picked_books[i], picked_students[i], day[issued], day[issued + loan], returned
+
+def index_names():
+    import app as library
+    return [re.search(r"INDEX IF NOT EXISTS (\w+)", ddl).group(1) for _, ddl in library.SCHEMA_INDEXES]
+
+def generate(path, books, students, transactions, seed=42, end=None, log=print):
+    """Builds a benchmark database at path; returns the row counts."""
+    end = end or datetime.date.today()
+    rng = random.Random(seed)
+    stem = os.path.splitext(path)[0]
+    for name in (path, stem + '_archive.db', stem + '_reports.db'):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(name + suffix):
+                os.remove(name + suffix)
+
+    # Importing the app against the new path creates the schema.
+    os.environ['LIBRARY_DB'] = path
+    import app as library
+    library._pool.dispose()
+
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA synchronous = OFF")
+    cursor = conn.cursor()
+    for (name,) in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'").fetchall():
+        cursor.execute(f"DROP TRIGGER {name}")
+    for name in index_names():
+        cursor.execute(f"DROP INDEX IF EXISTS {name}")
+    cursor.execute("PRAGMA user_version = 0")
+
+    started = time.perf_counter()
+    cursor.executemany("INSERT INTO books (custom_id, name, author) VALUES (?, ?, ?)", book_rows(rng, books))
+    cursor.executemany("INSERT INTO students (admission_no, name, batch) VALUES (?, ?, ?)",
+                       student_rows(rng, students, end.year))
+    password_hash = library.hash_password("password")
+    cursor.executemany("INSERT INTO students_auth (admission_no, password_hash, is_approved) VALUES (?, ?, ?)",
+                       ((f"ADM{i + 1:06d}", password_hash, int(rng.random() > 0.03)) for i in range(students)))
+    conn.commit()
+    log(f"books and students loaded in {time.perf_counter() - started:.1f}s")
+
+    started = time.perf_counter()
+    cursor.executemany("""INSERT INTO transactions (book_id, student_id, issue_date, due_date, return_date)
+                          VALUES (?, ?, ?, ?, ?)""", transaction_rows(rng, books, students, transactions, end))
+    # A copy can only be out once: earlier loans of a book that is still out were returned on time.
+    cursor.execute("""UPDATE transactions SET return_date = MIN(due_date, ?)
+                      WHERE return_date IS NULL
+                        AND id NOT IN (SELECT MAX(id) FROM transactions WHERE return_date IS NULL GROUP BY book_id)""",
+                   (end.isoformat(),))
+    cursor.execute("UPDATE books SET available = 0 WHERE id IN (SELECT book_id FROM transactions WHERE return_date IS NULL)")
+    conn.commit()
+    log(f"transactions loaded in {time.perf_counter() - started:.1f}s")
+
+    # init_db() puts back the triggers, shared counters and index set.
+    started = time.perf_counter()
+    library.init_db()
+    library._pool.dispose()
+    library.attach_archive(conn)
+    library.rebuild_borrow_counts(cursor)
+    library.rebuild_books_fts(cursor)
+    conn.commit()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    log(f"triggers, search index and indexes rebuilt in {time.perf_counter() - started:.1f}s")
+
+    counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+              for table in ('books', 'students', 'transactions')}
+    counts['active_loans'] = conn.execute("SELECT COUNT(*) FROM transactions WHERE return_date IS NULL").fetchone()[0]
+    counts['overdue_loans'] = conn.execute("SELECT COUNT(*) FROM transactions WHERE return_date IS NULL AND due_date < ?",
+                                           (end.isoformat(),)).fetchone()[0]
+    conn.close()
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a deterministic benchmark database.")
+    parser.add_argument('--scale', choices=SCALES, default='small')
+    parser.add_argument('--books', type=int)
+    parser.add_argument('--students', type=int)
+    parser.add_argument('--transactions', type=int)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--end-date', type=datetime.date.fromisoformat, help="last day of loan history (default: today)")
+    parser.add_argument('--output', default=DEFAULT_DB)
+    args = parser.parse_args()
+
+    books, students, transactions = SCALES[args.scale]
+    counts = generate(args.output, args.books or books, args.students or students,
+                      args.transactions or transactions, args.seed, args.end_date)
+    print(", ".join(f"{value} {key.replace('_', ' ')}" for key, value in counts.items()))
+    print(f"Wrote {args.output}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,287 @@
+"""Per-route load benchmark.
+
+Drives every main route with concurrent clients against a generated
+database (see benchmark.generate). It reports p50/p95/p99 latency and
+throughput per route and writes the results to JSON for benchmark.compare.
+
+By default requests go through Flask's test client. --http starts a real
+threaded WSGI server on localhost instead and talks to it over HTTP.
+
+The benchmark issues and then returns books, so it changes the database
+it runs against: point it at a generated copy, never at library.db.
+
+    python -m benchmark.run                                  # benchmark/bench.db, 4 clients
+    python -m benchmark.run --clients 8 --requests 200 --http
+    python -m benchmark.run --routes index,api_view_books --output before.json
+"""
+import argparse
+import datetime
+import http.cookiejar
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from benchmark.generate import DEFAULT_DB, TITLE_WORDS, FIRST_NAMES
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+ENV_KNOBS = ('DB_POOL_SIZE', 'DB_SYNCHRONOUS', 'GROUP_COMMIT', 'GROUP_COMMIT_WINDOW_MS', 'GROUP_COMMIT_MAX_OPS')
+
+# --- Scenarios ---
+# name -> (portal to log in to, function(rng, data, state) -> (method, url, form, json))
+
+def _word(rng):
+    return rng.choice(TITLE_WORDS)
+
+def _issue(rng, data, state):
+    book = state['to_issue'].pop() if state['to_issue'] else rng.choice(data['books'])
+    student = rng.choice(data['students'])
+    state['issued'].append((book, student))
+    return 'POST', '/issue', {'book_id': book, 'admission_no': student, 'loan_period': '14'}, None
+
+def _return(rng, data, state):
+    book, student = state['issued'].pop() if state['issued'] else rng.choice(data['loans'])
+    return 'POST', '/return', {'book_id': book, 'admission_no': student}, None
+
+SCENARIOS = {
+    'index': ('librarian', lambda rng, data, state: ('GET', '/index', None, None)),
+    'student_dashboard': ('student', lambda rng, data, state: ('GET', '/student_dashboard', None, None)),
+    'api_view_books': ('librarian', lambda rng, data, state: (
+        'GET', f"/api/view_books?query={_word(rng)}&page=1", None, None)),
+    'api_view_books_cursor': ('librarian', lambda rng, data, state: (
+        'GET', f"/api/view_books?query={_word(rng)}&cursor=", None, None)),
+    'api_view_students': ('librarian', lambda rng, data, state: (
+        'GET', f"/api/view_students?query={rng.choice(FIRST_NAMES)}&page=1", None, None)),
+    'api_student_search': ('student', lambda rng, data, state: (
+        'GET', f"/api/student_search?query={_word(rng)}&page=1", None, None)),
+    'api_transaction_history': ('librarian', lambda rng, data, state: (
+        'GET', f"/api/transaction_history?status={rng.choice(['all', 'active', 'returned'])}", None, None)),
+    'transaction_history': ('librarian', lambda rng, data, state: ('GET', '/transaction_history', None, None)),
+    'active_issues': ('librarian', lambda rng, data, state: ('GET', '/active_issues', None, None)),
+    'search_books': ('librarian', lambda rng, data, state: ('POST', '/search_books', {'query': _word(rng)}, None)),
+    'lookup_book': ('librarian', lambda rng, data, state: ('GET', f"/lookup_book/{rng.choice(data['books'])}", None, None)),
+    'lookup_student': ('librarian', lambda rng, data, state: (
+        'GET', f"/lookup_student/{rng.choice(data['students'])}", None, None)),
+    'api_lookup': ('librarian', lambda rng, data, state: (
+        'POST', '/api/lookup', None, {'book_ids': rng.sample(data['books'], 10), 'admission_nos': rng.sample(data['students'], 5)})),
+    'issue_book': ('librarian', _issue),
+    'return_book': ('librarian', _return),
+}
+# Not warmed up: every request changes the database.
+WRITE_SCENARIOS = {'issue_book', 'return_book'}
+
+def sample_data(db_path, size=1000):
+    """Reads ids to drive the scenarios with from the benchmark database."""
+    conn = sqlite3.connect(db_path)
+    step = lambda table: max(1, conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] // size)
+    data = {
+        'books': [row[0] for row in conn.execute(
+            "SELECT COALESCE(custom_id, id) FROM books WHERE id % ? = 0 LIMIT ?", (step('books'), size))],
+        'available': [row[0] for row in conn.execute(
+            "SELECT COALESCE(custom_id, id) FROM books WHERE available = 1 AND id % 7 = 3 LIMIT 20000")],
+        'students': [row[0] for row in conn.execute(
+            """SELECT s.admission_no FROM students s JOIN students_auth sa ON sa.admission_no = s.admission_no
+               WHERE sa.is_approved = 1 AND s.id % ? = 0 LIMIT ?""", (step('students'), size))],
+        'loans': [tuple(row) for row in conn.execute(
+            """SELECT COALESCE(b.custom_id, b.id), s.admission_no FROM transactions t
+               JOIN books b ON b.id = t.book_id JOIN students s ON s.id = t.student_id
+               WHERE t.return_date IS NULL LIMIT ?""", (size,))],
+        'counts': {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                   for table in ('books', 'students', 'transactions')},
+    }
+    conn.close()
+    return data
+
+# --- Clients ---
+
+class TestClient:
+    def __init__(self, library):
+        self.client = library.app.test_client()
+
+    def request(self, method, url, form=None, body=None):
+        response = self.client.open(url, method=method, data=form, json=body)
+        response.close()
+        return response.status_code
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+class HTTPClient:
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+
+    def request(self, method, url, form=None, body=None):
+        data, headers = None, {}
+        if form is not None:
+            data = urllib.parse.urlencode(form).encode()
+        elif body is not None:
+            data, headers = json.dumps(body).encode(), {'Content-Type': 'application/json'}
+        req = urllib.request.Request(self.base_url + url, data=data, method=method, headers=headers)
+        try:
+            with self.opener.open(req) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+
+def log_in(client, library, portal, data, index):
+    if portal == 'librarian':
+        client.request('POST', '/librarian_login', {'username': library.LIBRARIAN_USERNAME,
+                                                    'password': library.LIBRARIAN_PASSWORD})
+    else:
+        client.request('POST', '/student_login', {'admission_no': data['students'][index % len(data['students'])],
+                                                  'password': 'password'})
+
+# --- Measurement ---
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return 0.0
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+def run_scenario(name, make_client, library, data, states, clients, requests, warmup, seed):
+    portal, build = SCENARIOS[name]
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+    ready = threading.Barrier(clients + 1)
+
+    def worker(index):
+        rng = random.Random(f"{seed}-{name}-{index}")
+        client = make_client()
+        log_in(client, library, portal, data, index)
+        for _ in range(0 if name in WRITE_SCENARIOS else warmup):
+            client.request(*build(rng, data, {'to_issue': [], 'issued': []}))
+        ready.wait()
+        mine, codes = [], {}
+        for _ in range(requests):
+            method, url, form, body = build(rng, data, states[index])
+            started = time.perf_counter()
+            status = client.request(method, url, form, body)
+            mine.append(time.perf_counter() - started)
+            codes[status] = codes.get(status, 0) + 1
+        with lock:
+            latencies.extend(mine)
+            for status, count in codes.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    ordered = sorted(latencies)
+    ms = lambda seconds: round(seconds * 1000, 3)
+    return {
+        'requests': len(ordered),
+        'errors': sum(count for status, count in statuses.items() if status >= 500),
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'p50_ms': ms(percentile(ordered, 0.50)),
+        'p95_ms': ms(percentile(ordered, 0.95)),
+        'p99_ms': ms(percentile(ordered, 0.99)),
+        'mean_ms': ms(sum(ordered) / len(ordered)) if ordered else 0.0,
+        'max_ms': ms(ordered[-1]) if ordered else 0.0,
+        'throughput_rps': round(len(ordered) / elapsed, 2) if elapsed else 0.0,
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip() or None
+    except OSError:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure latency and throughput for every route.")
+    parser.add_argument('--db', default=DEFAULT_DB)
+    parser.add_argument('--clients', type=int, default=4, help="concurrent clients per route")
+    parser.add_argument('--requests', type=int, default=100, help="requests per client per route")
+    parser.add_argument('--warmup', type=int, default=3, help="unmeasured requests per client first")
+    parser.add_argument('--routes', help="comma-separated subset of: " + ", ".join(SCENARIOS))
+    parser.add_argument('--http', action='store_true', help="go through a local threaded WSGI server")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="results file (default: benchmark/results/<timestamp>.json)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        parser.error(f"{args.db} does not exist; build it with: python -m benchmark.generate")
+    names = args.routes.split(',') if args.routes else list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown routes: {', '.join(unknown)}")
+
+    os.environ['LIBRARY_DB'] = os.path.abspath(args.db)
+    import app as library
+    data = sample_data(args.db)
+    per_client = len(data['available']) // args.clients
+    states = [{'to_issue': data['available'][i * per_client:(i + 1) * per_client], 'issued': []}
+              for i in range(args.clients)]
+
+    server = None
+    if args.http:
+        from werkzeug.serving import WSGIRequestHandler, make_server
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_request(self, *args, **kwargs):
+                pass
+        server = make_server('127.0.0.1', 0, library.app, threaded=True, request_handler=QuietHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_port}"
+        make_client = lambda: HTTPClient(base_url)
+    else:
+        make_client = lambda: TestClient(library)
+
+    results = {
+        'meta': {
+            'started_at': datetime.datetime.now().isoformat(timespec='seconds'),
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'db': os.path.abspath(args.db),
+            'db_counts': data['counts'],
+            'mode': 'http' if args.http else 'test-client',
+            'clients': args.clients,
+            'requests_per_client': args.requests,
+            'env': {knob: os.environ[knob] for knob in ENV_KNOBS if knob in os.environ},
+        },
+        'routes': {},
+    }
+
+    print(f"{'route':<26}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}{'errors':>8}")
+    for name in names:
+        result = run_scenario(name, make_client, library, data, states, args.clients,
+                              args.requests, args.warmup, args.seed)
+        results['routes'][name] = result
+        print(f"{name:<26}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+              f"{result['throughput_rps']:>10.1f}{result['errors']:>8}")
+    if server is not None:
+        server.shutdown()
+
+    output = args.output or os.path.join(RESULTS_DIR, datetime.datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote {output}")
+    return 1 if any(result['errors'] for result in results['routes'].values()) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,222 @@
+"""Builds the self-hosted static bundle in static/dist/.
+
+- app.css: Tailwind compiled ahead of time from the classes used in
+  templates/*.html and static/*.js, minified. This replaces the in-browser
+  compiler from cdn.tailwindcss.com.
+- bootstrap.css, bootstrap-icons.css: vendored and purged down to the
+  selectors the templates use.
+- inter.css, poppins.css: Google Fonts stylesheets with their font files
+  vendored next to them.
+- chart.js, bootstrap.js: vendored, already minified upstream.
+
+Every file is written under a content-hashed name, and
+static/dist/manifest.json maps logical names ('app.css') to them. The app's
+asset_tag()/asset_url() helpers read the manifest. Until the bundle is
+built they fall back to the CDN URLs, so a fresh checkout still works.
+
+    python build_assets.py                 # needs network access for the first build
+    TAILWIND_BIN=/path/to/tailwindcss python build_assets.py
+
+Tailwind comes from TAILWIND_BIN, a `tailwindcss` on PATH, or the pinned
+standalone CLI, which is downloaded once into ~/.cache/library-assets.
+"""
+import hashlib
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_DIR = os.path.join(ROOT, 'templates')
+STATIC_DIR = os.path.join(ROOT, 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST = os.path.join(DIST_DIR, 'manifest.json')
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'library-assets')
+
+TAILWIND_VERSION = '3.4.17'
+TAILWIND_CONTENT = ['./templates/**/*.html', './static/*.js']
+
+# logical name -> pinned upstream URL
+VENDOR_JS = {
+    'chart.js': 'https://cdn.jsdelivr.net/npm/chart.js@4.4.1/dist/chart.umd.js',
+    'bootstrap.js': 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/js/bootstrap.bundle.min.js',
+}
+# logical name -> (pinned upstream URL, purge unused selectors)
+VENDOR_CSS = {
+    'bootstrap.css': ('https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/css/bootstrap.min.css', True),
+    'bootstrap-icons.css': ('https://cdn.jsdelivr.net/npm/bootstrap-icons@1.10.5/font/bootstrap-icons.css', True),
+    'inter.css': ('https://fonts.googleapis.com/css2?family=Inter:wght@100..900&display=swap', False),
+    'poppins.css': ('https://fonts.googleapis.com/css2?family=Poppins:wght@400;600&display=swap', False),
+}
+# Classes Bootstrap's JavaScript adds at runtime; never purge them.
+PURGE_SAFELIST = {'show', 'showing', 'hiding', 'fade', 'collapse', 'collapsing', 'active', 'disabled',
+                  'modal-open', 'modal-backdrop', 'modal-static', 'was-validated', 'is-invalid', 'is-valid'}
+# Google Fonts serves woff2 only to browsers it recognises.
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36'
+
+def fetch(url):
+    request = urllib.request.Request(url, headers={'User-Agent': USER_AGENT})
+    with urllib.request.urlopen(request, timeout=60) as response:
+        return response.read()
+
+def write_hashed(manifest, name, data):
+    """Writes data as dist/<stem>.<hash><ext> and records it under name."""
+    stem, ext = os.path.splitext(name)
+    filename = f"{stem}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+    with open(os.path.join(DIST_DIR, filename), 'wb') as f:
+        f.write(data)
+    manifest[name] = filename
+    return filename
+
+# --- Tailwind ---
+def tailwind_binary():
+    configured = os.environ.get('TAILWIND_BIN') or shutil.which('tailwindcss')
+    if configured:
+        return configured
+    system = {'Linux': 'linux', 'Darwin': 'macos', 'Windows': 'windows'}[platform.system()]
+    machine = {'x86_64': 'x64', 'amd64': 'x64', 'arm64': 'arm64', 'aarch64': 'arm64'}[platform.machine().lower()]
+    name = f"tailwindcss-{system}-{machine}" + ('.exe' if system == 'windows' else '')
+    path = os.path.join(CACHE_DIR, f"{TAILWIND_VERSION}-{name}")
+    if not os.path.exists(path):
+        print(f"Downloading Tailwind CLI {TAILWIND_VERSION} ({name})...")
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        data = fetch(f"https://github.com/tailwindlabs/tailwindcss/releases/download/v{TAILWIND_VERSION}/{name}")
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.chmod(path + '.tmp', 0o755)
+        os.replace(path + '.tmp', path)
+    return path
+
+def build_tailwind():
+    """Compiles and minifies Tailwind for the classes the templates use."""
+    with tempfile.TemporaryDirectory() as scratch:
+        output = os.path.join(scratch, 'app.css')
+        subprocess.run([tailwind_binary(), '--content', ','.join(TAILWIND_CONTENT), '--minify', '-o', output],
+                       cwd=ROOT, check=True)
+        with open(output, 'rb') as f:
+            return f.read()
+
+# --- Purging vendored CSS ---
+def used_tokens():
+    """Every class-like token in the templates and static scripts."""
+    tokens = set(PURGE_SAFELIST)
+    folders = ((TEMPLATE_DIR, '.html'), (STATIC_DIR, '.js'))
+    for folder, suffix in folders:
+        for name in os.listdir(folder):
+            if name.endswith(suffix):
+                with open(os.path.join(folder, name), encoding='utf-8') as f:
+                    tokens.update(re.findall(r'[A-Za-z0-9_-]+', f.read()))
+    return tokens
+
+def split_top_level(text, separator):
+    """Splits on separator outside of parentheses and brackets."""
+    parts, depth, start = [], 0, 0
+    for i, char in enumerate(text):
+        if char in '([':
+            depth += 1
+        elif char in ')]':
+            depth -= 1
+        elif char == separator and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return parts
+
+def css_blocks(css):
+    """Yields (prelude, body) for each top-level `prelude { body }` block."""
+    i = 0
+    while True:
+        open_at = css.find('{', i)
+        if open_at == -1:
+            return
+        depth, j, quote = 1, open_at + 1, None
+        while depth:
+            char = css[j]
+            if quote:
+                if char == '\\':
+                    j += 1
+                elif char == quote:
+                    quote = None
+            elif char in '"\'':
+                quote = char
+            elif char == '{':
+                depth += 1
+            elif char == '}':
+                depth -= 1
+            j += 1
+        yield css[i:open_at].strip(), css[open_at + 1:j - 1]
+        i = j
+
+def selector_used(selector, tokens):
+    # A class only inside :not(...) does not have to be present.
+    required = re.sub(r':not\([^)]*\)', '', selector)
+    return all(name in tokens for name in re.findall(r'\.(-?[_a-zA-Z][_a-zA-Z0-9-]*)', required))
+
+def purge_css(css, tokens):
+    """Drops style rules whose selectors name classes no template uses."""
+    kept = []
+    for prelude, body in css_blocks(css):
+        if prelude.startswith(('@media', '@supports', '@layer', '@container')):
+            inner = purge_css(body, tokens)
+            if inner:
+                kept.append(f"{prelude}{{{inner}}}")
+        elif prelude.startswith('@'):
+            kept.append(f"{prelude}{{{body}}}")  # @font-face, @keyframes, ...
+        else:
+            selectors = [s for s in split_top_level(prelude, ',') if selector_used(s, tokens)]
+            if selectors:
+                kept.append(f"{','.join(s.strip() for s in selectors)}{{{body}}}")
+    return ''.join(kept)
+
+# --- Vendored CSS with its fonts ---
+def vendor_css(url, purge, tokens):
+    """Downloads a stylesheet and every file it references; returns the rewritten CSS."""
+    css = fetch(url).decode('utf-8')
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'@charset[^;]*;', '', css)
+    if purge:
+        css = purge_css(css, tokens)
+
+    def vendor_reference(match):
+        reference = match.group(2)
+        if reference.startswith('data:'):
+            return match.group(0)
+        source = urllib.parse.urljoin(url, reference)
+        name = os.path.basename(urllib.parse.urlparse(source).path)
+        if source not in fetched:
+            fetched[source] = write_hashed({}, name, fetch(source))
+        return f"url({fetched[source]})"
+
+    fetched = {}
+    css = re.sub(r'url\((["\']?)([^"\')]+)\1\)', vendor_reference, css)
+    return re.sub(r'\s*\n\s*', '', css).encode('utf-8')
+
+def main():
+    if os.path.isdir(DIST_DIR):
+        shutil.rmtree(DIST_DIR)
+    os.makedirs(DIST_DIR)
+    manifest = {}
+    tokens = used_tokens()
+
+    write_hashed(manifest, 'app.css', build_tailwind())
+    for name, (url, purge) in VENDOR_CSS.items():
+        write_hashed(manifest, name, vendor_css(url, purge, tokens))
+    for name, url in VENDOR_JS.items():
+        write_hashed(manifest, name, fetch(url))
+
+    with open(MANIFEST, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    for name, filename in sorted(manifest.items()):
+        size = os.path.getsize(os.path.join(DIST_DIR, filename))
+        print(f"{name:<22} {filename:<36} {size / 1024:8.1f} KB")
+    print(f"Wrote {MANIFEST}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,220 @@
+"""Set-based bulk import engine for books and students.
+
+Rows are cleaned and de-duplicated inside pandas and checked against the
+database with one query per chunk. Large files are read in chunks, and only
+the rows that passed are kept. Once the whole file is read, they are written
+with executemany() in one short transaction.
+Both importers return a report dict describing what was added and skipped.
+"""
+import json
+import os
+
+import pandas as pd
+
+CHUNK_SIZE = 5000
+
+BOOK_COLUMNS = ['name', 'author', 'custom_id']
+STUDENT_COLUMNS = ['admission_no', 'name', 'batch', 'password']
+
+def read_chunks(path, columns, chunk_size=CHUNK_SIZE):
+    """Yields DataFrames of at most chunk_size rows from an .xlsx or .csv file."""
+    if os.path.splitext(path)[1].lower() == '.csv':
+        for chunk in pd.read_csv(path, chunksize=chunk_size, dtype=str):
+            yield chunk.reindex(columns=columns)
+        return
+
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(cell).strip() if cell is not None else '' for cell in next(rows, ())]
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= chunk_size:
+                yield pd.DataFrame(batch, columns=header).reindex(columns=columns)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=header).reindex(columns=columns)
+    finally:
+        workbook.close()
+
+def count_rows(path):
+    """Number of data rows in an .xlsx or .csv file, for progress reporting."""
+    if os.path.splitext(path)[1].lower() == '.csv':
+        with open(path, 'rb') as f:
+            return max(sum(1 for _ in f) - 1, 0)
+
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only=True)
+    try:
+        return max((workbook.active.max_row or 1) - 1, 0)
+    finally:
+        workbook.close()
+
+def missing_columns(path, columns):
+    """Required columns absent from the file's header row."""
+    if os.path.splitext(path)[1].lower() == '.csv':
+        header = pd.read_csv(path, nrows=0).columns
+    else:
+        from openpyxl import load_workbook
+        workbook = load_workbook(path, read_only=True)
+        try:
+            first = next(workbook.active.iter_rows(max_row=1, values_only=True), ())
+        finally:
+            workbook.close()
+        header = [str(cell).strip() for cell in first if cell is not None]
+    return [column for column in columns if column not in set(header)]
+
+def new_report():
+    return {'added': 0, 'skipped': 0, 'added_keys': [], 'skipped_rows': []}
+
+def _clean(series, upper=False):
+    """Strips text values, turning blanks into NA; optionally uppercases."""
+    cleaned = series.astype('string').str.strip()
+    if upper:
+        cleaned = cleaned.str.upper()
+    return cleaned.mask(cleaned == '')
+
+def _skip(report, frame, mask, reason, key_column):
+    """Records the rows selected by mask as skipped and returns the rest."""
+    for row_number, key in zip(frame.loc[mask, '_row'], frame.loc[mask, key_column]):
+        report['skipped_rows'].append({'row': int(row_number), 'key': None if pd.isna(key) else key, 'reason': reason})
+    report['skipped'] += int(mask.sum())
+    return frame.loc[~mask]
+
+def _existing(conn, sql, values):
+    """Runs an anti-join lookup for a list of keys in a single query."""
+    if not values:
+        return set()
+    return {row[0] if len(row) == 1 else tuple(row) for row in conn.execute(sql, (json.dumps(values),))}
+
+def _skip_taken_books(conn, report, frame):
+    """Skips rows whose custom_id or name/author is already in the database."""
+    ids = frame['custom_id'].dropna().tolist()
+    taken_ids = _existing(conn, "SELECT custom_id FROM books WHERE custom_id IN (SELECT value FROM json_each(?))", ids)
+    frame = _skip(report, frame, frame['custom_id'].isin(taken_ids), 'custom_id already exists', 'custom_id')
+    taken_titles = _existing(conn, """SELECT name, author FROM books WHERE (name, author) IN
+                                      (SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]') FROM json_each(?))""",
+                             frame[['name', 'author']].values.tolist())
+    exists = pd.Series(pd.MultiIndex.from_frame(frame[['name', 'author']]).isin(taken_titles), index=frame.index)
+    return _skip(report, frame, exists, 'name/author already exists', 'name')
+
+def _skip_taken_students(conn, report, frame):
+    """Skips rows whose admission_no is already in the database."""
+    taken = _existing(conn, "SELECT admission_no FROM students WHERE admission_no IN (SELECT value FROM json_each(?))",
+                      frame['admission_no'].tolist())
+    return _skip(report, frame, frame['admission_no'].isin(taken), 'admission_no already exists', 'admission_no')
+
+def _write(conn, frames, skip_taken, insert):
+    """Inserts the checked rows in one short immediate transaction.
+
+    The database checks run again under the write lock, so a row someone
+    else added since the read pass is skipped instead of failing the import.
+    """
+    if not frames:
+        return
+    frame = pd.concat(frames)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        frame = skip_taken(frame)
+        insert(frame)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def import_books(conn, chunks, progress=None):
+    """Imports book rows from an iterable of DataFrames; returns a report.
+
+    progress, if given, is called with the number of rows read after each chunk.
+    """
+    report = new_report()
+    seen_ids, seen_titles = set(), set()
+    checked = []
+    first_row = 2  # spreadsheet row of the first data row (after the header)
+    for chunk in chunks:
+        frame = chunk.copy()
+        frame['_row'] = range(first_row, first_row + len(frame))
+        first_row += len(frame)
+
+        frame['name'] = _clean(frame['name'])
+        frame['author'] = _clean(frame['author'])
+        frame['custom_id'] = _clean(frame['custom_id'], upper=True)
+
+        frame = _skip(report, frame, frame['name'].isna() | frame['author'].isna(), 'missing name or author', 'name')
+
+        # Duplicates inside the file (and against earlier chunks)
+        has_id = frame['custom_id'].notna()
+        dup_id = has_id & (frame.duplicated('custom_id') | frame['custom_id'].isin(seen_ids))
+        frame = _skip(report, frame, dup_id, 'custom_id repeated in file', 'custom_id')
+        titles = pd.MultiIndex.from_frame(frame[['name', 'author']])
+        dup_title = frame.duplicated(['name', 'author']) | pd.Series(titles.isin(seen_titles), index=frame.index)
+        frame = _skip(report, frame, dup_title, 'name/author repeated in file', 'name')
+
+        # Duplicates already in the database, one query per key type
+        frame = _skip_taken_books(conn, report, frame)
+
+        checked.append(frame)
+        seen_ids.update(frame['custom_id'].dropna())
+        seen_titles.update(zip(frame['name'], frame['author']))
+        if progress:
+            progress(first_row - 2)
+
+    def insert(frame):
+        rows = [(None if pd.isna(c) else c, n, a) for c, n, a in zip(frame['custom_id'], frame['name'], frame['author'])]
+        conn.executemany("INSERT INTO books (custom_id, name, author, available) VALUES (?, ?, ?, 1)", rows)
+        report['added'] += len(rows)
+        report['added_keys'].extend(c or n for c, n, _ in rows)
+
+    _write(conn, checked, lambda frame: _skip_taken_books(conn, report, frame), insert)
+    return report
+
+def import_students(conn, chunks, hash_passwords, progress=None):
+    """Imports student rows from an iterable of DataFrames; returns a report.
+
+    hash_passwords takes a list of plain-text passwords and returns their
+    hashes in the same order. Imported portal accounts are pre-approved.
+    progress is called as in import_books(). Every password is hashed
+    before the write transaction starts, so the slow part never holds the
+    database's write lock.
+    """
+    report = new_report()
+    seen = set()
+    checked = []
+    first_row = 2
+    for chunk in chunks:
+        frame = chunk.copy()
+        frame['_row'] = range(first_row, first_row + len(frame))
+        first_row += len(frame)
+
+        frame['admission_no'] = _clean(frame['admission_no'], upper=True)
+        frame['name'] = _clean(frame['name'])
+        frame['batch'] = _clean(frame['batch']).fillna('')
+        frame['password'] = frame['password'].astype('string')
+
+        missing = frame['admission_no'].isna() | frame['name'].isna() | frame['password'].isna()
+        frame = _skip(report, frame, missing, 'missing admission_no, name or password', 'admission_no')
+
+        repeated = frame.duplicated('admission_no') | frame['admission_no'].isin(seen)
+        frame = _skip(report, frame, repeated, 'admission_no repeated in file', 'admission_no')
+
+        frame = _skip_taken_students(conn, report, frame)
+
+        frame = frame.drop(columns='password').assign(password_hash=hash_passwords(frame['password'].tolist()))
+        checked.append(frame)
+        seen.update(frame['admission_no'])
+        if progress:
+            progress(first_row - 2)
+
+    def insert(frame):
+        admission_nos = frame['admission_no'].tolist()
+        conn.executemany("INSERT INTO students (admission_no, name, batch) VALUES (?, ?, ?)",
+                         zip(admission_nos, frame['name'], frame['batch']))
+        conn.executemany("INSERT INTO students_auth (admission_no, password_hash, is_approved) VALUES (?, ?, 1)",
+                         zip(admission_nos, frame['password_hash']))
+        report['added'] += len(admission_nos)
+        report['added_keys'].extend(admission_nos)
+
+    _write(conn, checked, lambda frame: _skip_taken_students(conn, report, frame), insert)
+    return report
@@ -0,0 +1,76 @@
+"""Checks that odd book ids get a "not found" answer instead of a server error.
+
+Scanners and keyboards can send ids like '²' or '٣': str.isdigit() accepts
+them but int() does not. This drives the circulation and lookup routes that resolve book ids
+against a scratch database with such input and fails on any 5xx response.
+
+    python check_book_ids.py
+"""
+import os
+import sys
+import tempfile
+from urllib.parse import quote
+
+ODD_IDS = ['²', '٣', '¹²', '①', ' 7 ']
+
+def main():
+    scratch = tempfile.mkdtemp()
+    os.environ['LIBRARY_DB'] = os.path.join(scratch, 'book_ids.db')
+    import app as library
+    with library.get_connection() as conn:
+        conn.execute("INSERT INTO books (custom_id, name, author) VALUES ('B1', 'Odd Id Book', 'Author')")
+        conn.execute("INSERT INTO students (admission_no, name, batch) VALUES ('S1', 'Odd Id Student', 'B')")
+
+    client = library.app.test_client()
+    client.post('/librarian_login', data={'username': library.LIBRARIAN_USERNAME, 'password': library.LIBRARIAN_PASSWORD})
+    problems = []
+
+    def expect(label, response, status):
+        if response.status_code != status:
+            problems.append(f"{label}: got {response.status_code}, expected {status}")
+        return response
+
+    for action in ('issue', 'return'):
+        response = expect(f"POST /api/circulation {action}",
+                          client.post('/api/circulation', json={'action': action, 'admission_no': 'S1', 'book_ids': ODD_IDS, 'loan_period': '14'}), 200)
+        results = (response.get_json() or {}).get('results', [])
+        if len(results) != len(ODD_IDS) or any(result['book_name'] for result in results):
+            problems.append(f"POST /api/circulation {action}: expected every odd id to be not found, got {results}")
+
+    for value in ODD_IDS:
+        if value.strip():
+            expect(f"POST /issue {value!r}", client.post('/issue', data={'book_id': value, 'admission_no': 'S1', 'loan_period': '14'}), 302)
+
+    # The lookup endpoints resolve through the per-worker cache; ask twice so both paths run.
+    for attempt in ('uncached', 'cached'):
+        response = expect(f"POST /api/lookup ({attempt})", client.post('/api/lookup', json={'book_ids': ['B1', *ODD_IDS, '99']}), 200)
+        books = (response.get_json() or {}).get('books', {})
+        if not (books.get('B1') or {}).get('name') or any(books.get(value) for value in ODD_IDS + ['99']):
+            problems.append(f"POST /api/lookup ({attempt}): expected only B1 to be found, got {books}")
+        for value in ODD_IDS:
+            if value.strip():
+                expect(f"GET /lookup_book/{value!r} ({attempt})", client.get(f"/lookup_book/{quote(value)}"), 404)
+
+    # History cursors are row ids too and take the same input.
+    expect("GET /api/transaction_history?cursor=²", client.get(f"/api/transaction_history?cursor={quote('²')}"), 400)
+
+    # Leading zeros are still a plain database id: '01' is book 1.
+    book_id = str(library.lookup_books(['B1'])['B1']['id'])
+    padded = '0' + book_id
+    if (client.get(f"/lookup_book/{padded}").get_json() or {}).get('name') != 'Odd Id Book':
+        problems.append(f"GET /lookup_book/{padded}: expected the book with id {book_id}")
+    books = (client.post('/api/lookup', json={'book_ids': [padded]}).get_json() or {}).get('books', {})
+    if not (books.get(padded) or {}).get('name'):
+        problems.append(f"POST /api/lookup {padded!r}: expected the book with id {book_id}, got {books}")
+    response = client.post('/api/circulation', json={'action': 'issue', 'admission_no': 'S1', 'book_ids': [padded], 'loan_period': '14'})
+    results = (response.get_json() or {}).get('results', [])
+    if not results or results[0]['book_name'] != 'Odd Id Book':
+        problems.append(f"POST /api/circulation issue {padded!r}: expected the book with id {book_id}, got {results}")
+
+    print(f"Checked {len(ODD_IDS)} odd book ids.")
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    return len(problems)
+
+if __name__ == '__main__':
+    sys.exit(1 if main() else 0)
@@ -0,0 +1,35 @@
+import sqlite3
+import sys
+# DB_NAME and the archive attach_archive() adds both follow LIBRARY_DB / ARCHIVE_DB.
+from app import DB_NAME, attach_archive, verify_borrow_counts, rebuild_borrow_counts
+
+def check_borrow_counts(repair=False):
+    """Compares the stored borrow counters with the live and archived transactions."""
+    conn = sqlite3.connect(DB_NAME)
+    conn.row_factory = sqlite3.Row
+    attach_archive(conn)  # archived loans count too
+    cursor = conn.cursor()
+
+    drift = verify_borrow_counts(cursor)
+    drifted = 0
+    for table, rows in drift.items():
+        for row in rows:
+            print(f"{table}: '{row['name']}' (id {row['id']}) stored {row['stored']}, actual {row['actual']}")
+        drifted += len(rows)
+
+    if drifted == 0:
+        print("All borrow counters are in sync.")
+    elif repair:
+        rebuild_borrow_counts(cursor)
+        conn.commit()
+        print(f"Rebuilt borrow counters ({drifted} rows had drifted).")
+    else:
+        print(f"{drifted} rows have drifted. Run with --repair to rebuild them.")
+
+    conn.close()
+    return drifted
+
+if __name__ == '__main__':
+    repair = '--repair' in sys.argv[1:]
+    drifted = check_borrow_counts(repair)
+    sys.exit(1 if drifted and not repair else 0)
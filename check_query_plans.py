@@ -0,0 +1,222 @@
+"""Runs EXPLAIN QUERY PLAN over every SQL statement in app.py.
+
+Statements are collected two ways: the literal SQL passed to .execute() in
+each route, and every statement the routes actually run (captured with a
+trace callback while a scripted session exercises them against a scratch
+database). The check fails if any plan falls back to a full SCAN of one of
+the large tables, unless the statement is listed in ALLOWED_SCANS.
+
+    python check_query_plans.py          # exits 1 on a plan regression
+    python check_query_plans.py -v       # also prints every plan
+"""
+import ast
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+
+APP_FILE = 'app.py'
+LARGE_TABLES = {'books', 'students', 'transactions', 'students_auth', 'transactions_archive'}
+
+# (pattern on normalized SQL, reason) for statements that must scan by design.
+ALLOWED_SCANS = (
+    (r"^SELECT \(SELECT COUNT\(id\) FROM books\) AS total_books",
+     "dashboard totals; an unfiltered COUNT reads the whole table"),
+    (r"^SELECT \(SELECT COUNT\(id\) FROM books WHERE available = 1\) AS available_count",
+     "catalog availability totals; an unfiltered COUNT reads the whole table"),
+    (r"^SELECT COUNT\((\w+\.)?id\) FROM (books|students s LEFT JOIN students_auth sa ON s\.admission_no = sa\.admission_no)$",
+     "unfiltered pagination totals; cached by cached_count()"),
+    (r"^SELECT (COUNT\(s\.id\)|s\.id, s\.admission_no, s\.name, s\.batch, sa\.is_approved) FROM students s LEFT JOIN students_auth sa ON s\.admission_no = sa\.admission_no "
+     r"WHERE \(s\.name LIKE (\?|'%[^']*%') OR s\.admission_no LIKE (\?|'%[^']*%')\)",
+     "student list substring search; a leading % cannot use an index"),
+    (r"^SELECT t\.id, .* FROM (all_)?transactions t LEFT JOIN books b ON t\.book_id = b\.id LEFT JOIN students s ON t\.student_id = s\.id "
+     r"WHERE \(b\.name LIKE (\?|'%[^']*%') OR s\.name LIKE (\?|'%[^']*%') OR s\.admission_no LIKE (\?|'%[^']*%')\)",
+     "transaction history substring search; a leading % cannot use an index"),
+    (r"^SELECT \* FROM books ORDER BY name ASC$",
+     "search_books with an empty query lists the whole catalog"),
+    (r"^SELECT (id, custom_id, name, author, available, borrow_count FROM books|s\.id, s\.admission_no, s\.name, s\.batch, sa\.is_approved, s\.borrow_count FROM students)",
+     "exports stream the whole filtered set on purpose"),
+    (r"^SELECT DISTINCT batch FROM students",
+     "batch filter options; covering index scan"),
+    (r"FROM (all_)?transactions t LEFT JOIN books b ON t\.book_id = b\.id LEFT JOIN students s ON t\.student_id = s\.id( WHERE t\.return_date IS (NOT )?NULL)? ORDER BY t\.id DESC$",
+     "transaction_history?all=1 and exports stream every transaction on purpose"),
+    (r"^SELECT (t\.id, t\.book_id, s\.batch, .* FROM all_transactions t LEFT JOIN students s ON s\.id = t\.student_id$|COUNT\(\*\) FROM all_transactions$)",
+     "rebuilding the report rollups reads every loan once"),
+)
+
+def normalize(sql):
+    return re.sub(r"\s+", " ", sql).strip()
+
+def route_literal_sql(path=APP_FILE):
+    """Returns the literal SQL strings passed to .execute() or write_statement() inside route functions."""
+    tree = ast.parse(open(path).read())
+    statements = []
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.FunctionDef):
+            continue
+        decorators = [ast.unparse(d) for d in node.decorator_list]
+        if not any(d.startswith(('app.route', 'app.context_processor')) for d in decorators):
+            continue
+        for call in ast.walk(node):
+            if not isinstance(call, ast.Call) or not call.args:
+                continue
+            name = call.func.attr if isinstance(call.func, ast.Attribute) else getattr(call.func, 'id', None)
+            if (name in ('execute', 'executemany', 'write_statement')
+                    and isinstance(call.args[0], ast.Constant) and isinstance(call.args[0].value, str)):
+                statements.append(call.args[0].value)
+    return statements
+
+def run_routes(captured):
+    """Imports the app against a scratch database and drives every route once."""
+    import app as library
+
+    def traced_connect(pool, _connect=library.ConnectionPool._connect):
+        conn = _connect(pool)
+        conn.set_trace_callback(captured.append)
+        return conn
+    library.ConnectionPool._connect = traced_connect
+    library._pool.dispose()
+
+    with library.get_connection() as conn:
+        conn.executemany("INSERT INTO books (custom_id, name, author) VALUES (?, ?, ?)",
+                         [(f"QP{i}", f"Plan Book {i}", f"Author {i % 7}") for i in range(40)])
+        conn.executemany("INSERT INTO students (admission_no, name, batch) VALUES (?, ?, ?)",
+                         [(f"QPS{i}", f"Plan Student {i}", f"B{i % 3}") for i in range(20)])
+        conn.executemany("INSERT INTO students_auth (admission_no, password_hash, is_approved) VALUES (?, ?, ?)",
+                         [(f"QPS{i}", library.hash_password("pw"), i % 2) for i in range(20)])
+        student_id = conn.execute("SELECT id FROM students WHERE admission_no = 'QPS0'").fetchone()[0]
+        conn.execute("UPDATE students_auth SET is_approved = 1 WHERE admission_no = 'QPS0'")
+    captured.clear()  # only keep statements issued by the app itself
+
+    client = library.app.test_client()
+    client.post('/librarian_login', data={'username': library.LIBRARIAN_USERNAME, 'password': library.LIBRARIAN_PASSWORD})
+    for book in ('QP1', 'QP2', 'QP3'):
+        client.post('/issue', data={'book_id': book, 'admission_no': 'QPS0', 'loan_period': '14'})
+    client.post('/return', data={'book_id': 'QP3', 'admission_no': 'QPS0'})
+    client.post('/api/circulation', json={'action': 'issue', 'admission_no': 'QPS0', 'book_ids': ['QP3', '4'], 'loan_period': '7'})
+    client.post('/api/circulation', json={'action': 'return', 'admission_no': 'QPS0', 'book_ids': ['QP3', '4']})
+    client.post('/api/lookup', json={'book_ids': ['QP5', '6'], 'admission_nos': ['QPS2', 'NOPE']})
+    with library.get_connection() as conn:
+        loan_id = conn.execute("SELECT MAX(id) FROM transactions WHERE return_date IS NULL").fetchone()[0]
+    library.archive_transactions(older_than_days=-1)  # history now spans both tables
+    library.refresh_rollups(rebuild=True)
+
+    librarian_gets = [
+        '/index', '/approve_students', '/view_books', '/view_students', '/active_issues',
+        '/transaction_history', '/transaction_history?status=active&query=Plan',
+        '/transaction_history?all=1&query=Plan', '/api/view_students?query=Plan',
+        '/transaction_history?status=returned', '/transaction_history?all=1',
+        '/api/transaction_history?cursor=3&status=returned', f'/student_details/{student_id}',
+        f'/edit_student/{student_id}', '/edit_book/1', '/lookup_book/QP1', '/lookup_student/QPS0',
+        '/api/view_books', '/api/view_books?page=2&query=plan&filter=available',
+        '/api/view_books?cursor=&count=1&filter=issued',
+        '/api/view_students', '/api/view_students?page=2&query=Plan&batch=B1&status=pending',
+        '/api/view_students?cursor=&count=1&status=approved',
+        '/export/books.csv?filter=available', '/export/students.csv?status=pending',
+        '/export/active_issues.csv', '/export/transactions.csv?status=active',
+        '/reports', '/api/reports/circulation?grain=month', '/api/reports/batches', '/api/reports/books',
+    ]
+    for url in librarian_gets:
+        client.get(url)
+    for url in ('/api/view_books?cursor=', '/api/view_books?query=plan&cursor=', '/api/view_students?cursor='):
+        next_cursor = client.get(url).get_json()['pagination']['next_cursor']
+        if next_cursor:
+            client.get(url + next_cursor)
+    client.post('/search_books', data={'query': 'plan book'})
+    client.post('/search_books', data={'query': ''})
+    client.post(f'/extend/{loan_id}', data={'new_due_date': '2999-01-01'})
+    client.post(f'/delete_student/{student_id}')
+    client.post('/edit_book/1', data={'custom_id': 'QP1', 'name': 'Plan Book One', 'author': 'Author'})
+    client.post('/add_book', data={'custom_id': 'QPNEW', 'name': 'New Plan Book', 'author': 'Someone'})
+    with library.get_connection() as conn:
+        new_book_id = conn.execute("SELECT id FROM books WHERE custom_id = 'QPNEW'").fetchone()[0]
+    client.post(f'/delete_book/{new_book_id}')
+    client.post('/add_student', data={'admission_no': 'QPNEW', 'name': 'New', 'batch': 'B1', 'password': 'pw'})
+    client.get('/approve_student/QPS1')
+    client.get('/reject_student/QPS3')
+    client.get('/logout')
+
+    client.post('/student_register', data={'admission_no': 'QPREG', 'name': 'Reg', 'batch': 'B1', 'password': 'pw'})
+    client.post('/student_login', data={'admission_no': 'QPS0', 'password': 'pw'})
+    for url in ('/student_dashboard', '/student_search_books', '/student_change_password', '/api/student_loans',
+                '/api/student_search?query=plan', '/api/student_search?cursor=&status=available&count=1'):
+        client.get(url)
+    client.post('/student_change_password', data={'current_password': 'pw', 'new_password': 'pw', 'confirm_password': 'pw'})
+    return library
+
+def explain(conn, sql):
+    placeholders = sql.count('?')
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, (None,) * placeholders)]
+
+def partial_indexes(conn):
+    return {row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND sql LIKE '% WHERE %'")}
+
+def aliases(sql):
+    """Maps table aliases (and bare names) in a statement to their table."""
+    mapping = {}
+    for table, alias in re.findall(r"\b(?:FROM|JOIN|UPDATE|INTO)\s+(\w+)(?:\s+(?!ON\b|WHERE\b|SET\b|ORDER\b|LEFT\b|JOIN\b|GROUP\b|LIMIT\b|VALUES\b)(\w+))?", sql, re.I):
+        mapping[table] = table
+        if alias:
+            mapping[alias] = table
+    return mapping
+
+def plan_violations(conn, sql, partial):
+    """Returns the plan lines that scan a large table without a usable index."""
+    violations = []
+    tables = aliases(sql)
+    plan = explain(conn, sql)
+    for line in plan:
+        match = re.match(r"SCAN (?:\w+\.)?(\w+)(?: USING (?:COVERING )?INDEX (\w+))?", line)
+        if not match or 'VIRTUAL TABLE' in line:
+            continue
+        table = tables.get(match.group(1), match.group(1))
+        index = match.group(2)
+        if table not in LARGE_TABLES:
+            continue
+        if index and index in partial:
+            continue  # scan of a partial index (e.g. active loans only)
+        if re.search(r"\bLIMIT\b", sql, re.I) and not any('TEMP B-TREE' in l for l in plan):
+            continue  # scan already in output order, cut short by LIMIT
+        violations.append(line)
+    return violations
+
+def is_checked(sql):
+    head = sql.split(None, 1)[0].upper() if sql.strip() else ''
+    return head in ('SELECT', 'UPDATE', 'DELETE', 'INSERT', 'WITH')
+
+def main(verbose=False):
+    scratch = tempfile.mkdtemp()
+    os.environ['LIBRARY_DB'] = os.path.join(scratch, 'plans.db')
+
+    captured = []
+    library = run_routes(captured)
+    statements = {normalize(sql) for sql in route_literal_sql() + captured
+                  if not sql.startswith('--') and is_checked(sql)}
+
+    failures = 0
+    conn = sqlite3.connect(os.environ['LIBRARY_DB'])
+    library.attach_archive(conn)
+    partial = partial_indexes(conn)
+    for sql in sorted(statements):
+        # Traced statements have their values inlined; literal ones use '?'.
+        violations = plan_violations(conn, sql, partial)
+        allowed = next((reason for pattern, reason in ALLOWED_SCANS if re.search(pattern, sql)), None)
+        if verbose:
+            print(sql)
+            for line in explain(conn, sql):
+                print("    " + line)
+        if violations and not allowed:
+            failures += 1
+            print(f"FULL SCAN: {sql}")
+            for line in violations:
+                print(f"    {line}")
+    conn.close()
+
+    print("-" * 20)
+    print(f"Checked {len(statements)} statements: {failures} plan regression(s).")
+    return failures
+
+if __name__ == '__main__':
+    sys.exit(1 if main('-v' in sys.argv[1:]) else 0)
@@ -0,0 +1,70 @@
+"""Compares the report rollups with the loans they were built from.
+
+For every month up to today, the active and overdue loans the monthly
+circulation report shows at the month's end (today, for this month) must
+equal a count straight from the loan tables, archive included. So must the
+issues and overdue starts this month's top books report shows. The rollups
+are refreshed first; nothing is checked until they have been built.
+
+    python check_rollups.py
+"""
+import sys
+from datetime import date
+
+import pandas as pd
+
+import app as library
+import reports
+
+def month_ends(first, today):
+    """(period, last day) for every month from first to today's, ending at today."""
+    ends = pd.period_range(first[:7], today[:7], freq='M')
+    return [(period.strftime('%Y-%m'), min(period.end_time.strftime('%Y-%m-%d'), today)) for period in ends]
+
+def check_rollups():
+    if not reports.status(library.REPORTS_DB)['built']:
+        print("The rollups have not been built yet; nothing to check.")
+        return 0
+    library.refresh_rollups()
+    today = date.today().isoformat()
+    with library.get_connection() as conn:
+        loans = pd.DataFrame([tuple(row) for row in conn.execute(
+            "SELECT book_id, issue_date, due_date, return_date FROM all_transactions")],
+            columns=['book_id', 'issue_date', 'due_date', 'return_date'])
+    if loans.empty:
+        print("No loans to check.")
+        return 0
+    overdue_from = (pd.to_datetime(loans['due_date'], format='%Y-%m-%d', errors='coerce')
+                    + pd.Timedelta(days=1)).dt.strftime('%Y-%m-%d')
+    # A loan returned by its due date never goes overdue.
+    overdue_from = overdue_from.where(loans['return_date'].isna() | (loans['return_date'] > loans['due_date']))
+
+    problems = []
+    first = loans['issue_date'].min()
+    rows = {row['period']: row for row in reports.circulation(library.REPORTS_DB, 'month', first, today)}
+    for period, end in month_ends(first, today):
+        out = (loans['issue_date'] <= end) & ~(loans['return_date'] <= end)
+        live = {'active': int(out.sum()), 'overdue': int((out & (overdue_from <= end)).sum())}
+        shown = {column: rows[period][column] for column in live}
+        if shown != live:
+            problems.append(f"{period} (at {end}): the report shows {shown}, the loans say {live}")
+
+    month = today[:7] + '-01'
+    for book in reports.top_books(library.REPORTS_DB, month, today):
+        mine = loans[loans['book_id'] == book['book_id']]
+        live = {'issues': int(mine['issue_date'].between(month, today).sum()),
+                'overdue_starts': int(overdue_from[mine.index].between(month, today).sum())}
+        shown = {column: book[column] for column in live}
+        if shown != live:
+            problems.append(f"top books, book {book['book_id']}: the report shows {shown}, the loans say {live}")
+
+    for problem in problems:
+        print(problem)
+    if problems:
+        print(f"{len(problems)} report figure(s) disagree with the loans. Rebuild the rollups from the reports page.")
+    else:
+        print(f"Month-end stocks for {len(rows)} month(s) and this month's top books match the loans.")
+    return len(problems)
+
+if __name__ == '__main__':
+    sys.exit(1 if check_rollups() else 0)
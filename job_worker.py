@@ -0,0 +1,26 @@
+"""Runs background jobs in their own process, next to the web server.
+
+    JOB_WORKERS=0 gunicorn app:app &
+    JOB_WORKERS=4 python job_worker.py
+
+Uses the same job database and handlers as the app, so jobs queued from
+the librarian pages are picked up here.
+"""
+import time
+
+import app
+
+def main():
+    runner = app._jobs
+    if runner.workers <= 0:
+        raise SystemExit("Set JOB_WORKERS to the number of job threads to run, e.g. JOB_WORKERS=4.")
+    runner.start()
+    print(f"Running jobs from {runner.path} with {runner.workers} thread(s). Ctrl+C to stop.")
+    while True:
+        time.sleep(60)
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
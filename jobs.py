@@ -0,0 +1,336 @@
+"""Background jobs persisted in SQLite.
+
+Imports, exports and other long work are queued as rows in a side
+database (JOB_DB, by default library_jobs.db next to the library
+database) instead of running inside a request. Every worker process that
+touches the runner starts JOB_WORKERS threads which claim queued jobs
+one at a time, so a job queued by one gunicorn worker can be run by any
+of them.
+
+A handler is a function handler(job) that reads job.params, reports
+job.progress(done, total) as it goes and returns a JSON-serializable
+result. Files it produces go in job.output_path(name).
+
+- Cancelling a queued job takes effect at once; a running job stops at its
+  next progress() call, which raises JobCancelled.
+- A handler that raises JobError fails for good. Any other exception is
+  retried with backoff until the job has been tried max_attempts times.
+- Each process heartbeats the jobs it is running. A running job whose
+  heartbeat stops (its worker was killed) is queued again, or failed once
+  out of attempts.
+- Finished jobs and their files are removed after JOB_KEEP_DAYS.
+
+To keep job work out of the web workers entirely, start them with
+JOB_WORKERS=0 and run `python job_worker.py` next to them.
+"""
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+
+from process_threads import ProcessThreads, start_daemon
+
+JOB_DB = os.environ.get('JOB_DB')
+JOB_DIR = os.environ.get('JOB_DIR')
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+JOB_KEEP_DAYS = float(os.environ.get('JOB_KEEP_DAYS', 7))
+POLL_INTERVAL = 2  # seconds between queue checks when idle
+HEARTBEAT_INTERVAL = 10  # seconds
+STALE_AFTER = 60  # seconds without a heartbeat before a running job is recovered
+PROGRESS_INTERVAL = 0.5  # seconds between progress writes
+RETRY_BACKOFF = 10  # seconds, doubled after every failed attempt
+
+FINISHED = ('succeeded', 'failed', 'cancelled')
+
+SCHEMA = ("""CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                params TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                progress INTEGER NOT NULL DEFAULT 0,
+                total INTEGER,
+                message TEXT,
+                result TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                cancel_requested INTEGER NOT NULL DEFAULT 0,
+                created_by TEXT,
+                worker TEXT,
+                created_at REAL NOT NULL,
+                run_after REAL NOT NULL,
+                started_at REAL,
+                heartbeat_at REAL,
+                finished_at REAL
+            )""",
+          "CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs (status, run_after, id)")
+
+class JobError(Exception):
+    """A failure that retrying will not fix, e.g. a file with the wrong columns."""
+
+class JobCancelled(Exception):
+    pass
+
+class Job:
+    """What a handler sees of its job: params, progress reporting and an output folder."""
+    def __init__(self, runner, row):
+        self.runner = runner
+        self.id = row['id']
+        self.kind = row['kind']
+        self.params = json.loads(row['params'])
+        self.attempt = row['attempts']
+        self._reported = 0.0
+
+    def progress(self, done, total=None, message=None, force=False):
+        """Records progress; raises JobCancelled if a librarian cancelled the job."""
+        now = time.monotonic()
+        if not force and now - self._reported < PROGRESS_INTERVAL:
+            return
+        self._reported = now
+        conn = self.runner.connect()
+        try:
+            with conn:
+                conn.execute("""UPDATE jobs SET progress = ?, total = COALESCE(?, total), message = COALESCE(?, message),
+                                heartbeat_at = ? WHERE id = ?""", (done, total, message, time.time(), self.id))
+            cancelled = conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (self.id,)).fetchone()[0]
+        finally:
+            conn.close()
+        if cancelled:
+            raise JobCancelled()
+
+    def output_path(self, filename):
+        folder = os.path.join(self.runner.file_dir, str(self.id))
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, filename)
+
+class JobRunner:
+    """Queues jobs in SQLite and runs them on a thread pool in each worker process."""
+    def __init__(self, db_name, path=JOB_DB, file_dir=JOB_DIR, workers=JOB_WORKERS):
+        stem = os.path.splitext(db_name)[0]
+        self.path = path or stem + '_jobs.db'
+        self.file_dir = file_dir or stem + '_jobs'
+        self.workers = workers
+        self.handlers = {}
+        self._threads = ProcessThreads(self._start_threads)
+        self._wake = None
+        self._running = set()
+        self.worker_name = None
+
+    def register(self, kind, handler, max_attempts=JOB_MAX_ATTEMPTS):
+        self.handlers[kind] = (handler, max_attempts)
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA busy_timeout = 10000")
+        for statement in SCHEMA:
+            conn.execute(statement)
+        return conn
+
+    def start(self):
+        """Starts this process's worker and heartbeat threads, once per process."""
+        self._threads.ensure()
+
+    def _start_threads(self):
+        self._wake = threading.Event()
+        self._running = set()
+        self.worker_name = f"{socket.gethostname()}:{os.getpid()}"
+        if self.workers <= 0:
+            return  # jobs run in job_worker.py instead
+        os.makedirs(self.file_dir, exist_ok=True)
+        for number in range(self.workers):
+            start_daemon(self._work, f'job-worker-{number}')
+        start_daemon(self._heartbeat, 'job-heartbeat')
+
+    # --- Queue ---
+    def submit(self, kind, params, created_by=None):
+        """Queues a job and returns its id."""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        now = time.time()
+        conn = self.connect()
+        try:
+            with conn:
+                job_id = conn.execute("""INSERT INTO jobs (kind, params, max_attempts, created_by, created_at, run_after)
+                                         VALUES (?, ?, ?, ?, ?, ?)""",
+                                      (kind, json.dumps(params), self.handlers[kind][1], created_by, now, now)).lastrowid
+        finally:
+            conn.close()
+        self.start()
+        self._wake.set()
+        self.prune()
+        return job_id
+
+    def get(self, job_id):
+        conn = self.connect()
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return describe(row) if row else None
+
+    def recent(self, limit=50):
+        self.start()  # so the workers polling a job page also pick up queued work
+        conn = self.connect()
+        try:
+            rows = conn.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        finally:
+            conn.close()
+        return [describe(row) for row in rows]
+
+    def cancel(self, job_id):
+        """Cancels a queued job, or asks a running one to stop. Returns False if already finished."""
+        conn = self.connect()
+        try:
+            with conn:
+                queued = conn.execute("""UPDATE jobs SET status = 'cancelled', cancel_requested = 1, finished_at = ?
+                                         WHERE id = ? AND status = 'queued'""", (time.time(), job_id)).rowcount
+                running = conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'",
+                                       (job_id,)).rowcount
+        finally:
+            conn.close()
+        return bool(queued or running)
+
+    def retry(self, job_id):
+        """Queues a failed or cancelled job again with a fresh set of attempts."""
+        conn = self.connect()
+        try:
+            with conn:
+                changed = conn.execute("""UPDATE jobs SET status = 'queued', attempts = 0, cancel_requested = 0,
+                                          progress = 0, message = NULL, error = NULL, result = NULL,
+                                          run_after = ?, finished_at = NULL
+                                          WHERE id = ? AND status IN ('failed', 'cancelled')""",
+                                       (time.time(), job_id)).rowcount
+        finally:
+            conn.close()
+        if changed:
+            self.start()
+            self._wake.set()
+        return bool(changed)
+
+    def prune(self):
+        """Deletes finished jobs older than JOB_KEEP_DAYS, with their files."""
+        cutoff = time.time() - JOB_KEEP_DAYS * 86400
+        conn = self.connect()
+        try:
+            with conn:
+                old = [row[0] for row in conn.execute(
+                    f"SELECT id FROM jobs WHERE status IN ({', '.join('?' * len(FINISHED))}) AND finished_at < ?",
+                    (*FINISHED, cutoff))]
+                conn.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in old])
+        finally:
+            conn.close()
+        for job_id in old:
+            shutil.rmtree(os.path.join(self.file_dir, str(job_id)), ignore_errors=True)
+
+    # --- Workers ---
+    def _claim(self):
+        """Atomically takes the oldest runnable job, after recovering abandoned ones."""
+        now = time.time()
+        conn = self.connect()
+        try:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute("""UPDATE jobs SET status = CASE
+                                    WHEN cancel_requested THEN 'cancelled'
+                                    WHEN attempts >= max_attempts THEN 'failed'
+                                    ELSE 'queued' END,
+                                error = CASE WHEN attempts >= max_attempts AND NOT cancel_requested
+                                    THEN 'The worker running this job stopped.' ELSE error END,
+                                finished_at = CASE WHEN cancel_requested OR attempts >= max_attempts THEN ? END,
+                                run_after = ?
+                                WHERE status = 'running' AND heartbeat_at < ?""", (now, now, now - STALE_AFTER))
+                row = conn.execute("""SELECT * FROM jobs WHERE status = 'queued' AND run_after <= ?
+                                      ORDER BY id LIMIT 1""", (now,)).fetchone()
+                if row is None:
+                    return None
+                conn.execute("""UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?,
+                                started_at = ?, heartbeat_at = ?, error = NULL WHERE id = ?""",
+                             (self.worker_name, now, now, row['id']))
+                return conn.execute("SELECT * FROM jobs WHERE id = ?", (row['id'],)).fetchone()
+        finally:
+            conn.close()
+
+    def _work(self):
+        while True:
+            try:
+                row = self._claim()
+            except sqlite3.Error:
+                row = None
+            if row is None:
+                self._wake.wait(POLL_INTERVAL)
+                self._wake.clear()
+                continue
+            self._running.add(row['id'])
+            try:
+                self._run(row)
+            finally:
+                self._running.discard(row['id'])
+
+    def _run(self, row):
+        job = Job(self, row)
+        handler = self.handlers.get(row['kind'], (None,))[0]
+        try:
+            if handler is None:
+                raise JobError(f"No handler for job kind '{row['kind']}'.")
+            result = handler(job)
+        except JobCancelled:
+            self._finish(job.id, 'cancelled', message='Cancelled.')
+        except JobError as e:
+            self._finish(job.id, 'failed', error=str(e))
+        except Exception as e:
+            if row['attempts'] < row['max_attempts']:
+                delay = RETRY_BACKOFF * 2 ** (row['attempts'] - 1)
+                self._finish(job.id, 'queued', error=f"Attempt {row['attempts']} failed: {e}", run_after=time.time() + delay)
+            else:
+                self._finish(job.id, 'failed', error=f"{e}\n\n{traceback.format_exc(limit=5)}")
+        else:
+            self._finish(job.id, 'succeeded', result=result)
+
+    def _finish(self, job_id, status, result=None, error=None, message=None, run_after=None):
+        conn = self.connect()
+        try:
+            with conn:
+                conn.execute("""UPDATE jobs SET status = ?, result = ?, error = ?, message = COALESCE(?, message),
+                                run_after = COALESCE(?, run_after),
+                                progress = CASE WHEN ? = 'succeeded' THEN COALESCE(total, progress) ELSE progress END,
+                                finished_at = CASE WHEN ? IN ('succeeded', 'failed', 'cancelled') THEN ? END
+                                WHERE id = ?""",
+                             (status, json.dumps(result) if result is not None else None, error, message,
+                              run_after, status, status, time.time(), job_id))
+        finally:
+            conn.close()
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            running = list(self._running)
+            if not running:
+                continue
+            try:
+                conn = self.connect()
+                try:
+                    with conn:
+                        conn.executemany("UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = 'running'",
+                                         [(time.time(), job_id) for job_id in running])
+                finally:
+                    conn.close()
+            except sqlite3.Error:
+                pass  # try again next beat; STALE_AFTER allows for several misses
+
+def describe(row):
+    """A job row as a JSON-friendly dict for the API and templates."""
+    job = dict(row)
+    job['params'] = json.loads(job['params'])
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    job['finished'] = job['status'] in FINISHED
+    job['percent'] = round(100 * job['progress'] / job['total']) if job['total'] else (100 if job['status'] == 'succeeded' else 0)
+    for field in ('created_at', 'started_at', 'finished_at'):
+        job[field] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(job[field])) if job[field] else None
+    return job
@@ -0,0 +1,75 @@
+"""Takes, lists, verifies and restores online backups of the library.
+
+    python manage_backups.py snapshot          # one snapshot now (for cron)
+    python manage_backups.py run --every 6     # a snapshot every 6 hours, until stopped
+    python manage_backups.py list
+    python manage_backups.py verify 20261017-020000
+    python manage_backups.py restore 20261017-020000
+
+Snapshots go to BACKUP_DIR (default library_backups/), and only the newest
+BACKUP_KEEP are kept. Taking one is safe while the app is serving
+requests. Restore works on a running app too, but restart it afterwards so
+no worker keeps serving lookups it cached before the restore. Set
+METRICS_DIR to the server's to see these runs on /metrics.
+"""
+import argparse
+import sys
+import time
+
+import metrics
+from app import _backups, restore_backup
+from backups import BackupError
+
+def report(done, total):
+    print(f"\rCopied {done} of {total} pages...", end='', flush=True)
+
+def snapshot():
+    manifest = _backups.snapshot(progress=report)
+    metrics.flush(force=True)
+    size = sum(entry['bytes'] for entry in manifest['files'].values())
+    print(f"\nSaved snapshot {manifest['name']} ({size / 1048576:.1f} MB) in {manifest['duration']:.1f}s.")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('snapshot', help="take one snapshot and prune old ones")
+    run = commands.add_parser('run', help="take a snapshot every few hours until stopped")
+    run.add_argument('--every', type=float, default=24, help="hours between snapshots (default 24)")
+    commands.add_parser('list', help="list the complete snapshots, newest first")
+    for name in ('verify', 'restore'):
+        commands.add_parser(name, help=f"{name} a snapshot").add_argument('name')
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'snapshot':
+            snapshot()
+        elif args.command == 'run':
+            print(f"Backing up to {_backups.path} every {args.every:g} hour(s). Ctrl+C to stop.")
+            while True:
+                started = time.monotonic()
+                try:
+                    snapshot()
+                except Exception as e:  # keep the schedule going; the failure is counted
+                    metrics.flush(force=True)
+                    print(f"\nBackup failed: {e}", file=sys.stderr)
+                time.sleep(max(args.every * 3600 - (time.monotonic() - started), 0))
+        elif args.command == 'list':
+            for manifest in _backups.list():
+                size = sum(entry['bytes'] for entry in manifest['files'].values())
+                print(f"{manifest['name']}  {size / 1048576:8.1f} MB  {', '.join(manifest['files'])}")
+        elif args.command == 'verify':
+            _backups.verify(args.name)
+            print(f"Snapshot {args.name} matches its checksums and passes the integrity check.")
+        elif args.command == 'restore':
+            restore_backup(args.name, progress=report)
+            print(f"\nRestored snapshot {args.name}. Restart the app to drop what its workers had cached.")
+    except BackupError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,233 @@
+"""Request and SQL metrics, exported in the Prometheus text format.
+
+Each worker process counts into its own in-memory Registry. Workers
+periodically write a snapshot of their registry to METRICS_DIR, one file
+per process id. /metrics sums every file it finds, so the counters and
+histograms cover all gunicorn workers, including workers that have since
+been restarted.
+
+By default METRICS_DIR is keyed by the parent process id, so each
+gunicorn master starts from zero. When setting it explicitly, empty it
+before starting the server, as with prometheus_client's multiprocess mode.
+
+SQL is timed by the connection factory below: the time spent inside
+execute()/executemany(), the fetch*() calls and row iteration, per
+normalized statement.
+"""
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+
+METRICS_DIR = os.environ.get('METRICS_DIR') or os.path.join(
+    tempfile.gettempdir(), 'library_metrics', str(os.getppid()))
+FLUSH_INTERVAL = 5  # seconds between snapshot writes per worker
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64)
+
+HELP = {
+    'library_http_requests_total': ('counter', "HTTP requests by route, method and status."),
+    'library_http_request_duration_seconds': ('histogram', "Time to build each response, by route."),
+    'library_sql_queries_per_request': ('histogram', "SQL statements executed per request, by route."),
+    'library_sql_statements_total': ('counter', "SQL statements executed, by route and normalized statement."),
+    'library_sql_statement_seconds_total': ('counter', "Time spent in SQLite, by route and normalized statement."),
+    'library_shared_cache_requests_total': ('counter', "Shared result cache lookups, by cache and result (hit, miss, stale, error)."),
+    'library_shared_cache_evictions_total': ('counter', "Shared result cache entries evicted to stay under SHARED_CACHE_BYTES."),
+    'library_backup_runs_total': ('counter', "Backup snapshots taken, by result (succeeded, failed)."),
+    'library_backup_duration_seconds': ('histogram', "Time to take a complete backup snapshot."),
+    'library_backup_pages_total': ('counter', "Database pages copied by the backup API, by database (main, archive)."),
+    'library_backup_bytes_total': ('counter', "Bytes of backup files written, after compression, by database."),
+}
+
+class Registry:
+    """Thread-safe counters and histograms keyed by metric name and labels."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value, buckets):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            entry = self.histograms.get(key)
+            if entry is None:
+                entry = self.histograms[key] = {'buckets': list(buckets), 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    entry['counts'][i] += 1
+            entry['sum'] += value
+            entry['count'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': [[name, dict(labels), value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, dict(labels), dict(entry, counts=list(entry['counts']))]
+                               for (name, labels), entry in self.histograms.items()],
+            }
+
+    def merge(self, snapshot):
+        for name, labels, value in snapshot['counters']:
+            self.inc(name, labels, value)
+        for name, labels, entry in snapshot['histograms']:
+            key = (name, tuple(sorted(labels.items())))
+            with self._lock:
+                mine = self.histograms.setdefault(
+                    key, {'buckets': entry['buckets'], 'counts': [0] * len(entry['buckets']), 'sum': 0.0, 'count': 0})
+                mine['counts'] = [a + b for a, b in zip(mine['counts'], entry['counts'])]
+                mine['sum'] += entry['sum']
+                mine['count'] += entry['count']
+
+registry = Registry()
+_last_flush = {'at': 0.0, 'pid': None}
+
+def flush(force=False):
+    """Writes this worker's snapshot to METRICS_DIR, at most every FLUSH_INTERVAL seconds."""
+    now = time.monotonic()
+    if not force and _last_flush['pid'] == os.getpid() and now - _last_flush['at'] < FLUSH_INTERVAL:
+        return
+    _last_flush['at'], _last_flush['pid'] = now, os.getpid()
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+    fd, temp_path = tempfile.mkstemp(dir=METRICS_DIR, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(registry.snapshot(), f)
+    os.replace(temp_path, path)
+
+def collect():
+    """Returns a Registry holding the sum of every worker's last snapshot."""
+    flush(force=True)
+    total = Registry()
+    for filename in os.listdir(METRICS_DIR):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, filename)) as f:
+                total.merge(json.load(f))
+        except (OSError, ValueError):
+            continue  # a worker is replacing its file right now
+    return total
+
+def _label_text(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in pairs) + '}'
+
+def render(total):
+    """Formats a Registry in the Prometheus text exposition format."""
+    lines = []
+    for name, (kind, help_text) in HELP.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == 'counter':
+            for (metric, labels), value in sorted(total.counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_label_text(labels)} {value:g}")
+            continue
+        for (metric, labels), entry in sorted(total.histograms.items()):
+            if metric != name:
+                continue
+            for bound, count in zip(entry['buckets'], entry['counts']):
+                lines.append(f"{name}_bucket{_label_text(labels, [('le', f'{bound:g}')])} {count}")
+            lines.append(f"{name}_bucket{_label_text(labels, [('le', '+Inf')])} {entry['count']}")
+            lines.append(f"{name}_sum{_label_text(labels)} {entry['sum']:g}")
+            lines.append(f"{name}_count{_label_text(labels)} {entry['count']}")
+    return "\n".join(lines) + "\n"
+
+# --- SQL timing ---
+
+_literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+def normalize_sql(sql):
+    """Collapses whitespace and literal values so equal statements share one label."""
+    return _literals.sub('?', re.sub(r"\s+", " ", sql).strip())[:200]
+
+# Set by the app: called once per statement as observer(sql, params, seconds).
+# params is None for executemany().
+observer = None
+
+class TimedCursor(sqlite3.Cursor):
+    """A cursor that times each statement across execute, fetch and iteration.
+
+    A statement is reported when its rows run out, when the cursor runs
+    the next statement, or when the cursor is closed or dropped.
+    """
+    _sql = None
+    _params = None
+    _elapsed = 0.0
+
+    def _timed(self, call, *args):
+        started = time.perf_counter()
+        try:
+            return call(*args)
+        finally:
+            self._elapsed += time.perf_counter() - started
+
+    def _finish(self):
+        sql, self._sql = self._sql, None
+        if sql is not None and observer is not None:
+            observer(sql, self._params, self._elapsed)
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        self._sql, self._params, self._elapsed = sql, parameters, 0.0
+        return self._timed(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        self._sql, self._params, self._elapsed = sql, None, 0.0
+        return self._timed(super().executemany, sql, seq_of_parameters)
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        rows = self._timed(super().fetchmany, size)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        self._finish()
+        return rows
+
+    def __next__(self):
+        try:
+            return self._timed(super().__next__)
+        except StopIteration:
+            self._finish()
+            raise
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        self._finish()
+
+class TimedConnection(sqlite3.Connection):
+    """Connection factory whose cursors, including conn.execute() shortcuts, are timed."""
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
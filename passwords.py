@@ -0,0 +1,74 @@
+"""Password hashing for student portal accounts.
+
+Hashes are stored as "scrypt$<n>$<r>$<p>$<salt>$<hash>" (base64 salt and
+hash). Older accounts still hold a bare SHA-256 hex digest; those verify
+through check_password() and are re-hashed at their next login.
+
+This module has no side effects on import, so process-pool workers can
+load it cheaply when hashing passwords in bulk.
+"""
+import base64
+import hashlib
+import hmac
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+HASH_SCHEME = 'scrypt'
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+# Below this many passwords a process pool costs more than it saves.
+PARALLEL_THRESHOLD = 64
+PARALLEL_BATCH_SIZE = 32
+
+def _b64encode(raw):
+    return base64.b64encode(raw).decode()
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * r * n, dklen=KEY_BYTES)
+
+def hash_password(password):
+    """Hashes a password with a random salt using scrypt."""
+    salt = os.urandom(SALT_BYTES)
+    key = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f"{HASH_SCHEME}${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64encode(salt)}${_b64encode(key)}"
+
+def check_password(hashed_password, provided_password):
+    """Checks a provided password against a stored hash (scrypt or legacy SHA-256)."""
+    if not hashed_password:
+        return False
+    if '$' not in hashed_password:
+        legacy = hashlib.sha256(provided_password.encode()).hexdigest()
+        return hmac.compare_digest(hashed_password, legacy)
+    try:
+        scheme, n, r, p, salt, key = hashed_password.split('$')
+        if scheme != HASH_SCHEME:
+            return False
+        expected = base64.b64decode(key)
+        actual = _scrypt(provided_password, base64.b64decode(salt), int(n), int(r), int(p))
+    except (ValueError, TypeError):
+        return False
+    return hmac.compare_digest(expected, actual)
+
+def password_needs_rehash(hashed_password):
+    """True for legacy hashes or scrypt hashes made with older cost settings."""
+    return not (hashed_password or '').startswith(f"{HASH_SCHEME}${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$")
+
+def hash_passwords(passwords, executor=None):
+    """Hashes a list of passwords, returning hashes in the same order.
+
+    Large lists are spread over a process pool: pass an existing
+    ProcessPoolExecutor to reuse it across calls, or one is created for
+    this call and shut down afterwards.
+    """
+    passwords = list(passwords)
+    if len(passwords) < PARALLEL_THRESHOLD:
+        return [hash_password(password) for password in passwords]
+    if executor is not None:
+        return list(executor.map(hash_password, passwords, chunksize=PARALLEL_BATCH_SIZE))
+    with ProcessPoolExecutor() as pool:
+        return list(pool.map(hash_password, passwords, chunksize=PARALLEL_BATCH_SIZE))
@@ -0,0 +1,36 @@
+"""Background threads started once per process.
+
+Threads do not survive a fork, so a gunicorn worker forked from a parent
+that already started its threads has none of them. A ProcessThreads runs
+its start function again the first time it is asked for in each new
+process; the start function resets whatever per-process state goes with
+the threads (queues, events, counters) and starts them.
+"""
+import os
+import threading
+
+def start_daemon(target, name):
+    """Starts a daemon thread running target()."""
+    thread = threading.Thread(target=target, name=name, daemon=True)
+    thread.start()
+    return thread
+
+class ProcessThreads:
+    """Calls start() once in each process that asks for its threads."""
+    def __init__(self, start):
+        self._start = start
+        self._lock = threading.Lock()
+        self._pid = None
+
+    @property
+    def running(self):
+        """True once start() has run in this process."""
+        return self._pid == os.getpid()
+
+    def ensure(self):
+        """Runs start() unless it already ran in this process."""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._start()
@@ -0,0 +1,23 @@
+import sqlite3
+from app import create_books_fts, rebuild_books_fts
+
+# --- Configuration ---
+DB_FILE = 'library.db'
+
+def rebuild_search_index():
+    """Creates (if needed) and fully rebuilds the books full-text search index."""
+    conn = sqlite3.connect(DB_FILE)
+    cursor = conn.cursor()
+
+    create_books_fts(cursor)
+    rebuild_books_fts(cursor)
+    # Merge the freshly written index segments for faster queries.
+    cursor.execute("INSERT INTO books_fts(books_fts) VALUES ('optimize')")
+    conn.commit()
+
+    indexed = cursor.execute("SELECT COUNT(*) FROM books").fetchone()[0]
+    conn.close()
+    print(f"Search index rebuilt for {indexed} books.")
+
+if __name__ == '__main__':
+    rebuild_search_index()
@@ -0,0 +1,330 @@
+"""Circulation rollups for the librarian reports.
+
+Daily and monthly counts of issues, returns and loans going overdue, per
+batch and per book, live in a side database (REPORTS_DB, by default
+library_reports.db next to the library database). Reports read only these
+rollups, never the loan tables, so a term-end report over years of
+history costs a few thousand rows instead of a scan under the desk's feet.
+
+Every loan contributes dated events:
+
+- an issue on its issue_date, and a return on its return_date;
+- an overdue start the day after its due_date, unless returned by then,
+  and an overdue end on its return_date if that was late.
+
+Active and overdue loans at the end of any day or month are running sums
+of those events, computed with pandas when a report is asked for.
+
+Rollups are kept up to date incrementally. Triggers in the library
+database append the id of every inserted, returned or extended loan to
+transaction_changes; apply_changes() reads the entries after the saved
+watermark, subtracts what those loans contributed last time and adds what
+they contribute now. Loans still out are kept in open_loans for that.
+A returned loan never changes again, so only open loans are kept. Their
+book and batch are fixed when the loan is first rolled up. rebuild()
+recomputes everything from a columnar extract of every loan, a chunk at a
+time.
+"""
+import datetime
+import json
+import pathlib
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+EXTRACT_CHUNK = 50000
+ROLLUPS = (('day', 'batch'), ('month', 'batch'), ('month', 'book'))
+MEASURES = ('issues', 'returns', 'overdue_starts', 'overdue_ends')
+LOAN_COLUMNS = ['id', 'book_id', 'batch', 'issue_date', 'due_date', 'return_date']
+
+SCHEMA = ("""CREATE TABLE IF NOT EXISTS rollups (
+                grain TEXT NOT NULL,
+                dimension TEXT NOT NULL,
+                period TEXT NOT NULL,
+                key TEXT NOT NULL,
+                issues INTEGER NOT NULL DEFAULT 0,
+                returns INTEGER NOT NULL DEFAULT 0,
+                overdue_starts INTEGER NOT NULL DEFAULT 0,
+                overdue_ends INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (grain, dimension, period, key)
+            ) WITHOUT ROWID""",
+          """CREATE TABLE IF NOT EXISTS open_loans (
+                id INTEGER PRIMARY KEY,
+                book_id INTEGER,
+                batch TEXT,
+                issue_date TEXT,
+                due_date TEXT
+            )""",
+          """CREATE TABLE IF NOT EXISTS rollup_state (
+                key TEXT PRIMARY KEY,
+                value
+            )""")
+
+# The library-side statements, run by the app on its own connections.
+CHANGES_SQL = "SELECT seq, loan_id FROM transaction_changes WHERE seq > ? ORDER BY seq"
+LOANS_SQL = """SELECT t.id, t.book_id, s.batch, t.issue_date, t.due_date, t.return_date
+               FROM all_transactions t LEFT JOIN students s ON s.id = t.student_id"""
+
+def connect(path, timeout=5):
+    conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    for statement in SCHEMA:
+        conn.execute(statement)
+    return conn
+
+def _state(conn, key, default=None):
+    row = conn.execute("SELECT value FROM rollup_state WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else default
+
+def _set_state(conn, **values):
+    conn.executemany("INSERT OR REPLACE INTO rollup_state (key, value) VALUES (?, ?)", values.items())
+
+def status(path):
+    """{'built': bool, 'watermark': int, 'refreshed_at': unix time or None}.
+
+    Opens the rollups read-only: asking before the first build creates nothing.
+    """
+    not_built = {'built': False, 'watermark': None, 'refreshed_at': None}
+    try:
+        conn = sqlite3.connect(pathlib.Path(path).resolve().as_uri() + '?mode=ro', uri=True, timeout=5)
+    except sqlite3.OperationalError:
+        return not_built  # no file yet
+    try:
+        watermark = _state(conn, 'watermark')
+        return {'built': watermark is not None, 'watermark': watermark, 'refreshed_at': _state(conn, 'refreshed_at')}
+    except sqlite3.OperationalError:
+        return not_built  # a file without the rollup tables
+    finally:
+        conn.close()
+
+# --- Events ---
+def loans_frame(rows):
+    frame = pd.DataFrame(rows, columns=LOAN_COLUMNS)
+    frame['book_id'] = frame['book_id'].astype('Int64')
+    return frame
+
+def loan_events(loans, sign=1):
+    """One row per dated event of a frame of loans: date, measure, book_id, batch, count."""
+    due = pd.to_datetime(loans['due_date'], format='%Y-%m-%d', errors='coerce')
+    returned = loans['return_date'].notna()
+    late = ~returned | (loans['return_date'] > loans['due_date'])
+    overdue_from = (due + pd.Timedelta(days=1)).dt.strftime('%Y-%m-%d')
+    parts = [(loans['issue_date'], 'issues', slice(None)),
+             (loans['return_date'], 'returns', returned),
+             (overdue_from, 'overdue_starts', late & due.notna()),
+             (loans['return_date'], 'overdue_ends', returned & late)]
+    events = pd.concat([pd.DataFrame({'date': dates[mask], 'measure': measure,
+                                      'book_id': loans['book_id'][mask], 'batch': loans['batch'][mask]})
+                        for dates, measure, mask in parts], ignore_index=True)
+    events['batch'] = events['batch'].fillna('')
+    events['count'] = sign
+    return events
+
+def aggregate(events):
+    """Sums events into {(grain, dimension): frame of period, key and the MEASURES}."""
+    tables = {}
+    for grain, dimension in ROLLUPS:
+        period = events['date'] if grain == 'day' else events['date'].str[:7]
+        key = events['batch'] if dimension == 'batch' else events['book_id'].astype('string')
+        frame = pd.DataFrame({'period': period, 'key': key, 'measure': events['measure'], 'count': events['count']})
+        frame = frame.dropna(subset=['period', 'key'])
+        table = (frame.groupby(['period', 'key', 'measure'])['count'].sum()
+                 .unstack('measure', fill_value=0).reindex(columns=list(MEASURES), fill_value=0))
+        tables[grain, dimension] = table[(table != 0).any(axis=1)].reset_index()
+    return tables
+
+def _add(reports, tables):
+    for (grain, dimension), table in tables.items():
+        reports.executemany("""INSERT INTO rollups (grain, dimension, period, key, issues, returns, overdue_starts, overdue_ends)
+                               VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                               ON CONFLICT (grain, dimension, period, key) DO UPDATE SET
+                                   issues = issues + excluded.issues, returns = returns + excluded.returns,
+                                   overdue_starts = overdue_starts + excluded.overdue_starts,
+                                   overdue_ends = overdue_ends + excluded.overdue_ends""",
+                            [(grain, dimension, row[0], row[1], *map(int, row[2:]))
+                             for row in table.itertuples(index=False)])
+
+def _remember_open(reports, loans):
+    open_loans = loans[loans['return_date'].isna()]
+    reports.executemany("INSERT OR REPLACE INTO open_loans (id, book_id, batch, issue_date, due_date) VALUES (?, ?, ?, ?, ?)",
+                        [(int(row.id), None if pd.isna(row.book_id) else int(row.book_id), row.batch,
+                          row.issue_date, row.due_date) for row in open_loans.itertuples(index=False)])
+
+# --- Maintenance ---
+def rebuild(conn, path, progress=None):
+    """Recomputes every rollup from the loans; returns the new watermark.
+
+    conn is a library connection with the archive attached and no
+    transaction open. progress(done, total) is called after every chunk.
+    """
+    reports = connect(path, timeout=30)
+    try:
+        reports.execute("BEGIN IMMEDIATE")
+        conn.execute("BEGIN")  # the watermark and the extract come from one snapshot
+        try:
+            watermark = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM transaction_changes").fetchone()[0]
+            total = conn.execute("SELECT COUNT(*) FROM all_transactions").fetchone()[0]
+            reports.execute("DELETE FROM rollups")
+            reports.execute("DELETE FROM open_loans")
+            cursor = conn.execute(LOANS_SQL)
+            done, parts = 0, []
+            while rows := cursor.fetchmany(EXTRACT_CHUNK):
+                loans = loans_frame([tuple(row) for row in rows])
+                parts.extend(aggregate(loan_events(loans)).items())
+                _remember_open(reports, loans)
+                done += len(loans)
+                if progress:
+                    progress(done, total)
+        finally:
+            conn.rollback()
+        # Chunks overlap on their edge periods; sum them once more before writing.
+        tables = {}
+        for rollup in ROLLUPS:
+            frames = [table for key, table in parts if key == rollup]
+            if frames:
+                tables[rollup] = pd.concat(frames).groupby(['period', 'key'], as_index=False)[list(MEASURES)].sum()
+        _add(reports, tables)
+        _set_state(reports, watermark=watermark, refreshed_at=int(datetime.datetime.now().timestamp()))
+        reports.execute("COMMIT")
+    except BaseException:
+        if reports.in_transaction:
+            reports.execute("ROLLBACK")
+        raise
+    finally:
+        reports.close()
+    return watermark
+
+def apply_changes(conn, path, timeout=5):
+    """Folds the loans changed since the watermark into the rollups; returns (changed loans, watermark).
+
+    Raises sqlite3.OperationalError if another process holds the rollups
+    for longer than timeout seconds.
+    """
+    reports = connect(path, timeout=timeout)
+    try:
+        reports.execute("BEGIN IMMEDIATE")
+        watermark = _state(reports, 'watermark')
+        if watermark is None:
+            raise LookupError("The rollups have not been built yet.")
+        conn.execute("BEGIN")  # the change list and the loans come from one snapshot
+        try:
+            changes = conn.execute(CHANGES_SQL, (watermark,)).fetchall()
+            ids = sorted({row[1] for row in changes})
+            current = loans_frame([tuple(row) for row in conn.execute(
+                LOANS_SQL + " WHERE t.id IN (SELECT value FROM json_each(?))", (json.dumps(ids),))])
+        finally:
+            conn.rollback()
+        if changes:
+            previous = loans_frame(reports.execute(
+                """SELECT id, book_id, batch, issue_date, due_date, NULL FROM open_loans
+                   WHERE id IN (SELECT value FROM json_each(?))""", (json.dumps(ids),)).fetchall())
+            # A loan keeps the book and batch it was first counted under.
+            known = previous.set_index('id')
+            current['book_id'] = current['id'].map(known['book_id']).fillna(current['book_id']).astype('Int64')
+            current['batch'] = current['id'].map(known['batch']).fillna(current['batch'])
+            events = pd.concat([loan_events(previous, -1), loan_events(current, 1)], ignore_index=True)
+            _add(reports, aggregate(events))
+            reports.execute("DELETE FROM open_loans WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(ids),))
+            _remember_open(reports, current)
+            watermark = changes[-1][0]
+        _set_state(reports, watermark=watermark, refreshed_at=int(datetime.datetime.now().timestamp()))
+        reports.execute("COMMIT")
+    except BaseException:
+        if reports.in_transaction:
+            reports.execute("ROLLBACK")
+        raise
+    finally:
+        reports.close()
+    return len(ids), watermark
+
+# --- Reports ---
+def _rollup_frame(reports, grain, dimension, end, start=None, keys=None):
+    sql = f"""SELECT period, key, {', '.join(MEASURES)} FROM rollups
+              WHERE grain = ? AND dimension = ? AND period <= ?"""
+    params = [grain, dimension, end]
+    if start is not None:
+        sql += " AND period >= ?"
+        params.append(start)
+    if keys:
+        sql += " AND key IN (SELECT value FROM json_each(?))"
+        params.append(json.dumps(list(keys)))
+    return pd.DataFrame(reports.execute(sql, params).fetchall(), columns=['period', 'key', *MEASURES])
+
+def _periods(grain, start, end):
+    if grain == 'day':
+        return pd.date_range(start, end, freq='D').strftime('%Y-%m-%d')
+    return pd.period_range(start[:7], end[:7], freq='M').strftime('%Y-%m')
+
+def _with_stocks(frame, grain, start, end):
+    """Per-period flows plus active and overdue loans at the end of each period, from start to end."""
+    periods = _periods(grain, start, end)
+    flows = frame.groupby('period')[list(MEASURES)].sum().sort_index()
+    stocks = pd.DataFrame({'active': (flows['issues'] - flows['returns']).cumsum(),
+                           'overdue': (flows['overdue_starts'] - flows['overdue_ends']).cumsum()})
+    # Carry the running totals over days with no events (and into the range from before it).
+    index = flows.index.union(periods)
+    stocks = stocks.reindex(index).ffill().fillna(0).astype(np.int64).reindex(periods)
+    flows = flows.reindex(periods, fill_value=0)
+    return flows.join(stocks)
+
+def circulation(path, grain, start, end, batch=None):
+    """Issues, returns, loans going overdue, and active/overdue loans per day or month."""
+    keys = [batch] if batch is not None else None
+    reports = connect(path)
+    try:
+        if grain == 'day':
+            frame = _rollup_frame(reports, 'day', 'batch', end, keys=keys)
+        else:
+            # Whole months before the last one come from the month rollup. The
+            # last month is summed from its days up to end, so events dated
+            # later (loans due to go overdue next week) stay out of it.
+            before = (pd.Period(end[:7], freq='M') - 1).strftime('%Y-%m')
+            days = _rollup_frame(reports, 'day', 'batch', end, start=end[:7] + '-01', keys=keys)
+            frame = pd.concat([_rollup_frame(reports, 'month', 'batch', before, keys=keys),
+                               days.assign(period=days['period'].str[:7])], ignore_index=True)
+    finally:
+        reports.close()
+    table = _with_stocks(frame, grain, start, end)
+    return [{'period': period, **{column: int(value) for column, value in row.items()}}
+            for period, row in table.iterrows()]
+
+def batch_summary(path, start, end):
+    """Per batch over a date range: flows, active and overdue loans at the end, peak and average active."""
+    reports = connect(path)
+    try:
+        frame = _rollup_frame(reports, 'day', 'batch', end)
+    finally:
+        reports.close()
+    summary = []
+    for batch, rows in frame.groupby('key'):
+        table = _with_stocks(rows, 'day', start, end)
+        summary.append({'batch': batch,
+                        **{column: int(table[column].sum()) for column in MEASURES},
+                        'active_at_end': int(table['active'].iloc[-1]),
+                        'overdue_at_end': int(table['overdue'].iloc[-1]),
+                        'peak_active': int(table['active'].max()),
+                        'average_active': round(float(table['active'].mean()), 1)})
+    return sorted(summary, key=lambda row: (-row['issues'], row['batch']))
+
+def top_books(path, start, end, limit=20):
+    """Most issued books over the months from start to end, with how many went overdue."""
+    reports = connect(path)
+    try:
+        frame = _rollup_frame(reports, 'month', 'book', end[:7], start=start[:7])
+        # An open loan's overdue start is rolled up ahead of its date; the
+        # ones that have not come yet are taken back out.
+        projected = pd.DataFrame(reports.execute(
+            """SELECT CAST(book_id AS TEXT), COUNT(*) FROM open_loans
+               WHERE book_id IS NOT NULL AND date(due_date, '+1 day') > ?
+                 AND substr(date(due_date, '+1 day'), 1, 7) BETWEEN ? AND ?
+               GROUP BY book_id""", (datetime.date.today().isoformat(), start[:7], end[:7])).fetchall(),
+            columns=['key', 'projected']).set_index('key')['projected']
+    finally:
+        reports.close()
+    totals = frame.groupby('key')[['issues', 'overdue_starts']].sum()
+    totals['overdue_starts'] -= projected.reindex(totals.index, fill_value=0)
+    totals = totals[totals['issues'] > 0].sort_values(['issues', 'overdue_starts'], ascending=False).head(limit)
+    return [{'book_id': int(key), 'issues': int(row['issues']), 'overdue_starts': int(row['overdue_starts'])}
+            for key, row in totals.iterrows()]
@@ -0,0 +1,153 @@
+"""Result cache shared by every worker process.
+
+Entries live in a side SQLite database (SHARED_CACHE_DB, by default
+library_cache.db next to the library database), so a leaderboard computed
+by one gunicorn worker is served by all of them. Each entry has:
+
+- a TTL, after which it is recomputed;
+- a set of tags; invalidate('books') drops every entry tagged 'books';
+- a stamp chosen by the caller (the app uses the data versions of the
+  tagged tables), and a get() with a different stamp counts as stale.
+
+The file is bounded by SHARED_CACHE_BYTES: once it holds more, expired
+entries go first, then the least recently used ones. Hits, misses, stale
+entries and evictions are counted in the metrics registry.
+
+The cache is best-effort. If the side file is locked or unwritable, get()
+reports a miss and set() does nothing, so callers just compute the value.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+
+SHARED_CACHE_DB = os.environ.get('SHARED_CACHE_DB')
+SHARED_CACHE_BYTES = int(os.environ.get('SHARED_CACHE_BYTES', 8 * 1024 * 1024))
+TOUCH_INTERVAL = 30  # seconds; a hit updates last_used at most this often
+
+SCHEMA = ("""CREATE TABLE IF NOT EXISTS cache_entries (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                stamp TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )""",
+          """CREATE TABLE IF NOT EXISTS cache_tags (
+                tag TEXT NOT NULL,
+                key TEXT NOT NULL,
+                PRIMARY KEY (tag, key)
+            ) WITHOUT ROWID""",
+          "CREATE INDEX IF NOT EXISTS idx_cache_tags_key ON cache_tags (key)",
+          "CREATE INDEX IF NOT EXISTS idx_cache_entries_last_used ON cache_entries (last_used)")
+
+class SharedCache:
+    """A TTL + tag cache in a SQLite file, safe to use from many processes and threads."""
+    def __init__(self, db_name, path=SHARED_CACHE_DB, max_bytes=SHARED_CACHE_BYTES):
+        self.path = path or os.path.splitext(db_name)[0] + '_cache.db'
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+
+    def _conn(self):
+        # One connection per thread, reopened after a fork.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = OFF")  # losing the cache in a crash is fine
+            for statement in SCHEMA:
+                conn.execute(statement)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _count(self, name, result):
+        metrics.registry.inc('library_shared_cache_requests_total', {'cache': name, 'result': result})
+
+    def get(self, key, stamp='', name='default'):
+        """Returns the cached value, or None on a miss, an expired entry or a stamp mismatch."""
+        now = time.time()
+        try:
+            conn = self._conn()
+            row = conn.execute("SELECT value, stamp, expires_at, last_used FROM cache_entries WHERE key = ?",
+                               (key,)).fetchone()
+            if row is None:
+                self._count(name, 'miss')
+                return None
+            value, stored_stamp, expires_at, last_used = row
+            if stored_stamp != stamp or expires_at <= now:
+                self._count(name, 'stale')
+                return None
+            if now - last_used > TOUCH_INTERVAL:
+                conn.execute("UPDATE cache_entries SET last_used = ? WHERE key = ?", (now, key))
+        except sqlite3.Error:
+            self._count(name, 'error')
+            return None
+        self._count(name, 'hit')
+        return json.loads(value)
+
+    def set(self, key, value, ttl, tags=(), stamp=''):
+        """Stores a JSON-serializable value for ttl seconds under the given tags."""
+        data = json.dumps(value, separators=(',', ':'))
+        now = time.time()
+        try:
+            conn = self._conn()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute("""INSERT OR REPLACE INTO cache_entries (key, value, stamp, size, expires_at, last_used)
+                                VALUES (?, ?, ?, ?, ?, ?)""", (key, data, stamp, len(data), now + ttl, now))
+                conn.execute("DELETE FROM cache_tags WHERE key = ?", (key,))
+                conn.executemany("INSERT INTO cache_tags (tag, key) VALUES (?, ?)", [(tag, key) for tag in set(tags)])
+                self._evict(conn, now)
+        except sqlite3.Error:
+            pass  # someone else holds the lock; the next request stores it
+
+    def _evict(self, conn, now):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache_entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        victims = conn.execute("SELECT key, size FROM cache_entries ORDER BY expires_at > ?, last_used",
+                               (now,)).fetchall()
+        for key, size in victims:
+            if total <= self.max_bytes:
+                break
+            self._delete(conn, [key])
+            total -= size
+            evicted += 1
+        metrics.registry.inc('library_shared_cache_evictions_total', {}, evicted)
+
+    def _delete(self, conn, keys):
+        for key in keys:
+            conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+            conn.execute("DELETE FROM cache_tags WHERE key = ?", (key,))
+
+    def invalidate(self, *tags):
+        """Drops every entry carrying any of the given tags."""
+        try:
+            conn = self._conn()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                keys = [row[0] for row in conn.execute(
+                    f"SELECT DISTINCT key FROM cache_tags WHERE tag IN ({', '.join('?' * len(tags))})", tags)]
+                self._delete(conn, keys)
+        except sqlite3.Error:
+            pass  # entries are still stamped and expire on their own
+
+    def clear(self):
+        try:
+            conn = self._conn()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute("DELETE FROM cache_entries")
+                conn.execute("DELETE FROM cache_tags")
+        except sqlite3.Error:
+            pass
+
+    def stats(self):
+        """Entry count and stored bytes, for the status API."""
+        conn = self._conn()
+        entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries").fetchone()
+        return {'entries': entries, 'bytes': size, 'max_bytes': self.max_bytes, 'path': self.path}
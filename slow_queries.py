@@ -0,0 +1,186 @@
+"""Slow-query log.
+
+Any statement that takes longer than SLOW_QUERY_MS is queued here with its
+normalized SQL, the shapes of its parameters (types and lengths, never the
+values), its duration and the route that ran it. A background thread per
+worker process captures the EXPLAIN QUERY PLAN and appends the entry to a
+side SQLite database (SLOW_QUERY_DB, by default library_slow_queries.db
+next to the library database), keeping the newest SLOW_QUERY_KEEP
+entries. Request threads never wait on it: if the queue is full, the entry
+is dropped and counted.
+
+    SLOW_QUERY_MS=50 gunicorn app:app      # log statements slower than 50 ms
+    SLOW_QUERY_MS=0  gunicorn app:app      # disable the log
+
+The report at /slow_queries groups the log by statement, worst total first.
+"""
+import os
+import queue
+import sqlite3
+import time
+
+import metrics
+from process_threads import ProcessThreads, start_daemon
+
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+SLOW_QUERY_DB = os.environ.get('SLOW_QUERY_DB')
+SLOW_QUERY_KEEP = int(os.environ.get('SLOW_QUERY_KEEP', 10000))
+QUEUE_SIZE = 1000
+
+SCHEMA = """CREATE TABLE IF NOT EXISTS slow_queries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    logged_at TEXT NOT NULL,
+    route TEXT NOT NULL,
+    statement TEXT NOT NULL,
+    param_shapes TEXT NOT NULL,
+    duration_ms REAL NOT NULL,
+    query_plan TEXT
+)"""
+INDEX = "CREATE INDEX IF NOT EXISTS idx_slow_queries_statement ON slow_queries (statement, id)"
+EXPLAINED = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE')
+
+def value_shape(value):
+    if value is None:
+        return 'null'
+    if isinstance(value, (bool, int)):
+        return 'int'
+    if isinstance(value, float):
+        return 'real'
+    if isinstance(value, str):
+        return f'text({len(value)})'
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f'blob({len(value)})'
+    return type(value).__name__
+
+def param_shapes(params):
+    """Describes bound parameters without their values, e.g. 'int, text(12)'."""
+    if params is None:
+        return '(executemany)'
+    if isinstance(params, dict):
+        return ', '.join(f':{name} {value_shape(value)}' for name, value in params.items())
+    return ', '.join(value_shape(value) for value in params)
+
+def format_plan(rows):
+    """Indents EXPLAIN QUERY PLAN rows (id, parent, notused, detail) as a tree."""
+    depth = {0: -1}
+    lines = []
+    for node, parent, _, detail in rows:
+        depth[node] = depth.get(parent, -1) + 1
+        lines.append('  ' * depth[node] + detail)
+    return '\n'.join(lines)
+
+def capture_plan(conn, sql, params):
+    if sql.lstrip().split(None, 1)[0].upper() not in EXPLAINED:
+        return None
+    if params is None:
+        params = (None,) * sql.count('?')
+    try:
+        return format_plan(conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall())
+    except sqlite3.Error as e:
+        return f"(plan unavailable: {e})"
+
+class SlowQueryLog:
+    """Queues slow statements and writes them from one background thread per process.
+
+    prepare, if given, is called with the connection plans are captured on,
+    to attach the databases and create the views the statements refer to.
+    """
+    def __init__(self, db_name, path=SLOW_QUERY_DB, threshold_ms=SLOW_QUERY_MS, keep=SLOW_QUERY_KEEP, prepare=None):
+        self.db_name = db_name
+        self.prepare = prepare
+        self.path = path or os.path.splitext(db_name)[0] + '_slow_queries.db'
+        self.threshold = threshold_ms / 1000
+        self.keep = keep
+        self._writer = ProcessThreads(self._start_writer)
+        self._queue = None
+        self.dropped = 0
+
+    @property
+    def enabled(self):
+        return self.threshold > 0
+
+    def _start_writer(self):
+        self._queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.dropped = 0
+        start_daemon(self._run, 'slow-query-log')
+
+    def record(self, sql, params, seconds, route):
+        """Queues the statement if it was slow. Never blocks."""
+        if not self.enabled or seconds < self.threshold:
+            return
+        self._writer.ensure()
+        entry = (time.strftime('%Y-%m-%d %H:%M:%S'), route, sql, params, seconds)
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute(SCHEMA)
+        conn.execute(INDEX)
+        return conn
+
+    def _run(self):
+        log = self.connect()
+        # Plain connection: plan capture must not be timed and logged itself.
+        source = sqlite3.connect(f"file:{self.db_name}?mode=ro", uri=True, check_same_thread=False)
+        if self.prepare:
+            try:
+                self.prepare(source)
+            except sqlite3.Error:
+                pass  # plans that need it show as unavailable
+        while True:
+            entries = [self._queue.get()]
+            while True:
+                try:
+                    entries.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(log, source, entries)
+            except sqlite3.Error:
+                pass  # the log is best-effort; the next batch tries again
+
+    def _write(self, log, source, entries):
+        rows = [(logged_at, route, metrics.normalize_sql(sql), param_shapes(params),
+                 round(seconds * 1000, 3), capture_plan(source, sql, params))
+                for logged_at, route, sql, params, seconds in entries]
+        with log:
+            log.executemany("""INSERT INTO slow_queries
+                (logged_at, route, statement, param_shapes, duration_ms, query_plan)
+                VALUES (?, ?, ?, ?, ?, ?)""", rows)
+            newest = log.execute("SELECT MAX(id) FROM slow_queries").fetchone()[0]
+            log.execute("DELETE FROM slow_queries WHERE id <= ?", (newest - self.keep,))
+
+    def report(self, limit=50):
+        """Top statements by total time, with their latest plan and parameter shapes."""
+        if not os.path.exists(self.path):
+            return []
+        log = self.connect()
+        try:
+            return log.execute("""
+                SELECT s.statement, COUNT(*) AS calls,
+                       ROUND(SUM(s.duration_ms), 1) AS total_ms,
+                       ROUND(AVG(s.duration_ms), 1) AS avg_ms,
+                       ROUND(MAX(s.duration_ms), 1) AS max_ms,
+                       GROUP_CONCAT(DISTINCT s.route) AS routes,
+                       MAX(s.logged_at) AS last_seen,
+                       latest.param_shapes, latest.query_plan
+                FROM slow_queries s
+                JOIN slow_queries latest ON latest.id = (
+                    SELECT MAX(id) FROM slow_queries WHERE statement = s.statement)
+                GROUP BY s.statement
+                ORDER BY total_ms DESC
+                LIMIT ?""", (limit,)).fetchall()
+        finally:
+            log.close()
+
+    def clear(self):
+        if os.path.exists(self.path):
+            log = self.connect()
+            with log:
+                log.execute("DELETE FROM slow_queries")
+            log.close()
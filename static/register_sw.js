@@ -0,0 +1,13 @@
+// Registers the site-wide service worker (served from /sw.js so it controls every page).
+if ('serviceWorker' in navigator) {
+    window.addEventListener('load', () => {
+        // Earlier releases registered /static/sw.js, which only covered /static/.
+        navigator.serviceWorker.getRegistrations().then(registrations => {
+            registrations
+                .filter(registration => registration.active && registration.active.scriptURL.endsWith('/static/sw.js'))
+                .forEach(registration => registration.unregister());
+        });
+        navigator.serviceWorker.register('/sw.js', { scope: '/' })
+            .catch(err => console.log('ServiceWorker registration failed: ', err));
+    });
+}
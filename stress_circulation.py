@@ -0,0 +1,167 @@
+"""Concurrency stress check for issue/return.
+
+Starts several processes, each with several threads, that issue and return
+a small shared pool of books as fast as they can through the real routes
+(the single-book forms and the batch circulation API). The books are few
+on purpose so desks keep colliding. Runs against a scratch database and
+then checks that no copy was ever issued twice and that every write the
+clients saw as successful is in the database.
+
+    python stress_circulation.py                     # 4 processes x 4 threads
+    python stress_circulation.py --processes 8 --threads 8 --ops 300
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+BOOKS = 12
+
+def desk(library, student_adm, ops, seed, totals, lock):
+    """One circulation desk: a client issuing and returning for one student."""
+    rng = random.Random(seed)
+    client = library.app.test_client()
+    client.post('/librarian_login', data={'username': library.LIBRARIAN_USERNAME, 'password': library.LIBRARIAN_PASSWORD})
+    held = set()
+    counts = {'issued': 0, 'returned': 0, 'rejected': 0, 'errors': 0}
+
+    for _ in range(ops):
+        if held and rng.random() < 0.5:
+            action, books = 'return', [rng.choice(sorted(held))]
+        else:
+            action, books = 'issue', [f"ST{rng.randrange(BOOKS)}"]
+        if rng.random() < 0.3:
+            books += [f"ST{rng.randrange(BOOKS)}" for _ in range(2)]
+
+        if len(books) == 1:
+            form = {'book_id': books[0], 'admission_no': student_adm, 'loan_period': '14'}
+            page = client.post('/issue' if action == 'issue' else '/return', data=form, follow_redirects=True)
+            text = page.get_data(as_text=True)
+            if re.search(r"Error (issuing|returning) book", text):
+                counts['errors'] += 1
+            elif ' issued to ' in text:
+                counts['issued'] += 1
+                held.add(books[0])
+            elif ' returned by ' in text:
+                counts['returned'] += 1
+                held.discard(books[0])
+            else:
+                counts['rejected'] += 1
+            continue
+
+        response = client.post('/api/circulation', json={'action': action, 'admission_no': student_adm,
+                                                         'book_ids': books, 'loan_period': '14'})
+        if response.status_code >= 500 or response.status_code == 409:
+            counts['errors'] += 1
+            continue
+        for result in response.get_json().get('results', []):
+            if result['status'] == 'error':
+                counts['rejected'] += 1
+            elif result['status'] == 'issued':
+                counts['issued'] += 1
+                held.add(result['book_id'])
+            else:
+                counts['returned'] += 1
+                held.discard(result['book_id'])
+
+    with lock:
+        for key, value in counts.items():
+            totals[key] += value
+
+def run_process(index, threads, ops, queue):
+    """Runs one worker process with a thread per desk; reports its totals."""
+    import app as library
+    totals = {'issued': 0, 'returned': 0, 'rejected': 0, 'errors': 0}
+    lock = threading.Lock()
+    desks = [threading.Thread(target=desk, args=(library, f"SS{index}_{i}", ops, index * 1000 + i, totals, lock))
+             for i in range(threads)]
+    for thread in desks:
+        thread.start()
+    for thread in desks:
+        thread.join()
+    queue.put(totals)
+
+def check(db_path, totals):
+    """Returns a list of invariant violations found in the database."""
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    problems = []
+
+    for row in conn.execute("""SELECT book_id, COUNT(*) AS loans FROM transactions
+                               WHERE return_date IS NULL GROUP BY book_id HAVING COUNT(*) > 1"""):
+        problems.append(f"book {row['book_id']} is on {row['loans']} active loans at once")
+    for row in conn.execute("""SELECT id, available FROM books b
+                               WHERE available != NOT EXISTS (SELECT 1 FROM transactions t
+                                                              WHERE t.book_id = b.id AND t.return_date IS NULL)"""):
+        problems.append(f"book {row['id']} has available={row['available']} but its loans disagree")
+
+    issued = conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+    returned = conn.execute("SELECT COUNT(*) FROM transactions WHERE return_date IS NOT NULL").fetchone()[0]
+    if issued != totals['issued']:
+        problems.append(f"clients saw {totals['issued']} issues succeed, database holds {issued}")
+    if returned != totals['returned']:
+        problems.append(f"clients saw {totals['returned']} returns succeed, database holds {returned}")
+    if totals['errors']:
+        problems.append(f"{totals['errors']} requests failed with a database error")
+
+    from app import attach_archive, verify_borrow_counts
+    attach_archive(conn)
+    for table, rows in verify_borrow_counts(conn.cursor()).items():
+        if rows:
+            problems.append(f"{len(rows)} {table} borrow counters drifted")
+    conn.close()
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--ops', type=int, default=150, help="operations per thread")
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp()
+    os.environ['LIBRARY_DB'] = db_path = os.path.join(scratch, 'stress.db')
+    import app as library
+    with library.get_connection() as conn:
+        conn.executemany("INSERT INTO books (custom_id, name, author) VALUES (?, ?, ?)",
+                         [(f"ST{i}", f"Stress Book {i}", "Load") for i in range(BOOKS)])
+        conn.executemany("INSERT INTO students (admission_no, name, batch) VALUES (?, ?, ?)",
+                         [(f"SS{p}_{t}", f"Desk {p}.{t}", "S") for p in range(args.processes) for t in range(args.threads)])
+    library._pool.dispose()
+
+    # spawn, not fork: each worker imports the app the way a server worker would.
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    workers = [context.Process(target=run_process, args=(i, args.threads, args.ops, queue)) for i in range(args.processes)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    totals = {'issued': 0, 'returned': 0, 'rejected': 0, 'errors': 0}
+    for _ in workers:
+        for key, value in queue.get().items():
+            totals[key] += value
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    requests_made = args.processes * args.threads * args.ops
+    print(f"{args.processes} processes x {args.threads} threads, {requests_made} requests in {elapsed:.1f}s "
+          f"({requests_made / elapsed:.0f} req/s)")
+    print(f"issued {totals['issued']}, returned {totals['returned']}, "
+          f"rejected {totals['rejected']}, errors {totals['errors']}")
+
+    problems = check(db_path, totals)
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    print("-" * 20)
+    print("No double issues or lost writes." if not problems else f"{len(problems)} problem(s) found.")
+    return len(problems)
+
+if __name__ == '__main__':
+    sys.exit(1 if main() else 0)
@@ -0,0 +1,128 @@
+// Rendered by the /sw.js route. VERSION changes with every deploy that
+// touches a template or static file, which installs this worker afresh and
+// lets `activate` delete the caches of the previous version.
+const VERSION = {{ version|tojson }};
+const PRECACHE_URLS = {{ precache|tojson }};
+const OFFLINE_URL = {{ offline_url|tojson }};
+const LOANS_URL = {{ loans_url|tojson }};
+
+const STATIC_CACHE = `library-static-${VERSION}`;
+const DATA_CACHE = `library-data-${VERSION}`;
+
+// JSON the student portal reads; served from cache while refreshed in the background.
+const STALE_WHILE_REVALIDATE = ['/api/student_search', LOANS_URL];
+// Anything cached for one student is dropped when they log out or someone logs in.
+const CLEAR_DATA_ON = ['/student_logout', '/student_login'];
+
+self.addEventListener('install', event => {
+  event.waitUntil(
+    caches.open(STATIC_CACHE)
+      // Pages are precached logged out, so they never hold anyone's data.
+      .then(cache => cache.addAll(PRECACHE_URLS.map(url => new Request(url, { credentials: 'omit' }))))
+      .then(() => refreshLoans())
+      .then(() => self.skipWaiting())
+  );
+});
+
+self.addEventListener('activate', event => {
+  event.waitUntil(
+    caches.keys()
+      .then(names => Promise.all(names
+        .filter(name => name.startsWith('library-') && name !== STATIC_CACHE && name !== DATA_CACHE)
+        .map(name => caches.delete(name))))
+      .then(() => self.clients.claim())
+  );
+});
+
+self.addEventListener('fetch', event => {
+  const request = event.request;
+  const url = new URL(request.url);
+  if (url.origin !== self.location.origin) {
+    return;
+  }
+  if (CLEAR_DATA_ON.includes(url.pathname)) {
+    event.waitUntil(caches.delete(DATA_CACHE));
+    return;
+  }
+  if (request.method !== 'GET') {
+    return;
+  }
+  if (STALE_WHILE_REVALIDATE.includes(url.pathname)) {
+    event.respondWith(staleWhileRevalidate(event));
+  } else if (request.mode === 'navigate') {
+    event.respondWith(networkFirst(event));
+  } else if (url.pathname.startsWith('/static/dist/') || (url.pathname.startsWith('/static/') && url.searchParams.has('v'))) {
+    // Content-hashed assets (and the font files they load) never change under the same URL.
+    event.respondWith(cacheFirst(request));
+  }
+});
+
+async function cacheFirst(request) {
+  const cached = await caches.match(request);
+  if (cached) {
+    return cached;
+  }
+  const response = await fetch(request);
+  if (response.ok) {
+    const cache = await caches.open(STATIC_CACHE);
+    await cache.put(request, response.clone());
+  }
+  return response;
+}
+
+function isCacheableData(response) {
+  return response.ok && !response.redirected &&
+    (response.headers.get('Content-Type') || '').includes('application/json');
+}
+
+async function staleWhileRevalidate(event) {
+  const cache = await caches.open(DATA_CACHE);
+  const cached = await cache.match(event.request);
+  const network = fetch(event.request)
+    .then(response => {
+      if (isCacheableData(response)) {
+        return stamp(response.clone()).then(copy => cache.put(event.request, copy)).then(() => response);
+      }
+      return response;
+    })
+    .catch(() => null);
+  event.waitUntil(network);
+  if (cached) {
+    return cached;
+  }
+  const response = await network;
+  return response || new Response(JSON.stringify({ error: 'You are offline.' }),
+    { status: 503, headers: { 'Content-Type': 'application/json' } });
+}
+
+async function networkFirst(event) {
+  try {
+    const response = await fetch(event.request);
+    if (new URL(event.request.url).pathname === '/student_dashboard' && response.ok && !response.redirected) {
+      event.waitUntil(refreshLoans());
+    }
+    return response;
+  } catch (err) {
+    return (await caches.match(event.request, { ignoreSearch: true })) || caches.match(OFFLINE_URL);
+  }
+}
+
+// Keeps the offline snapshot of the student's active loans current.
+async function refreshLoans() {
+  try {
+    const response = await fetch(LOANS_URL, { credentials: 'same-origin' });
+    if (isCacheableData(response)) {
+      const cache = await caches.open(DATA_CACHE);
+      await cache.put(LOANS_URL, await stamp(response));
+    }
+  } catch (err) {
+    // Offline or logged out: keep whatever snapshot we have.
+  }
+}
+
+// Records when a response was fetched, for the "as of" line on the offline page.
+async function stamp(response) {
+  const headers = new Headers(response.headers);
+  headers.set('X-Fetched-At', new Date().toISOString());
+  return new Response(await response.blob(), { status: response.status, statusText: response.statusText, headers });
+}